@@ -0,0 +1,8 @@
+def extract(odb, cfg, on_progress=None):
+    '''
+    Extract the data requested in a config (dictionary or file) from an odb with an abaqus python worker, receiving
+    the arrays over a pipe rather than through an output file, and return them as odbex.post.simdata.SimulationData.
+    '''
+    # Imported here so that importing odbex.abqpy does not pull in the Python 3 post-processing dependencies
+    from odbex.pipe import extract as _extract
+    return _extract(odb, cfg, on_progress)
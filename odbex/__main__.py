@@ -1,38 +1,303 @@
 import argparse
+import concurrent.futures
+import glob
+import json
+import os
 import pathlib
 import subprocess
-import os
-import signal
-import json
+import sys
+import threading
+import time
+from typing import Callable
+
+from attrs import define, field
+
+from odbex.abqpy import metrics, output
+from odbex.cache import ExtractionCache, temporary_config
 
 PARENT = pathlib.Path(__file__).parent
 EXTRACTOR = PARENT.joinpath('abqpy/__main__.py')
+MAX_LICENSES_ENV = 'ODBEX_MAX_LICENSES'
+MAX_WATCH_RETRIES = 3
+
+@define
+class WorkerResult:
+    odb: str
+    returncode: int
+    elapsed: float
+    output: str = ''
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+@define
+class ProgressDisplay:
+    '''Shows the progress events of abaqus python workers, at most once per interval for each odb (and at the end of each step).'''
+    interval: float = 5.
+    _last: dict[str, float] = field(init=False, factory=dict)
+    _lock: threading.Lock = field(init=False, factory=threading.Lock)
+
+    def __call__(self, event: dict) -> None:
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(event['odb'])
+            if last is not None and now - last < self.interval and event['frame'] < event['frames']: return
+            self._last[event['odb']] = now
+        eta = '' if event['eta'] is None else f', ~{event["eta"]:.0f} s left in step'
+        print(f'{event["odb"]}: {event["step"]} increment {event["increment"]} (frame {event["frame"]} of {event["frames"]}, {event["elapsed"]:.0f} s{eta})')
 
 def _argparse() -> argparse.Namespace:
     parser = argparse.ArgumentParser(prog="odbex")
     parser.add_argument('odb', help='Full or relative path to output database (.odb) file.')
     parser.add_argument('cfg', help='Full or relative path to odbex configuration (odbex_cfg.json) file.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of abaqus python workers to run concurrently (one ODB per worker).')
+    parser.add_argument(
+        '--max-licenses', type=int, default=None,
+        help=f'Upper limit on concurrent abaqus python workers, e.g. the number of Abaqus license tokens available. Defaults to ${MAX_LICENSES_ENV}, if set.'
+    )
+    parser.add_argument(
+        '--shards', type=int, default=1,
+        help='Split the frames of each step into this many contiguous blocks, each extracted by its own worker, and merge the results.'
+    )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='Only extract frames written since the last extraction, appending them to the (streamed) output.'
+    )
+    parser.add_argument(
+        '--watch', type=float, default=None, metavar='SECONDS',
+        help='Poll the .odb/.sta files at this interval and run an incremental extraction whenever they change, until the analysis ends.'
+    )
+    parser.add_argument('--profile', action='store_true', help='Write a cProfile dump of each extraction (PREFIX_ODBNAME.prof) next to its output.')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read from or write to the extraction cache.')
+    parser.add_argument('--refresh', action='store_true', help='Re-extract all requested data, replacing any cached results.')
+    parser.add_argument(
+        '--cache-size', type=float, default=None, metavar='GB',
+        help='Maximum size of the extraction cache, beyond which the least recently used results are evicted. Defaults to $ODBEX_CACHE_SIZE (bytes) or 10 GB.'
+    )
     return parser.parse_args()
 
+def _abaqus_python(*args: str) -> list[str]:
+    return ['abaqus', 'python', EXTRACTOR.as_posix(), *args]
+
+def _run(cmd: list[str], capture: bool = False, on_progress: Callable[[dict], None] | None = None) -> subprocess.CompletedProcess:
+    # The abaqus command is a batch script on Windows, so it has to go through the shell there
+    if on_progress is None:
+        return subprocess.run(cmd, shell=os.name == 'nt', capture_output=capture, text=True)
+    # Read the output line by line, handing progress events to the callback
+    lines = []
+    with subprocess.Popen(cmd, shell=os.name == 'nt', stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1) as p:
+        for line in p.stdout:
+            event = metrics.parse_progress(line)
+            if event is not None: on_progress(event)
+            elif capture: lines.append(line)
+            else: print(line, end='')
+    return subprocess.CompletedProcess(cmd, p.returncode, ''.join(lines), '')
+
+def _num_workers(jobs: int, max_licenses: int | None, num_odbs: int) -> int:
+    if max_licenses is None and MAX_LICENSES_ENV in os.environ:
+        max_licenses = int(os.environ[MAX_LICENSES_ENV])
+    workers = min(jobs, num_odbs)
+    if max_licenses is not None: workers = min(workers, max_licenses)
+    return max(workers, 1)
+
+def _worker_args(
+        odb: str, cfg: str, shard: tuple[int, int] | None = None, incremental: bool = False, profile: bool = False,
+        progress: bool = False
+    ) -> list[str]:
+    args = [odb, cfg]
+    if shard is not None: args += ['--shard', f'{shard[0]}/{shard[1]}']
+    if incremental: args += ['--incremental']
+    if profile: args += ['--profile']
+    if progress: args += ['--progress-events']
+    return args
+
+def _extract_odb(
+        odb: str, cfg: str, shard: tuple[int, int] | None = None, incremental: bool = False, capture: bool = True,
+        profile: bool = False, on_progress: Callable[[dict], None] | None = None
+    ) -> WorkerResult:
+    args = _worker_args(odb, cfg, shard, incremental, profile, progress=on_progress is not None)
+    start = time.perf_counter()
+    p = _run(_abaqus_python(*args), capture=capture, on_progress=on_progress)
+    return WorkerResult(odb, p.returncode, time.perf_counter() - start, (p.stdout or '') + (p.stderr or ''))
+
+def _extract_odb_cached(
+        odb: str, cfg: str, cache: ExtractionCache, refresh: bool = False, capture: bool = True,
+        profile: bool = False, on_progress: Callable[[dict], None] | None = None
+    ) -> WorkerResult:
+    '''Extract only the fields of an odb which are not already cached, then assemble the output from the cache.'''
+    start = time.perf_counter()
+    with open(cfg, 'r') as f:
+        odbex_cfg = json.load(f)
+    if not cache.supports(odbex_cfg): return _extract_odb(odb, cfg, capture=capture, profile=profile, on_progress=on_progress)
+    try:
+        entries = cache.entries(odb, odbex_cfg)
+    except OSError as e:
+        return WorkerResult(odb, 1, 0., f'error: cannot read {odb} ({e})\n')
+    missing = [e for e in entries if refresh or not cache.has(e)]
+    r = WorkerResult(odb, 0, 0., '')
+    if missing:
+        # Extract the missing fields to a temporary output next to the odb and split it into cache entries
+        prefix = f'odbex-cache-{os.getpid()}-{threading.get_ident()}'
+        tmp_cfg = temporary_config(cache.extraction_config(odbex_cfg, missing, prefix))
+        tmp_output = output.output_filepath(odb, prefix)
+        tmp_metrics = output.metrics_filepath(odb, prefix)
+        try:
+            r = _extract_odb(odb, tmp_cfg, capture=capture, profile=profile, on_progress=on_progress)
+            if r.ok:
+                with output.NpzArrays(tmp_output) as extracted:
+                    cache.store(missing, {k: extracted[k] for k in extracted.files})
+        finally:
+            os.remove(tmp_cfg)
+            if os.path.exists(tmp_output): os.remove(tmp_output)
+            # Metrics (and profile) of extracting the missing fields belong to the requested output
+            for tmp, ext in ((tmp_metrics, '.metrics.json'), (output.output_filepath(odb, prefix, ext='.prof'), '.prof')):
+                if os.path.exists(tmp): os.replace(tmp, output.output_filepath(odb, odbex_cfg.get('export_prefix'), ext=ext))
+        if not r.ok: return r
+    cache.assemble(entries, output.open_writer(odb, odbex_cfg))
+    cache.evict()
+    r.output += f'{len(entries) - len(missing)} of {len(entries)} requested fields read from cache\n'
+    r.elapsed = time.perf_counter() - start
+    return r
+
+def _merge_shards(odb: str, cfg: str, shard_results: list[WorkerResult]) -> WorkerResult:
+    result = WorkerResult(
+        odb, max(r.returncode for r in shard_results), max(r.elapsed for r in shard_results),
+        ''.join(r.output for r in shard_results)
+    )
+    with open(cfg, 'r') as f:
+        odbex_cfg = json.load(f)
+    filepath = output.output_filepath(odb, odbex_cfg.get('export_prefix'))
+    num_shards = len(shard_results)
+    shard_filepaths = [output.shard_filepath(filepath, i, num_shards) for i in range(num_shards)]
+    try:
+        if result.ok: output.merge_shards(shard_filepaths, output.open_writer(odb, odbex_cfg))
+    except Exception as e:
+        result.returncode, result.output = 1, result.output + f'error: merging shards of {odb} failed ({e})\n'
+    for fp in shard_filepaths:
+        if os.path.exists(fp): os.remove(fp)
+
+    # Combine the metrics of the shards
+    metrics_filepath = output.metrics_filepath(odb, odbex_cfg.get('export_prefix'))
+    shard_metrics = []
+    for fp in [output.shard_filepath(metrics_filepath, i, num_shards) for i in range(num_shards)]:
+        if not os.path.exists(fp): continue
+        with open(fp, 'r') as f:
+            shard_metrics.append(json.load(f))
+        os.remove(fp)
+    if shard_metrics:
+        with open(metrics_filepath, 'w') as f:
+            json.dump(metrics.combine(shard_metrics), f, indent=1, sort_keys=True)
+    return result
+
+def _print_summary(results: list[WorkerResult]) -> None:
+    failed = [r for r in results if not r.ok]
+    print(f'extraction summary: {len(results) - len(failed)} of {len(results)} odbs succeeded')
+    for r in sorted(results, key=lambda r: r.odb):
+        print(f'-> {"ok" if r.ok else "FAILED"} {r.odb} ({r.elapsed:.1f} s)')
+
+def extract_batch(
+        odbs: list[str], cfg: str, workers: int, num_shards: int = 1, incremental: bool = False,
+        cache: ExtractionCache | None = None, refresh: bool = False, profile: bool = False
+    ) -> list[WorkerResult]:
+    results = []
+    capture = workers > 1  # Output of concurrent workers would be interleaved
+    kwargs = {'capture': capture, 'profile': profile, 'on_progress': ProgressDisplay(5. if capture else 0.)}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        if num_shards > 1:
+            futures = {pool.submit(_extract_odb, odb, cfg, (i, num_shards), **kwargs): (odb, i) for odb in odbs for i in range(num_shards)}
+        elif cache is not None:
+            futures = {pool.submit(_extract_odb_cached, odb, cfg, cache, refresh, **kwargs): (odb, 0) for odb in odbs}
+        else:
+            futures = {pool.submit(_extract_odb, odb, cfg, incremental=incremental, **kwargs): (odb, 0) for odb in odbs}
+        shard_results = {odb: [None]*num_shards for odb in odbs}
+        for future in concurrent.futures.as_completed(futures):
+            odb, shard = futures[future]
+            try:
+                shard_results[odb][shard] = future.result()
+            except Exception as e:
+                # e.g. a cached entry evicted by a concurrent run while assembling, which must not stop the other odbs
+                shard_results[odb][shard] = WorkerResult(odb, 1, 0., f'error: extracting {odb} failed ({type(e).__name__}: {e})\n')
+            if any(r is None for r in shard_results[odb]): continue
+
+            # All shards of the odb are done, merge them into a single output
+            r = _merge_shards(odb, cfg, shard_results[odb]) if num_shards > 1 else shard_results[odb][0]
+            results.append(r)
+            print(f'[{len(results)}/{len(odbs)}] {"ok" if r.ok else "FAILED"} {r.odb} ({r.elapsed:.1f} s)')
+            if not r.ok and capture: print(r.output, file=sys.stderr)
+    return results
+
+def _analysis_ended(odb: str) -> bool:
+    sta = pathlib.Path(odb).with_suffix('.sta')
+    if not sta.exists(): return False
+    status = sta.read_text(errors='ignore')[-500:]
+    return 'HAS COMPLETED' in status or 'HAS NOT BEEN COMPLETED' in status
+
+def _modified_time(odb: str) -> float:
+    files = [pathlib.Path(odb), pathlib.Path(odb).with_suffix('.sta')]
+    return max(f.stat().st_mtime for f in files if f.exists())
+
+def watch(odbs: list[str], cfg: str, interval: float) -> None:
+    '''Incrementally extract the odbs of running jobs whenever their .odb/.sta files change, until every analysis has ended.'''
+    last_modified = {odb: None for odb in odbs}
+    failures = {odb: 0 for odb in odbs}
+    while last_modified:
+        for odb in list(last_modified):
+            if not os.path.exists(odb): continue
+            ended = _analysis_ended(odb)
+            modified = _modified_time(odb)
+            if modified != last_modified[odb]:
+                r = _extract_odb(odb, cfg, incremental=True)
+                print(f'{time.strftime("%H:%M:%S")} {"updated" if r.ok else "FAILED"} {odb} ({r.elapsed:.1f} s)')
+                if not r.ok: print(r.output, file=sys.stderr)
+                # A failed update is retried on the next polls, up to MAX_WATCH_RETRIES times before waiting for the files to change again
+                failures[odb] = 0 if r.ok else failures[odb] + 1
+                if r.ok or failures[odb] > MAX_WATCH_RETRIES:
+                    if not r.ok: print(f'giving up on updating {odb} until it changes again', file=sys.stderr)
+                    last_modified[odb], failures[odb] = modified, 0
+            # One last update once the analysis has ended
+            if ended and modified == last_modified[odb]:
+                print(f'analysis of {odb} has ended, no longer watching')
+                del last_modified[odb]
+        if last_modified: time.sleep(interval)
+
 def main() -> None:
     args = _argparse()
 
-    # # Get config and set up extraction data directory
-    # with open(args.cfg, 'r') as f:
-    #     odbex_cfg = json.load(f)
-    # data_dir = pathlib.Path(odbex_cfg['export'])
-    # if not data_dir.exists(): data_dir.mkdir()
-
-    p = subprocess.run(['abaqus', 'python', EXTRACTOR.as_posix(), args.odb, args.cfg], check=True, shell=True)
-    # p = subprocess.run(args=['abaqus', 'python', EXTRACTOR.as_posix(), '-h'], check=True, capture_output=True, text=True, shell=True)
-    # p = subprocess.Popen(['abaqus', 'python', EXTRACTOR.as_posix(), args.odb, args.cfg], preexec_fn=os.setsid)
-    # while True:
-    #     if p.poll() is not None:
-    #         break
-    #     try:
-    #         p.wait()
-    #     except KeyboardInterrupt:
-    #         os.killpg(os.getpgid(p.pid), signal.SIGTERM)     
+    odbs = sorted(glob.glob(args.odb)) if '*' in args.odb else [args.odb]
+    # Shards are always merged into a new output, which incremental extractions would have to append to instead
+    if args.shards > 1 and (args.incremental or args.watch is not None):
+        sys.exit('error: incremental extractions (--incremental, --watch) cannot be combined with --shards')
+    if args.watch is not None:
+        try:
+            watch(odbs, args.cfg, args.watch)
+        except KeyboardInterrupt:
+            print('stopped watching')
+        return
+
+    # Cached results are only used for regular (unsharded, non-incremental) extractions
+    cache = None
+    if not (args.no_cache or args.incremental or args.shards > 1):
+        cache = ExtractionCache.from_env(None if args.cache_size is None else int(args.cache_size*1024**3))
+
+    # Single worker: let the abaqus python process handle the wildcard and stream its output
+    if args.jobs <= 1 and args.shards <= 1 and cache is None:
+        worker_args = _worker_args(args.odb, args.cfg, incremental=args.incremental, profile=args.profile, progress=True)
+        p = _run(_abaqus_python(*worker_args), on_progress=ProgressDisplay(0.))
+        sys.exit(p.returncode)
+
+    if not odbs:
+        sys.exit(f'error: no odbs found matching {args.odb}')
+    # Sharding without an explicit number of jobs runs all shards of an odb at once
+    num_shards = max(args.shards, 1)
+    jobs = args.jobs if args.jobs > 1 else num_shards
+    workers = _num_workers(jobs, args.max_licenses, len(odbs)*num_shards)
+    print(f'extracting {len(odbs)} odbs ({num_shards} shard(s) each) with {workers} concurrent abaqus python workers')
+    results = extract_batch(
+        odbs, args.cfg, workers, num_shards, incremental=args.incremental, cache=cache, refresh=args.refresh, profile=args.profile
+    )
+    _print_summary(results)
+    if any(not r.ok for r in results): sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,17 +1,62 @@
 import os
 import sys
 import glob
+import traceback
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import argparse
 
-from abqpy import extractor, _json
+from abqpy import extractor, framing, metrics, _json
 
 def _argparse():
     # type: () -> argparse.Namespace
     parser = argparse.ArgumentParser()
     parser.add_argument('odb', default=None)
     parser.add_argument('cfg', default=None)
+    parser.add_argument('--shard', default=None, help='Extract only one contiguous block of frames, given as INDEX/COUNT (e.g., 0/4).')
+    parser.add_argument('--incremental', action='store_true', help='Only extract frames written since the last extraction, appending them to the streamed output.')
+    parser.add_argument('--profile', action='store_true', help='Write a cProfile dump of the extraction next to the output.')
+    parser.add_argument('--progress-events', action='store_true', help='Report progress as JSON events, for the odbex wrapper.')
+    parser.add_argument('--pipe', action='store_true', help='Send the extracted arrays to stdout rather than writing a file, for odbex.extract.')
     return parser.parse_args()
+
+def _parse_shard(shard):
+    # type: (str | None) -> tuple[int, int] | None
+    if shard is None: return None
+    index, count = [int(s) for s in shard.split('/')]
+    return index, count
+
+def _binary_stdout():
+    # type: () -> BinaryIO
+    '''Binary stream of the original stdout, which the extracted arrays are written to while printed output goes to stderr.'''
+    fd = os.dup(sys.stdout.fileno())
+    if os.name == 'nt':
+        import msvcrt
+        msvcrt.setmode(fd, os.O_BINARY)
+    sys.stdout.flush()
+    sys.stdout = sys.stderr
+    return os.fdopen(fd, 'wb')
+
+def _pipe(odb, odbex_cfg):
+    # type: (str, dict) -> int
+    '''Extract an odb into memory and send its arrays (framed as in abqpy.framing) to stdout.'''
+    stream = _binary_stdout()
+    arrays = None
+    try:
+        arrays, extraction_metrics = extractor.extract_arrays(odb, odbex_cfg)
+        header = {'ok': True, 'metrics': extraction_metrics.to_dict()}
+    except Exception as e:
+        traceback.print_exc()
+        header = {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+    stream.write(framing.MARKER)
+    framing.write_message(stream, header, arrays)
+    stream.close()
+    return 0 if header['ok'] else 1
+
+def _print_summary(odbs, failed):
+    # type: (list[str], list[str]) -> None
+    print('extraction summary: {} of {} odbs succeeded'.format(len(odbs) - len(failed), len(odbs)))
+    for odb in odbs:
+        print('-> {} {}'.format('FAILED' if odb in failed else 'ok', odb))
     
 def main():
     # type: () -> None
@@ -19,6 +64,11 @@ def main():
     
     # Load configuration settings for the extraction
     odbex_cfg = _json.load_json_py2(args.cfg)
+    shard = _parse_shard(args.shard)
+    metrics.emit_progress_events(args.progress_events)
+    if args.pipe:
+        if '*' in args.odb: sys.exit('error: arrays of a single odb only can be sent to stdout')
+        sys.exit(_pipe(args.odb, odbex_cfg))
 
     # Wildcard option
     if '*' in args.odb:
@@ -26,9 +76,17 @@ def main():
     else:
         odbs = [args.odb]
         
-    # Call extractor
+    # Call extractor, continuing on to the next odb if one fails
+    failed = []
     for odb in odbs:
-        extractor.extract(odb, odbex_cfg)
+        try:
+            extractor.extract(odb, odbex_cfg, shard=shard, incremental=args.incremental, profile=args.profile)
+        except Exception as e:
+            traceback.print_exc()
+            print('error: extraction from {} failed ({}). continuing to next odb...'.format(odb, e))
+            failed.append(odb)
+    if len(odbs) > 1: _print_summary(odbs, failed)
+    if failed: sys.exit(1)
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
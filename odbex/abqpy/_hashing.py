@@ -0,0 +1,28 @@
+"""
+Fingerprints of odb files and hashes of extraction definitions, used to key cached results.
+Standard library only, so that it can be imported from either interpreter.
+"""
+import hashlib
+import json
+import os
+
+# Bytes read from each end of the odb for its fingerprint
+SAMPLE_SIZE = 1 << 20
+
+def odb_fingerprint(odb_filepath, sample_size=SAMPLE_SIZE):
+    # type: (str, int) -> str
+    """Fingerprint of an odb from its absolute path, size, modification time and the bytes at either end of the file."""
+    stat = os.stat(odb_filepath)
+    h = hashlib.sha1()
+    h.update('{}|{}|{}'.format(os.path.abspath(odb_filepath), stat.st_size, int(stat.st_mtime)).encode('utf-8'))
+    with open(odb_filepath, 'rb') as f:
+        h.update(f.read(sample_size))
+        if stat.st_size > sample_size:
+            f.seek(max(stat.st_size - sample_size, sample_size))
+            h.update(f.read(sample_size))
+    return h.hexdigest()
+
+def config_hash(obj):
+    # type: (Any) -> str
+    """Hash of a json-serializable object which does not depend on the order of dictionary keys."""
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
@@ -11,6 +11,10 @@ def load_json_py2(filepath):
             ignore_dicts=True
         )
 
+def byteify(data):
+    """Convert the unicode strings of already decoded json (e.g., a request to the extraction server) to str, as load_json_py2 does."""
+    return _byteify(data)
+
 def _byteify(data, ignore_dicts = False):
     if isinstance(data, str):
         return data
@@ -0,0 +1,108 @@
+"""
+Derived fields defined in the extraction config as arithmetic expressions of field components,
+e.g. {"derived": {"SSUM": "S11 + S22", "DMGS": "SDEG*SMISES"}}.
+Expressions are parsed and checked once, then evaluated with numpy on the bulk data of each frame.
+"""
+import ast
+import numbers
+
+import numpy as np
+
+from . import tensors
+
+FUNCTIONS = {
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'minimum': np.minimum,
+    'maximum': np.maximum,
+    'where': np.where,
+}
+
+_CONSTANT = getattr(ast, 'Constant', None) or ast.Num
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load, _CONSTANT,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+    ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+class DerivedField(object):
+    __slots__ = ("name", "expression", "names", "sources", "_code",)
+
+    def __init__(self, name, expression):
+        # type: (str, str) -> None
+        self.name = name
+        self.expression = expression
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ValueError('invalid expression for derived field {}: {} ({})'.format(name, expression, e))
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise ValueError('unsupported operation {} in expression for derived field {}: {}'.format(
+                    type(node).__name__, name, expression
+                ))
+            if isinstance(node, _CONSTANT) and not _is_number(node):
+                raise ValueError('only numeric constants can be used in expression for derived field {}: {}'.format(name, expression))
+            if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS):
+                raise ValueError('only the functions {} can be called in expression for derived field {}: {}'.format(
+                    ', '.join(sorted(FUNCTIONS)), name, expression
+                ))
+        self.names = sorted(set(
+            node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id not in FUNCTIONS
+        ))
+        self.sources = None
+        self._code = compile(tree, '<derived field {}>'.format(name), 'eval')
+
+    def __repr__(self):
+        # type: () -> str
+        return 'DerivedField(name={}, expression={})'.format(self.name, self.expression)
+
+    def resolve(self, field_names, get_components):
+        # type: (list[str], Callable[[str], list[str]]) -> dict[str, str]
+        '''
+        Map each component label used in the expression to the field output it belongs to,
+        checking it against the component labels of the field (and the invariants that can be computed from them).
+        Only done once; the mapping is reused for all following frames.
+        '''
+        if self.sources is not None: return self.sources
+        sources = {}
+        for label in self.names:
+            # Longest field name first, so that e.g. LE11 resolves to LE rather than E
+            for field_name in sorted([f for f in field_names if label.startswith(f)], key=len, reverse=True):
+                components = list(get_components(field_name)) or [field_name]
+                if _is_tensor(components): components += tensors.invariant_labels(field_name, tensors.INVARIANTS)
+                if label in components:
+                    sources[label] = field_name
+                    break
+            else:
+                raise ValueError('{} in expression for derived field {} is not a component of any field output available in the odb'.format(
+                    label, self.name
+                ))
+        self.sources = sources
+        return sources
+
+    def evaluate(self, columns, num_rows):
+        # type: (dict[str, np.ndarray], int) -> np.ndarray
+        '''Evaluate the expression on 1D arrays of component values, returning an (num_rows, 1) array.'''
+        namespace = dict(FUNCTIONS)
+        namespace.update(columns)
+        result = np.asarray(eval(self._code, {'__builtins__': {}}, namespace), dtype=float)
+        if result.ndim == 0: result = np.full(num_rows, float(result))
+        return result.reshape(num_rows, 1)
+
+def _is_number(node):
+    # type: (ast.AST) -> bool
+    value = node.value if hasattr(node, 'value') else node.n
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+def _is_tensor(components):
+    # type: (list[str]) -> bool
+    return any(c[-2:] == '11' for c in components)
+
+def parse_derived(derived_definitions):
+    # type: (dict[str, str] | None) -> dict[str, DerivedField]
+    '''Parse the "derived" section of the extraction config into DerivedField objects keyed by name.'''
+    if not derived_definitions: return {}
+    return dict((name, DerivedField(name, expression)) for name, expression in derived_definitions.items())
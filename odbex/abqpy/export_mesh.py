@@ -0,0 +1,8 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from abqpy import geometry
+
+if __name__ == '__main__':
+    geometry.main()
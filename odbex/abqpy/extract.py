@@ -5,6 +5,8 @@ import numpy as np
 from odbAccess import openOdb
 import abaqusConstants as abqconst
 
+from . import tensors, timegrid
+
 def _repr(instance, class_dict):
     # type: (Any, dict) -> str
     return "{}({})".format(instance.__class__.__name__, ", ".join(["{}={}".format(attr, val) for attr, val in class_dict.items()]))
@@ -18,6 +20,7 @@ def _build_subset_definitions(config_field_request, odb_handler):
             "mesh_type": subset["mesh_type"],
             "mesh_id": mid,
             "field_vars": subset["fields"],
+            "invariants": subset.get("invariants"),
         }
         for subset in config_field_request["region_subsets"] for mid in subset["mesh_ids"]
     ]
@@ -34,21 +37,27 @@ def field_requests_from_config(config_field_requests, odb_handler):
         # model_region = odb_handler.get_model_region(request["region_type"], request["region_name"])
         subset_defintions = _build_subset_definitions(cfr, odb_handler)
         mesh_subsets = [MeshSubset.from_subset_definition(odb_handler=odb_handler, **sd) for sd in subset_defintions]
-        field_requests += [FieldRequest(ms, sd["field_vars"]) for ms, sd in zip(mesh_subsets, subset_defintions)]
+        field_requests += [FieldRequest(ms, sd["field_vars"], sd["invariants"]) for ms, sd in zip(mesh_subsets, subset_defintions)]
     return field_requests
 
 class MeshSubset(object):
-    __slots__ = ("mesh", "type", "id",)
+    __slots__ = ("mesh", "type", "id", "region_name",)
     
-    def __init__(self, mesh, mesh_type, mesh_id):
-        # type: (list[OdbMeshNode] | list[OdbMeshElement] | OdbSet, str, str) -> None
+    def __init__(self, mesh, mesh_type, mesh_id, region_name=None):
+        # type: (list[OdbMeshNode] | list[OdbMeshElement] | OdbSet, str, str, str | None) -> None
         self.mesh = mesh
         self.type = mesh_type
         self.id = mesh_id
+        self.region_name = region_name
         
     def __repr__(self):
         # type: () -> str
-        return _repr(self, {"mesh": "...", "type": self.type, "id": self.id})
+        return _repr(self, {"mesh": "...", "type": self.type, "id": self.id, "region_name": self.region_name})
+
+    @property
+    def key(self):
+        # type: () -> tuple
+        return (self.region_name, self.type, self.id)
         
     @classmethod
     def from_subset_definition(cls, model_region, mesh_type, mesh_id, odb_handler, **kwargs):
@@ -57,61 +66,77 @@ class MeshSubset(object):
             mesh_subset = odb_handler.get_mesh_items_by_label(mesh_type, model_region, mesh_id)
         else:
             mesh_subset = odb_handler.get_mesh_items_by_set_name(mesh_type, model_region, mesh_id)
-        return cls(mesh_subset, mesh_type, mesh_id)
+        return cls(mesh_subset, mesh_type, mesh_id, model_region.name)
     
 class FieldRequest(object):
-    __slots__ = ("mesh_subset", "field_vars",)
+    __slots__ = ("mesh_subset", "field_vars", "invariants",)
     
-    def __init__(self, mesh_subset, field_vars):
-        # type: (MeshSubset, list[str]) -> FieldRequest
+    def __init__(self, mesh_subset, field_vars, invariants=None):
+        # type: (MeshSubset, list[str], dict[str, list[str]] | None) -> FieldRequest
         self.mesh_subset = mesh_subset
         self.field_vars = field_vars
+        if isinstance(invariants, (list, tuple)):
+            invariants = dict((f, invariants) for f in field_vars if f in tensors.TENSOR_FIELDS)
+        self.invariants = invariants if invariants is not None else {}
+        
+    def field_invariants(self, field):
+        # type: (str) -> tuple[str, ...]
+        return tuple(self.invariants.get(field, tensors.default_invariants(field)))
         
     def __repr__(self):
         # type: () -> str
-        return _repr(self, {"mesh_subset": self.mesh_subset, "field_vars": self.field_vars})
+        return _repr(self, {"mesh_subset": self.mesh_subset, "field_vars": self.field_vars, "invariants": self.invariants})
 
 class FieldDataExtractor:
-    def __init__(self, mesh_subset, field, frames):
-        # type: (list[OdbMeshNode] | list[OdbMeshElement] | OdbSet, str, list[OdbFrame]) -> FieldDataExtractor
+    def __init__(self, mesh_subset, field, frames, invariants=None, component_labels=None):
+        # type: (list[OdbMeshNode] | list[OdbMeshElement] | OdbSet, str, list[OdbFrame], tuple[str, ...] | None, tuple[str, ...] | None) -> FieldDataExtractor
         self.mesh_subset = mesh_subset
         self.field = field
-        self.components = self._get_field_components(frames[0])
+        self.invariants = invariants if invariants is not None else tensors.default_invariants(field)
+        self.tensor_components = ()
+        self.components = self._get_field_components(frames[0], component_labels)
         self.frames = frames
         self.field_data = []
     
-    def _get_field_components(self, ini_frame, maxprinc=True):
-        # type: (OdbFrame, bool) -> tuple[str, ...]
-        components = ini_frame.fieldOutputs[self.field].getSubset(region=self.mesh_subset).componentLabels
+    def _get_field_components(self, ini_frame, component_labels=None):
+        # type: (OdbFrame, tuple[str, ...] | None) -> tuple[str, ...]
+        components = component_labels
+        if components is None:
+            components = ini_frame.fieldOutputs[self.field].getSubset(region=self.mesh_subset).componentLabels
         if not components:
             components = (self.field, )
-        if maxprinc and self.field in ["S", "E", "LE"]: 
-            maxprinc_component = "{}MAXPRINC".format(self.field)
-            components += (maxprinc_component, )
-        return components  
+        self.tensor_components = tuple(components)
+        return tuple(components) + tuple(tensors.invariant_labels(self.field, self.invariants))
     
     @staticmethod
     def _field_output_bdb(field_output):
         # type: (FieldOutput) -> np.ndarray
-        return np.vstack(bdb.data for bdb in field_output.bulkDataBlocks)
-        
-    def extract(self, maxprinc=True, ipt_vols=None):
-        # type: (bool, list[np.ndarray]) -> None
-        for frame in self.frames:
-            field_output = frame.fieldOutputs[self.field].getSubset(region=self.mesh_subset)
-            field_data = self._field_output_bdb(field_output)
-            if maxprinc and self.field in ["S", "E", "LE"]: 
-                maxprinc_field_data = self._field_output_bdb(field_output.getScalarField(invariant=abqconst.MAX_PRINCIPAL))
-                field_data = np.hstack([field_data, maxprinc_field_data])
-            self.field_data.append(field_data)
+        return np.vstack([bdb.data for bdb in field_output.bulkDataBlocks])
+
+    def add_frame_data(self, field_data):
+        # type: (np.ndarray) -> None
+        if self.invariants:
+            invariant_data, _ = tensors.compute_invariants(field_data, self.tensor_components, self.field, self.invariants)
+            field_data = np.hstack([field_data, invariant_data])
+        self.field_data.append(field_data)
+
+    def reduce(self, ipt_vols=None):
+        # type: (list[np.ndarray] | None) -> None
         if ipt_vols is not None and len(self.field_data[0]) == len(ipt_vols[0]):
             self.volume_average_field(ipt_vols)
         else:
             self.mean_field()
+        
+    def extract(self, ipt_vols=None):
+        # type: (list[np.ndarray]) -> None
+        for frame in self.frames:
+            field_output = frame.fieldOutputs[self.field].getSubset(region=self.mesh_subset)
+            self.add_frame_data(self._field_output_bdb(field_output))
+        self.reduce(ipt_vols)
             
     def mean_field(self):
         # type: () -> None
-        self.field_data = [np.mean(fd, axis=1) for fd in self.field_data]        
+        self.field_data = [np.mean(fd, axis=0) for fd in self.field_data]        
 
     def volume_average_field(self, ipt_vols):
         # type: (list[np.ndarray]) -> None
@@ -126,6 +151,77 @@ class FieldDataExtractor:
             records.append(record)
         return records
 
+class ExtractionPlan(object):
+    """
+    Compiles field requests into a single frame-major pass over the frames of a step. Each frame's field outputs
+    are fetched once, the data of each distinct (field, mesh subset) read once and shared by every request for it,
+    and integration point volumes read once per distinct element subset -- or, with constant_volumes, only on the
+    first frame -- so that odb calls scale with the distinct (frame, field, region) reads rather than the requests.
+    """
+    __slots__ = ("field_requests", "constant_volumes",)
+
+    def __init__(self, field_requests, constant_volumes=False):
+        # type: (list[FieldRequest], bool) -> None
+        self.field_requests = field_requests
+        self.constant_volumes = constant_volumes
+
+    def __repr__(self):
+        # type: () -> str
+        return _repr(self, {"field_requests": self.field_requests, "constant_volumes": self.constant_volumes})
+
+    @property
+    def reads(self):
+        # type: () -> list[tuple[tuple, str]]
+        """Distinct (mesh subset key, field) reads of each frame, integration point volumes included."""
+        reads = []
+        for fr in self.field_requests:
+            fields = list(fr.field_vars)
+            if fr.mesh_subset.type == "element": fields.append("IVOL")
+            reads += [(fr.mesh_subset.key, f) for f in fields if (fr.mesh_subset.key, f) not in reads]
+        return reads
+
+    def execute(self, frames):
+        # type: (list[OdbFrame]) -> list[tuple[dict[str, FieldDataExtractor], list[np.ndarray] | None]]
+        """
+        Read the data of every request from the frames, returning the extractors of each request's fields
+        (reduced to their averages) and the integration point volumes of its subset.
+        """
+        subsets = dict((fr.mesh_subset.key, fr.mesh_subset) for fr in self.field_requests)
+        ipt_vols = dict((key, []) for key, ms in subsets.items() if ms.type == "element")
+        extractors = [{} for _ in self.field_requests]
+        step_data = {}
+        for frame in frames:
+            field_outputs, frame_data = {}, {}
+            for key, field in self.reads:
+                if field == "IVOL" and self.constant_volumes and (key, field) in step_data:
+                    frame_data[(key, field)] = step_data[(key, field)]
+                    continue
+                if field not in field_outputs: field_outputs[field] = frame.fieldOutputs[field]
+                subset = field_outputs[field].getSubset(region=subsets[key].mesh)
+                frame_data[(key, field)] = (FieldDataExtractor._field_output_bdb(subset), subset.componentLabels)
+                if field == "IVOL": step_data[(key, field)] = frame_data[(key, field)]
+            for key in ipt_vols:
+                ipt_vols[key].append(frame_data[(key, "IVOL")][0])
+
+            # Hand each request its share of the frame's reads
+            for fr, fr_extractors in zip(self.field_requests, extractors):
+                key = fr.mesh_subset.key
+                for field in fr.field_vars:
+                    data, component_labels = frame_data[(key, field)]
+                    if field not in fr_extractors:
+                        fr_extractors[field] = FieldDataExtractor(
+                            fr.mesh_subset.mesh, field, frames, fr.field_invariants(field), tuple(component_labels)
+                        )
+                    fr_extractors[field].add_frame_data(data)
+
+        results = []
+        for fr, fr_extractors in zip(self.field_requests, extractors):
+            vols = ipt_vols.get(fr.mesh_subset.key)
+            for fde in fr_extractors.values():
+                fde.reduce(ipt_vols=vols)
+            results.append((fr_extractors, vols))
+        return results
+
 class OdbHandler:
     def __init__(self, odb_filepath):
         # type: (str,dict[str, str | list]) -> OdbHandler        
@@ -134,6 +230,7 @@ class OdbHandler:
         self.assembly = self.odb.rootAssembly
         self.instances = [instance for instance in self.assembly.instances.values()]
         self.analysis_steps = [step for step in self.odb.steps.values()]
+        self._mesh_label_index = {}
         
     @property
     def node_set_names(self):
@@ -182,12 +279,22 @@ class OdbHandler:
     def slice_step_frames(self, frames, num_frames=None):
         # type: (int, int | None) -> list[OdbFrame]
         total_frames = len(frames)
-        if num_frames >= total_frames or num_frames is None:
+        if num_frames is None or num_frames >= total_frames:
             return frames
         slice_idx = list(np.arange(0, total_frames, round(total_frames/num_frames), dtype=int))
         if slice_idx[-1] != total_frames-1: slice_idx.append(total_frames-1)
         return [frames[i] for i in slice_idx]
+
+    def frames_at_times(self, frames, times):
+        # type: (list[OdbFrame], list[float]) -> list[OdbFrame]
+        '''Frames nearest to the given (increasing) step times, found by binary search over the frame values.'''
+        return timegrid.nearest_frames(frames, timegrid.target_times({'times': times}))
     
+    def get_history_output(self, step, region_name, output_name):
+        # type: (OdbStep, str, str) -> np.ndarray
+        '''(increments, 2) time and value of a history output (e.g., ALLSE of "Assembly ASSEMBLY"), read in a single call.'''
+        return np.array(step.historyRegions[region_name].historyOutputs[output_name].data, dtype=float).reshape(-1, 2)
+
     def get_instance_by_name(self, name, ignorecase=True):
         # type: (str, bool) -> OdbInstance
         if ignorecase:
@@ -196,9 +303,17 @@ class OdbHandler:
             return self.assembly.instances[name]
         
     def get_mesh_items_by_label(self, mesh_type, model_region, label):
-        # type: (str, OdbInstance | OdbAssembly, int) -> list[OdbMeshNode] or list[OdbMeshElement]
+        # type: (str, OdbInstance | OdbAssembly, int) -> OdbMeshNode | OdbMeshElement
         _validate_mesh_type(mesh_type)
-        return next(m for m in getattr(model_region, mesh_type + "s") if m.label == label)
+        # Instances can look up mesh items by label directly
+        get_from_label = getattr(model_region, "get{}FromLabel".format(mesh_type.capitalize()), None)
+        if get_from_label is not None:
+            return get_from_label(label)
+        # Otherwise index all mesh items of the region by label once, rather than scanning them for each label
+        key = (model_region.name, mesh_type)
+        if key not in self._mesh_label_index:
+            self._mesh_label_index[key] = dict((m.label, m) for m in getattr(model_region, mesh_type + "s"))
+        return self._mesh_label_index[key][label]
         
     def get_mesh_items_by_set_name(self, mesh_type, model_region, set_name, ignorecase=True):
         # type: (str, OdbInstance | OdbAssembly, list[str], bool) -> OdbSet
@@ -1,79 +1,114 @@
 import os
 import json
 import sys
+import time
 
 import numpy as np
 
 from odbAccess import openOdb
 import abaqusConstants as abqconst
 
-import abqpy
+from . import _hashing, derived, geometry, metrics, output, regions, spatial, tensors, timegrid
 
 TEST_OUT = 'test_odb_py2_output.json'
 
-def extract(odb_filepath, odbex_cfg):
-    # type: (str, dict) -> None
+class ExtractionError(Exception):
+    '''Raised when an extraction definition cannot be resolved on the ODB.'''
+
+def extract(odb_filepath, odbex_cfg, shard=None, incremental=False, profile=False):
+    # type: (str, dict, tuple[int, int] | None, bool, bool) -> None
+    '''
+    Extract the data requested in the config from an odb. Timings of each phase are written to a .metrics.json
+    file next to the output, and with profile, a cProfile dump to a .prof file.
+    '''
+    if not profile:
+        return _extract(odb_filepath, odbex_cfg, shard, incremental)
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(_extract, odb_filepath, odbex_cfg, shard, incremental)
+    finally:
+        profile_filepath = output.output_filepath(odb_filepath, odbex_cfg.get('export_prefix'), ext='.prof')
+        profiler.dump_stats(profile_filepath)
+        print('profile written to file: {}'.format(profile_filepath))
+
+def _extract(odb_filepath, odbex_cfg, shard=None, incremental=False):
+    # type: (str, dict, tuple[int, int] | None, bool) -> None
+    # Frames are sampled over the whole step, so samples of the new frames alone would not match a full extraction
+    if incremental and (odbex_cfg.get('nframes') is not None or odbex_cfg.get('time_grid') is not None):
+        raise ExtractionError('incremental extractions extract every new frame, and cannot be combined with "nframes" or "time_grid"')
+    extraction_metrics = metrics.start(odb_filepath)
 
     # Open the odb
-    odb = openOdb(odb_filepath)
+    with metrics.phase('open_odb'):
+        odb = openOdb(odb_filepath, readOnly=True)
     print('extracting requested field data from {}'.format(odb_filepath))
 
     # print(odb.rootAssembly.instances.values()[0].nodeSets)
     # print(odb.rootAssembly.instances.values()[0].elementSets)
     # exit()
 
-    # Get the regions data is to be extracted on
-    extraction_regions = build_extraction_region_dict(odb, odbex_cfg['extract'])
-    
-
-
-    # Extract data from odb into a dictionary
-    extracted_odb_data = {}
+    # Extract data from odb, handing each frame to the writer for the requested output format
+    # Streamed (and HDF5) output keeps a manifest of the frames extracted so far, which incremental extractions continue from
+    writer = output.open_writer(odb_filepath, odbex_cfg, shard=shard, incremental=incremental)
+    manifest = None
+    if isinstance(writer, (output.StreamWriter, output.HDF5Writer)):
+        manifest_filepath = output.manifest_filepath(odb_filepath, odbex_cfg.get('export_prefix'))
+        manifest = output.Manifest(manifest_filepath, odb_filepath, reset=not incremental)
+    extract_odb(odb, odbex_cfg, writer, shard=shard, manifest=manifest, incremental=incremental)
+    with metrics.phase('close'):
+        writer.close()
+
+    extraction_metrics.bytes_written = metrics.path_size(writer.filepath)
+    metrics_filepath = output.metrics_filepath(odb_filepath, odbex_cfg.get('export_prefix'))
+    if shard is not None: metrics_filepath = output.shard_filepath(metrics_filepath, *shard)
+    extraction_metrics.save(metrics_filepath)
+    print('requested field data from {} successfully written to file: {}'.format(odb_filepath, writer.filepath))
+
+def extract_arrays(odb_filepath, odbex_cfg):
+    # type: (str, dict) -> tuple[dict[str, np.ndarray], metrics.Metrics]
+    '''Extract the data requested in the config from an odb into memory, returning its arrays rather than writing a file.'''
+    extraction_metrics = metrics.start(odb_filepath)
+    with metrics.phase('open_odb'):
+        odb = openOdb(odb_filepath, readOnly=True)
+    print('extracting requested field data from {}'.format(odb_filepath))
+    writer = output.MemoryWriter(dtype=output.output_options(odbex_cfg).get('dtype'))
+    extract_odb(odb, odbex_cfg, writer)
+    odb.close()
+    arrays = writer.arrays()
+    extraction_metrics.bytes_written = sum(int(a.nbytes) for a in arrays.values())
+    return arrays, extraction_metrics
+
+def extract_odb(odb, odbex_cfg, writer, shard=None, manifest=None, incremental=False):
+    # type: (Odb, dict, output.NpzWriter | output.StreamWriter | output.ConsolidatedWriter | output.HDF5Writer, tuple[int, int] | None, output.Manifest | None, bool) -> None
+    '''Extract the data requested in the config from an open odb, handing each frame to the writer.'''
+    # Get the regions data is to be extracted on, and parse expressions for derived fields
+    field_definitions = [ed for ed in odbex_cfg['extract'] if ed['type'].lower() != 'history']
+    history_definitions = [ed for ed in odbex_cfg['extract'] if ed['type'].lower() == 'history']
+    with metrics.phase('build_regions'):
+        extraction_regions = build_extraction_region_dict(odb, field_definitions)
+    try:
+        derived_fields = derived.parse_derived(odbex_cfg.get('derived'))
+    except ValueError as e:
+        raise ExtractionError(str(e))
 
     for step_name, step in odb.steps.items():
-        step_data = extract_step(step, odbex_cfg['nframes'], extraction_regions)
-
-        # Update the odb data dictionary with the data for the current step
-        extracted_odb_data.update({step_name: step_data})
-
-    # Write raw output data to file
-    prefix = odbex_cfg['export_prefix']
-    if prefix is None: prefix = 'odbex'
-    output_filename = '_'.join([prefix, os.path.splitext(os.path.basename(odb_filepath))[0]]) + '.npz'
-    # output_filename = '_'.join([prefix, os.path.splitext(os.path.basename(odb_filepath))[0]]) + '.json'
-    output_dir = os.path.join(os.path.dirname(odb_filepath))
-    if output_dir == '': output_dir = '.'
-    output_filepath = os.path.join(output_dir, output_filename)
-    if not os.path.exists(output_dir): os.mkdir(output_dir)
-
-    # Flatten data dictionary for numpy save
-    flattened = {}
-    for step, step_data in extracted_odb_data.items():
-        for region, region_data in step_data['field_data'].items():
-            for field, field_data in region_data.items():
-                for data_id, data in field_data.items():
-                    # Concatenate keys to unique string for saving
-                    key = '|'.join([step, region, field, data_id])
-                    flattened.update({key: np.array(data)})
-        increments = sorted(step_data['increments'].keys())
-        time = [step_data['increments'][i] for i in increments]
-        key = '|'.join([step, 'increments'])
-        flattened.update({key: np.array([increments, time]).T})        
-    
-    # Write numpy to file.
-    np.savez(output_filepath, **flattened)
-
-    # with open(output_filepath, 'w+') as f:
-    #     json.dump(extracted_odb_data, f, indent=4)
-    
-    print('requested field data from {} successfully written to file: {}'.format(odb_filepath, output_filepath))
+        # History outputs are whole time series, written by the first shard only
+        if history_definitions and (shard is None or shard[0] == 0):
+            extract_history(step, history_definitions, writer)
+        if not extraction_regions: continue
+        extract_step(
+            step, odbex_cfg.get('nframes'), extraction_regions, writer, shard=shard, derived_fields=derived_fields,
+            manifest=manifest, incremental=incremental, time_grid=odbex_cfg.get('time_grid'),
+            constant_volumes=odbex_cfg.get('constant_volumes', False)
+        )
 
 def slice_frames_evenly(frames, num_frames=None):
     # type: (int, int | None) -> list[OdbFrame]
     
     # Check if number of frames is provided or if it exceeds the number of available frames 
     total_frames = len(frames)
-    if num_frames >= total_frames or num_frames is None: return frames
+    if num_frames is None or num_frames >= total_frames: return frames
     
     # Create evenly spaced slice indices
     # Ensure that the last frame is always included
@@ -81,6 +116,22 @@ def slice_frames_evenly(frames, num_frames=None):
     if indices[-1] != total_frames-1: indices.append(total_frames-1)
     return [frames[i] for i in indices]
 
+def frames_after(frames, frame_id):
+    # type: (list[OdbFrame], int) -> list[OdbFrame]
+    '''Get the frames with a frame id greater than the one given, found by binary search over the (ordered) frames.'''
+    lo, hi = 0, len(frames)
+    while lo < hi:
+        mid = (lo + hi)//2
+        if frames[mid].frameId <= frame_id: lo = mid + 1
+        else: hi = mid
+    return [frames[i] for i in range(lo, len(frames))]
+
+def shard_frames(frames, shard, num_shards):
+    # type: (list, int, int) -> list
+    '''Get the contiguous block of frames (or time grid targets) handled by one shard of a sharded extraction.'''
+    start, stop = output.shard_bounds(len(frames), shard, num_shards)
+    return [frames[i] for i in range(start, stop)]
+
 def get_instance_element_set(instance, name):
     # type: (OdbInstance, str) -> OdbSet
     return instance.elementSets[name]
@@ -89,50 +140,93 @@ def get_instance_node_set(instance, name):
     # type: (OdbInstance, str) -> OdbSet
     return instance.nodeSets[name]
 
-def _make_number_slice(numbers):
-    # type: (list) -> np.ndarray:
-    '''
-    Convert a list of element/node numbers into an array for slicing.
-    If the list contains a string, the strings can be of a single integer (e.g., "1") or
-    a range of integers in the form "START-STOP" (e.g., "1-10").
-    '''
-    nums = []
-    for n in numbers:
-        if type(n) == int: nums.append(n)  # Subtract 1 to get correct index
-        if type(n) == str:
-            if '-' in n:  # Range of values
-                start, stop = n.split('-')
-                nums += np.arange(int(start), int(stop) + 1).tolist()
-            else: nums.append(int(n))  # Convert string to int and subtract 1 to get correct index
-    return np.unique(nums)
+def _temporary_set_name(mesh, labels):
+    # type: (str, np.ndarray) -> str
+    return 'ODBEX-{}-{}'.format(mesh.upper(), _hashing.config_hash([int(n) for n in labels])[:12])
+
+def _temporary_set(instance, mesh, labels):
+    # type: (OdbInstance, str, np.ndarray) -> OdbSet
+    '''Get a (temporary) element/node set on the instance containing the given labels, created on first use.'''
+    name = _temporary_set_name(mesh, labels)
+    if mesh == 'node':
+        if name not in instance.nodeSets.keys():
+            instance.NodeSetFromNodeLabels(name=name, nodeLabels=tuple(int(n) for n in labels))
+        return instance.nodeSets[name]
+    if name not in instance.elementSets.keys():
+        instance.ElementSetFromElementLabels(name=name, elementLabels=tuple(int(n) for n in labels))
+    return instance.elementSets[name]
 
 def get_instance_elements_by_number(instance, numbers):
-    # type: (OdbInstance, list) -> list[OdbMeshElement]
+    # type: (OdbInstance, list) -> OdbSet
     '''
-    Get an array of elements on the instance.
+    Get a (temporary) element set on the instance containing the elements with the given numbers,
+    so that their data can be read with a single getSubset call per frame and field.
     The list of element numbers can be integers or strings.
     If the list contains a string, the strings can be of a single integer (e.g., "1") or
     a range of integers in the form "START-STOP" (e.g., "1-10").
     '''
-    elems = []
-    for n in _make_number_slice(numbers):
-        elems.append(instance.getElementFromLabel(n))
-    return np.array(elems)
-
-    # return np.array(instance.elements)[_make_number_slice(numbers)]
+    return _temporary_set(instance, 'element', regions.make_number_slice(numbers))
 
 def get_instance_nodes_by_number(instance, numbers):
-    # type: (OdbInstance, list) -> list[OdbMeshNode]
+    # type: (OdbInstance, list) -> OdbSet
     '''
-    Get an array of nodes on the instance.
+    Get a (temporary) node set on the instance containing the nodes with the given numbers,
+    so that their data can be read with a single getSubset call per frame and field.
     The list of node numbers can be integers or strings.
     If the list contains a string, the strings can be of a single integer (e.g., "1") or
     a range of integers in the form "START-STOP" (e.g., "1-10").
     '''
-    nodes = []
-    for n in _make_number_slice(numbers):
-        nodes.append(instance.getNodeFromLabel(n))
-    return np.array(nodes)
+    return _temporary_set(instance, 'node', regions.make_number_slice(numbers))
+
+def _spatial_index(instance, mesh, indexes):
+    # type: (OdbInstance, str, dict) -> tuple[np.ndarray, spatial.GridIndex]
+    '''Labels and grid index of the node coordinates or element centroids of an instance, built once per instance.'''
+    key = (instance.name, mesh)
+    if key not in indexes:
+        node_labels, coordinates = geometry.node_data(instance)
+        if mesh == 'node':
+            labels, points = node_labels, coordinates
+        else:
+            labels, _, offsets, connectivity = geometry.element_data(instance)
+            points = geometry.element_centroids(node_labels, coordinates, offsets, connectivity)
+        indexes[key] = (labels, spatial.GridIndex(points))
+    return indexes[key]
+
+def get_instance_region_by_geometry(instance, mesh, selector, spec, indexes, region_id):
+    # type: (OdbInstance, str, str, dict, dict, str) -> OdbSet
+    '''
+    Get a (temporary) set on the instance containing the elements (by centroid) or nodes within a box, sphere,
+    cylinder or slab (see abqpy.spatial), so that their data can be read with a single getSubset call per
+    frame and field however many there are.
+    '''
+    labels, index = _spatial_index(instance, mesh, indexes)
+    try:
+        selected = np.unique(labels[spatial.select(index, selector, spec)])
+    except (ValueError, TypeError) as e:
+        raise ExtractionError('invalid {} selection for region {} of instance {}: {}'.format(selector, region_id, instance.name, e))
+    if not len(selected):
+        raise ExtractionError('no {}s of instance {} are within the {} {} of region {}'.format(mesh, instance.name, selector, spec, region_id))
+    return _temporary_set(instance, mesh, selected)
+
+def _invariants_by_field(extraction_definition, fields):
+    # type: (dict, list[str]) -> dict[str, list[str]]
+    '''
+    Get the tensor invariants to compute for each field of an extraction definition.
+    The "invariants" entry can be a list (applied to all stress/strain fields) or a dictionary of lists keyed by field name.
+    '''
+    requested = extraction_definition.get('invariants')
+    if requested is None: return {}
+    if isinstance(requested, dict):
+        invariants = dict((f, [i.upper() for i in invs]) for f, invs in requested.items() if f in fields)
+    else:
+        invariants = dict((f, [i.upper() for i in requested]) for f in fields if f in tensors.TENSOR_FIELDS)
+    for f, invs in invariants.items():
+        unknown = tensors.unknown_invariants(invs)
+        if unknown:
+            raise ExtractionError('unknown invariant(s) {} requested for field {}. valid invariants: {}'.format(
+                ', '.join(unknown), f, ', '.join(tensors.INVARIANTS)
+            ))
+    return invariants
 
 def build_extraction_region_dict(odb, extraction_defintions):
     _region_getters = {
@@ -149,23 +243,22 @@ def build_extraction_region_dict(odb, extraction_defintions):
         'assembly': {
             'element': {
                 'set': get_instance_element_set,
-                'number': get_instance_elements_by_number,
             },
             'node': {
                 'set': get_instance_node_set,
-                'number': get_instance_nodes_by_number,
             },
         },        
     }
-    _mesh_number_prefix = {'element': 'E', 'node': 'N'}
     
-    regions = {}
+    extraction_regions = {}
+    spatial_indexes = {}
     for ed in extraction_defintions:
         # Temp implementation for turning off averaging for a set
         mean_on = True
         if 'avg' in ed.keys() and ed['avg'] == False: mean_on = False
 
         rmesh, rtype, rid, fields = ed['mesh'].lower(), ed['type'].lower(), ed['id'], ed['fields']
+        invariants = _invariants_by_field(ed, fields)
         if ed['subsection'] == 'assembly':
             instance = odb.rootAssembly
             subsection = 'assembly'
@@ -174,53 +267,148 @@ def build_extraction_region_dict(odb, extraction_defintions):
                 instance = odb.rootAssembly.instances[ed['subsection']]
                 subsection = 'instance'
             except KeyError:
-                print('error: instance {} does not exist'.format(ed['subsection']))
-                print('the instances on the model which field data can be extracted from are:')
-                for inst in odb.rootAssembly.instances.keys():
-                    print('-> {}'.format(inst))
-                print('terminating...')
-                exit()
-        try:
-            rg = _region_getters[subsection][rmesh][rtype]
-        except KeyError:
-            print('incorrect value entry for region "type" ({}) or "get" ({})'.format(ed['type'], ed['get']))
-            print('valid type values: node, element')
-            print('valid get values: set, number')
-            print('terminating...')
-            exit()
-        region = rg(instance, rid)
-        if rtype == 'set':
-            regions.update({rid: {'region': region, 'fields': fields, 'mean_on': mean_on}})
+                raise ExtractionError('instance {} does not exist. the instances on the model which field data can be extracted from are: {}'.format(
+                    ed['subsection'], ', '.join(odb.rootAssembly.instances.keys())
+                ))
+        if rtype in spatial.SELECTORS and subsection == 'instance' and rmesh in ('element', 'node'):
+            region = get_instance_region_by_geometry(instance, rmesh, rtype, ed.get('geometry') or {}, spatial_indexes, rid)
         else:
-            pfx = _mesh_number_prefix[rmesh]
-
-            regions.update({'{}{}'.format(pfx, mesh_item.label): {'region': mesh_item, 'fields': fields, 'mean_on': mean_on} for mesh_item in region})
-    return regions
-
-def get_field_data(field_name, frame, region):
-    # type: (str, odb.Frame, odb.Region) -> tuple[np.ndarray, list[str]]
+            try:
+                rg = _region_getters[subsection][rmesh][rtype]
+            except KeyError:
+                raise ExtractionError('incorrect value entry for region "mesh" ({}) or "type" ({}). valid mesh values: node, element. valid type values: set, number, {} (instances only)'.format(
+                    ed['mesh'], ed['type'], ', '.join(spatial.SELECTORS)
+                ))
+            region = rg(instance, rid)
+        extraction_region = {
+            'region': region, 'instance': instance, 'subsection': subsection, 'mesh': rmesh, 'fields': fields,
+            'mean_on': mean_on, 'invariants': invariants
+        }
+        if rtype == 'set' or rtype in spatial.SELECTORS:
+            extraction_region.update({'ids': [rid], 'labels': None})
+            name = rid
+        else:
+            # Element/node numbers are extracted together from a temporary set, and split back into one region per label
+            extraction_region.update({'ids': regions.region_ids(ed), 'labels': regions.make_number_slice(rid)})
+            name = region.name
+        # Several definitions can request fields on the same region, and share its reads
+        key, n = name, 1
+        while key in extraction_regions:
+            n += 1
+            key = '{}#{}'.format(name, n)
+        extraction_regions.update({key: extraction_region})
+    _plan_region_unions(extraction_regions)
+    return extraction_regions
+
+def _region_labels(extraction_region):
+    # type: (dict) -> np.ndarray
+    if extraction_region['labels'] is not None: return np.asarray(extraction_region['labels'], dtype=int)
+    items = extraction_region['region'].nodes if extraction_region['mesh'] == 'node' else extraction_region['region'].elements
+    return np.unique(np.array([item.label for item in items], dtype=int))
+
+def _overlapping_groups(labels):
+    # type: (list[np.ndarray]) -> list[list[int]]
+    '''Groups of (indices of) label arrays which overlap, directly or through other arrays of the group.'''
+    groups = []
+    for i, l in enumerate(labels):
+        overlapping = [g for g in groups if any(np.intersect1d(l, labels[j]).size for j in g)]
+        for g in overlapping: groups.remove(g)
+        groups.append(sorted(sum(overlapping, [i])))
+    return [g for g in groups if len(g) > 1]
+
+def _plan_region_unions(extraction_regions):
+    # type: (dict) -> None
+    '''
+    Find extraction regions of an instance whose elements/nodes overlap (e.g., a set, subsets of it and element
+    numbers within it), and have them read the data of their union once per frame and field rather than each
+    their own, taking their rows from it by label. The union is the largest region if it contains all the others,
+    or a temporary set of their labels otherwise.
+    '''
+    by_instance = {}
+    for name, er in extraction_regions.items():
+        # Assembly sets can span instances, whose labels are not unique
+        if er['subsection'] != 'instance': continue
+        by_instance.setdefault((er['instance'].name, er['mesh']), []).append(name)
+    for (_, mesh), names in by_instance.items():
+        if len(names) < 2: continue
+        labels = [_region_labels(extraction_regions[n]) for n in names]
+        for group in _overlapping_groups(labels):
+            union_labels = np.unique(np.concatenate([labels[i] for i in group]))
+            members = [extraction_regions[names[i]] for i in group]
+            union_region = next((m['region'] for m, i in zip(members, group) if labels[i].size == union_labels.size), None)
+            if union_region is None:
+                instance = members[0]['instance']
+                get_union = get_instance_nodes_by_number if mesh == 'node' else get_instance_elements_by_number
+                union_region = get_union(instance, [int(n) for n in union_labels])
+            for m, i in zip(members, group):
+                m['union'] = {'region': union_region, 'labels': labels[i]}
+
+def _bulk_data_indices(bdbs, block_rows):
+    # type: (list[FieldBulkData], list[int]) -> dict[str, np.ndarray]
+    '''
+    Get the element label, node label, integration point and section point number of each row of the bulk data.
+    Indices which are not defined for the output position of the data (e.g., element labels of nodal data) are -1.
+    '''
+    indices = dict((data_id, []) for data_id in output.INDEX_DATA_IDS)
+    for bdb, num_rows in zip(bdbs, block_rows):
+        for data_id in ('elementLabels', 'nodeLabels', 'integrationPoints'):
+            values = getattr(bdb, data_id, None)
+            values = np.asarray(values if values is not None else [], dtype=int)
+            if values.shape[0] != num_rows: values = np.full(num_rows, -1, dtype=int)
+            indices[data_id].append(values)
+        section_point = getattr(bdb, 'sectionPoint', None)
+        indices['sectionPoints'].append(np.full(num_rows, section_point.number if section_point is not None else -1, dtype=int))
+    return dict((data_id, np.concatenate(values)) for data_id, values in indices.items())
+
+def _label_data_id(mesh):
+    # type: (str | None) -> str
+    return 'nodeLabels' if mesh == 'node' else 'elementLabels'
+
+def get_field_data(field_name, frame, region, invariants=None, mesh=None, return_indices=False, field_output=None):
+    # type: (str, odb.Frame, odb.Region, list[str] | None, str | None, bool, FieldOutput | None) -> tuple[np.ndarray, list[str]] | tuple[np.ndarray, list[str], dict[str, np.ndarray]]
+    '''
+    Get the bulk data of a field for a frame and region, as an array with one row per output location.
+    With return_indices, also returns the element/node labels, integration points and section points of the rows.
+    The field output can be given if it was already fetched from the frame.
+    '''
 
     # Get all field output for current field and frame
-    field_output = frame.fieldOutputs[field_name]
+    if field_output is None: field_output = frame.fieldOutputs[field_name]
 
     # Get component labels for the field
     components = list(field_output.componentLabels)
     if not components: components = [field_name]
 
     # Use the bulkDataBlocks method to retrieve all field output data for the region
-    bdbs = field_output.getSubset(region=region).bulkDataBlocks
-    check_node = str(type(region)) == "<type 'OdbMeshNode'>"
-    if field_name in ['S', 'E', 'LE'] and check_node:
-        bdbs = field_output.getSubset(region=region, position=abqconst.ELEMENT_NODAL).bulkDataBlocks
+    check_node = str(type(region)) == "<type 'OdbMeshNode'>" or mesh == 'node'
+    with metrics.phase('get_subset'):
+        if field_name in ['S', 'E', 'LE'] and check_node:
+            bdbs = field_output.getSubset(region=region, position=abqconst.ELEMENT_NODAL).bulkDataBlocks
+        else:
+            bdbs = field_output.getSubset(region=region).bulkDataBlocks
     
-    # Stack data into numpy array
-    data = np.vstack(bdb.data for bdb in bdbs)
-
-    # Get max. principal if stress or strain requested
-    if field_name in ['S', 'E', 'LE'] and not check_node:
-        bdbs = field_output.getSubset(region=region).getScalarField(invariant=abqconst.MAX_PRINCIPAL).bulkDataBlocks
-        data = np.hstack([data, np.vstack(bdb.data for bdb in bdbs)])
-        components += ("{}MAXPRINC".format(field_name), )
+    # Copy the blocks straight into a single array, with room for the invariants computed from them
+    if invariants is None: invariants = tensors.default_invariants(field_name)
+    with metrics.phase('stack'):
+        blocks = [bdb.data for bdb in bdbs]
+        num_components = len(components)
+        if len(blocks) == 1 and not invariants:
+            data = blocks[0]
+        else:
+            dtype = np.result_type(*blocks) if blocks else np.float32
+            data = np.empty((sum(len(b) for b in blocks), num_components + len(invariants)), dtype=dtype)
+            start = 0
+            for b in blocks:
+                data[start:start + len(b), :num_components] = b
+                start += len(b)
+
+    # Compute requested invariants (max. principal by default) of stress or strain from the tensor components
+    if invariants:
+        with metrics.phase('invariants'):
+            _, labels = tensors.compute_invariants(data[:, :num_components], components, field_name, invariants, out=data[:, num_components:])
+        components += labels
+    if return_indices:
+        return data, components, _bulk_data_indices(bdbs, [len(b) for b in blocks])
     return data, components
 
 # def vol_average_field_data(field_data, ipvols):
@@ -234,64 +422,359 @@ def average_field_data(field_data, ivols=None):
         return np.mean(field_data, axis=0), np.std(field_data, axis=0)
     # Volume-average if integration point quantity
     else:
-        return np.sum(field_data*ivols, axis=0)/np.sum(ivols), np.std(field_data*ivols, axis=0)
+        return np.dot(ivols[:, 0], field_data)/np.sum(ivols), np.std(field_data*ivols, axis=0)
     
-def update_field_dict(field_dict, data_mean, data_std, components):
-    # type: (dict, np.ndarray, list[str]) -> None
-    field_dict['data'].append(data_mean)
-    field_dict['std'].append(data_std)
-    # field_dict['data'].append(data_mean.tolist())
-    # field_dict['std'].append(data_std.tolist())
-    if 'components' not in field_dict.keys(): field_dict.update({'components': components})
-
-def extract_step(step, num_frames, extraction_regions, mean=True):
-    # type: (Odb.Step, int, dict) -> dict
-
-    # Get evenly spaced slice of frames
-    frames = slice_frames_evenly(step.frames, num_frames=num_frames)
-
-    # Initialize dictionaries to store extracted data in
-    field_data_dicts = {k: {f: {'data': [], 'std': []} for f in v['fields']} for k, v in extraction_regions.items()}
-
-    # Create a dictionary to store the step data
-    step_data = {'increments': {f.frameId: f.frameValue for f in frames}, 'field_data': field_data_dicts}
-
-    # Extract data for each frame 
-    for i, frame in enumerate(frames):
-        print('extracting data for increment {} (frame {} of {})'.format(frame.frameId, i+1, len(frames)))
-        # for region, ed in zip(extraction_regions, odbex_cfg['extract']):
-        for rid, fdd in field_data_dicts.items():
-            # Set the region for field data extraction
-            region = extraction_regions[rid]['region']
-
-            # Get integration point volumes first for volume-averaging quantities
-            ivols = None
-            if 'IVOL' in fdd.keys(): 
-                ivols, components = get_field_data('IVOL', frame, region)
-                if np.sum(ivols) == 0: continue
-                # update_field_dict(fdd['IVOL'], ivols, components)
-                # field_data_dicts[ed['id']]['IVOL']['data'].append(ivols)
-            
-            # Loop through field data labels and get bulk data, then average for the region
-            for field_name, field_dict in fdd.items():
-                if field_name == 'IVOL': continue
-
-                # Get field data and average/volume average as appropriate
-                try:
-                    fd, components = get_field_data(field_name, frame, region)
-                except KeyError as e:
-                    print('warning: field {} not available for extraction in current ODB. continuing to next requested field or odb...'.format(field_name))
-                    continue
-
-                fd_mean, fd_std = average_field_data(fd, ivols)
-
-                # Update the field dict
-                if extraction_regions[rid]['mean_on']:
-                    update_field_dict(field_dict, fd_mean, fd_std, components)
-                else:
-                    update_field_dict(field_dict, fd, fd_mean, components)
+def update_field_dict(writer, field_key, data_mean, data_std, components):
+    # type: (output.NpzWriter | output.StreamWriter | output.ConsolidatedWriter, tuple[str, str, str], np.ndarray, np.ndarray, list[str]) -> None
+    writer.append(*(field_key + ('data', data_mean)))
+    writer.append(*(field_key + ('std', data_std)))
+    writer.put(*(field_key + ('components', np.array(components))))
+
+def update_unaveraged_field_dict(writer, field_key, data, components, indices):
+    # type: (output.NpzWriter | output.StreamWriter | output.ConsolidatedWriter, tuple[str, str, str], np.ndarray, list[str], dict[str, np.ndarray]) -> None
+    '''
+    Write the data of every output location of a frame, which the writer stacks into a (frames, locations, components)
+    array. The labels/integration points locating each row are written once, as they do not change between frames.
+    '''
+    writer.append(*(field_key + ('data', data)))
+    writer.put(*(field_key + ('components', np.array(components))))
+    for data_id in output.INDEX_DATA_IDS:
+        writer.put(*(field_key + (data_id, indices[data_id])))
+
+class FrameReads(object):
+    '''
+    Reads of a frame shared by every extraction definition, so that odb calls scale with the distinct
+    (frame, field, region) reads rather than with the number of definitions: each field output is fetched from
+    the frame once, and the data of each region read once. Fields in constant_fields (IVOL, when the volumes
+    do not change) are read once per step, on the first frame extracted, and kept in step_reads.
+    '''
 
-    return step_data
+    def __init__(self, frame, step_reads=None, constant_fields=()):
+        # type: (OdbFrame, dict | None, tuple[str, ...]) -> None
+        self.frame = frame
+        self.step_reads = step_reads if step_reads is not None else {}
+        self.constant_fields = constant_fields
+        self.reads = {}
+        self._field_outputs = {}
+        self._field_names = None
+
+    def field_names(self):
+        # type: () -> list[str]
+        if self._field_names is None: self._field_names = list(self.frame.fieldOutputs.keys())
+        return self._field_names
+
+    def field_output(self, field_name):
+        # type: (str) -> FieldOutput
+        if field_name not in self._field_outputs: self._field_outputs[field_name] = self.frame.fieldOutputs[field_name]
+        return self._field_outputs[field_name]
+
+    def cache(self, field_name):
+        # type: (str) -> dict
+        return self.step_reads if field_name in self.constant_fields else self.reads
+
+def _region_key(extraction_region):
+    # type: (dict) -> tuple
+    '''Identifies the odb region of an extraction definition, which several definitions may share.'''
+    return (extraction_region['instance'].name, extraction_region['mesh'], extraction_region['region'].name)
+
+def get_derived_field_data(derived_field, reads, extraction_region):
+    # type: (derived.DerivedField, FrameReads, dict) -> tuple[np.ndarray, list[str], dict[str, np.ndarray] | None]
+    '''
+    Evaluate a derived field on the bulk data of a frame for a region.
+    Field data is read through the frame's reads so that fields which are also requested directly, or referenced by
+    several derived fields, are only read once per frame.
+    '''
+    try:
+        sources = derived_field.resolve(reads.field_names(), lambda f: reads.field_output(f).componentLabels)
+    except ValueError as e:
+        raise ExtractionError(str(e))
+    columns, num_rows, indices = {}, 0, None
+    for label, field_name in sources.items():
+        data, components, indices = _cached_field_data(field_name, reads, extraction_region)
+        if label in components:
+            columns[label] = data[:, components.index(label)]
+        else:
+            # Invariant which is not extracted for the field itself
+            values, _ = tensors.compute_invariants(data, components, field_name, [label[len(field_name):]])
+            columns[label] = values[:, 0]
+        num_rows = data.shape[0]
+    return derived_field.evaluate(columns, num_rows), [derived_field.name], indices
+
+def _get_field_data_by_label(field_name, reads, extraction_region):
+    # type: (str, FrameReads, dict) -> tuple[np.ndarray, list[str], dict[str, np.ndarray]]
+    '''
+    Get the bulk data of a field for a region of element/node numbers, with the indices of each row.
+    Data which cannot be attributed to the requested labels from a single read (e.g., nodal data on elements)
+    is read separately for each element/node instead.
+    '''
+    region, mesh, invariants = extraction_region['region'], extraction_region['mesh'], extraction_region['invariants']
+    field_output = reads.field_output(field_name)
+    data, components, indices = get_field_data(
+        field_name, reads.frame, region, invariants.get(field_name), mesh=mesh, return_indices=True, field_output=field_output
+    )
+    label_data_id = _label_data_id(mesh)
+    if np.all(indices[label_data_id] >= 0): return data, components, indices
+    instance = extraction_region['instance']
+    get_item = instance.getNodeFromLabel if mesh == 'node' else instance.getElementFromLabel
+    blocks = []
+    for label in extraction_region['labels']:
+        block, components, block_indices = get_field_data(
+            field_name, reads.frame, get_item(int(label)), invariants.get(field_name), mesh=mesh, return_indices=True,
+            field_output=field_output
+        )
+        block_indices[label_data_id] = np.full(block.shape[0], label, dtype=int)
+        blocks.append((block, block_indices))
+    indices = dict((data_id, np.concatenate([b[1][data_id] for b in blocks])) for data_id in output.INDEX_DATA_IDS)
+    return np.vstack([b[0] for b in blocks]), components, indices
+
+# np.isin is not available in the older numpy of some Abaqus versions, and np.in1d was removed in numpy 2.4
+_isin = np.isin if hasattr(np, 'isin') else np.in1d
+
+def _union_field_data(field_name, reads, extraction_region):
+    # type: (str, FrameReads, dict) -> tuple[np.ndarray, list[str], dict[str, np.ndarray] | None] | None
+    '''
+    Get the bulk data of a field for a region from the data of the union of the regions overlapping it, which is read
+    once per frame. The rows of the region are found from the element/node labels of the union's rows, once per step.
+    Returns None if the rows cannot be attributed to labels (e.g., nodal data of elements).
+    '''
+    union, mesh = extraction_region['union'], extraction_region['mesh']
+    invariants = extraction_region['invariants'].get(field_name)
+    # Node numbers are read with their mesh, as for their own reads, to get element nodal data on nodes
+    read_mesh = 'node' if extraction_region['labels'] is not None and mesh == 'node' else None
+    key = ('union', union['region'].name, mesh, field_name, tuple(invariants or ()), read_mesh)
+    cache = reads.cache(field_name)
+    if key not in cache:
+        cache[key] = get_field_data(
+            field_name, reads.frame, union['region'], invariants, mesh=read_mesh, return_indices=True,
+            field_output=reads.field_output(field_name)
+        )
+    data, components, indices = cache[key]
+    row_labels = indices[_label_data_id(mesh)]
+    rows_key = key + (_region_key(extraction_region), row_labels.shape[0])
+    if rows_key not in reads.step_reads:
+        reads.step_reads[rows_key] = None if np.any(row_labels < 0) else np.nonzero(_isin(row_labels, union['labels']))[0]
+    rows = reads.step_reads[rows_key]
+    if rows is None: return None
+    if extraction_region['labels'] is None and extraction_region['mean_on']: return data[rows], components, None
+    return data[rows], components, dict((data_id, index[rows]) for data_id, index in indices.items())
+
+def _cached_field_data(field_name, reads, extraction_region):
+    # type: (str, FrameReads, dict) -> tuple[np.ndarray, list[str], dict[str, np.ndarray] | None]
+    if 'union' in extraction_region:
+        field_data = _union_field_data(field_name, reads, extraction_region)
+        if field_data is not None: return field_data
+    invariants = extraction_region['invariants'].get(field_name)
+    # Row indices are only needed to write unaveraged data
+    by_label, return_indices = extraction_region['labels'] is not None, not extraction_region['mean_on']
+    key = (_region_key(extraction_region), field_name, tuple(invariants or ()), by_label, return_indices)
+    cache = reads.cache(field_name)
+    if key not in cache:
+        if by_label:
+            cache[key] = _get_field_data_by_label(field_name, reads, extraction_region)
+        else:
+            field_data = get_field_data(
+                field_name, reads.frame, extraction_region['region'], invariants, return_indices=return_indices,
+                field_output=reads.field_output(field_name)
+            )
+            cache[key] = field_data if return_indices else field_data + (None, )
+    return cache[key]
+
+def split_rows(extraction_region, indices):
+    # type: (dict, dict[str, np.ndarray] | None) -> list[tuple[str, np.ndarray | slice]]
+    '''
+    Get the rows of the bulk data belonging to each region id of an extraction region: all rows for sets,
+    or the rows of each element/node label for regions of element/node numbers.
+    '''
+    if extraction_region['labels'] is None: return [(extraction_region['ids'][0], slice(None))]
+    row_labels = indices[_label_data_id(extraction_region['mesh'])]
+    order = np.argsort(row_labels, kind='mergesort')
+    sorted_labels = row_labels[order]
+    starts = np.searchsorted(sorted_labels, extraction_region['labels'], side='left')
+    stops = np.searchsorted(sorted_labels, extraction_region['labels'], side='right')
+    return [(rid, order[start:stop]) for rid, start, stop in zip(extraction_region['ids'], starts, stops)]
+
+def extract_frame(frame, extraction_regions, derived_fields=None, skip=None, step_reads=None, constant_fields=()):
+    # type: (OdbFrame, dict, dict[str, derived.DerivedField] | None, Callable[[str, str], bool] | None, dict | None, tuple[str, ...]) -> list[tuple]
+    '''
+    Extract the requested data of a frame for every region as ((region id, field), arrays, components, indices)
+    records: (mean, std) arrays and no indices for averaged regions, the data at every output location and its
+    indices otherwise. Region/field pairs for which skip returns True, or already extracted for another
+    definition of the same region, are left out.
+    '''
+    if derived_fields is None: derived_fields = {}
+    extraction_metrics = metrics.active()
+    reads = FrameReads(frame, step_reads, constant_fields)
+    records, extracted = [], set()
+    for region_name, extraction_region in extraction_regions.items():
+        fields = extraction_region['fields']
+
+        # Get integration point volumes first for volume-averaging quantities
+        ivols = {}
+        if 'IVOL' in fields: 
+            field_start = time.time()
+            ivol_data, _, ivol_indices = _cached_field_data('IVOL', reads, extraction_region)
+            ivols = dict((rid, ivol_data[rows]) for rid, rows in split_rows(extraction_region, ivol_indices))
+            extraction_metrics.add_region_field(region_name, 'IVOL', time.time() - field_start)
+        
+        # Loop through field data labels and get bulk data, then average for each region
+        for field_name in fields:
+            if field_name == 'IVOL': continue
+            field_start = time.time()
+
+            # Get field data and average/volume average as appropriate
+            try:
+                if field_name in derived_fields:
+                    fd, components, indices = get_derived_field_data(derived_fields[field_name], reads, extraction_region)
+                else:
+                    fd, components, indices = _cached_field_data(field_name, reads, extraction_region)
+            except KeyError as e:
+                print('warning: field {} not available for extraction in current ODB. continuing to next requested field or odb...'.format(field_name))
+                continue
+
+            for rid, rows in split_rows(extraction_region, indices):
+                if (rid, field_name) in extracted or (skip is not None and skip(rid, field_name)): continue
+                rid_ivols = ivols.get(rid)
+                if rid_ivols is not None and np.sum(rid_ivols) == 0: continue
+                rid_fd = fd[rows]
+                if rid_fd.shape[0] == 0: continue
+
+                # Keep the frame's field data, averaged or at every output location
+                extracted.add((rid, field_name))
+                if extraction_region['mean_on']:
+                    with metrics.phase('average'):
+                        records.append(((rid, field_name), average_field_data(rid_fd, rid_ivols), components, None))
+                else:
+                    rid_indices = dict((data_id, index[rows]) for data_id, index in indices.items())
+                    records.append(((rid, field_name), (rid_fd, ), components, rid_indices))
+            extraction_metrics.add_region_field(region_name, field_name, time.time() - field_start)
+    return records
+
+def write_frame(writer, step_name, records):
+    # type: (output.NpzWriter | output.StreamWriter | output.ConsolidatedWriter, str, list[tuple]) -> None
+    with metrics.phase('write'):
+        for (rid, field_name), arrays, components, indices in records:
+            field_key = (step_name, rid, field_name)
+            if indices is None:
+                update_field_dict(writer, field_key, arrays[0], arrays[1], components)
+            else:
+                update_unaveraged_field_dict(writer, field_key, arrays[0], components, indices)
+
+def interpolate_records(before, after, weight):
+    # type: (list[tuple], list[tuple], float) -> list[tuple]
+    '''
+    Linearly interpolate the records of the frames before/after a target time (the std of averaged data included).
+    Data whose shape differs between the frames cannot be interpolated, so that of the nearest frame is kept.
+    '''
+    after = dict((r[0], r) for r in after)
+    records = []
+    for key, arrays, components, indices in before:
+        if key not in after: continue
+        after_arrays = after[key][1]
+        if any(a.shape != b.shape for a, b in zip(arrays, after_arrays)):
+            records.append(after[key] if weight > 0.5 else (key, arrays, components, indices))
+            continue
+        interpolated = tuple(a + weight*(b - a) for a, b in zip(arrays, after_arrays))
+        records.append((key, interpolated, components, indices))
+    return records
+
+def get_history_data(step, region_name, output_name):
+    # type: (OdbStep, str, str) -> np.ndarray
+    '''(increments, 2) array of the time and value of a history output of a step, read in a single call.'''
+    try:
+        history_region = step.historyRegions[region_name]
+    except KeyError:
+        raise ExtractionError('history region {} does not exist on step {}. the history regions of the step are: {}'.format(
+            region_name, step.name, ', '.join(step.historyRegions.keys())
+        ))
+    try:
+        history_output = history_region.historyOutputs[output_name]
+    except KeyError:
+        raise ExtractionError('history output {} does not exist on history region {} of step {}. the history outputs of the region are: {}'.format(
+            output_name, region_name, step.name, ', '.join(history_region.historyOutputs.keys())
+        ))
+    with metrics.phase('history'):
+        return np.array(history_output.data, dtype=float).reshape(-1, 2)
+
+def extract_history(step, history_definitions, writer):
+    # type: (OdbStep, list[dict], output.NpzWriter | output.StreamWriter | output.ConsolidatedWriter | output.HDF5Writer) -> None
+    '''
+    Write the history outputs requested by "history" extraction definitions ({"type": "history", "id": HISTORY_REGION,
+    "fields": [OUTPUT, ...]}) as STEP|HISTORY_REGION|OUTPUT|history arrays, at every increment they were written at.
+    '''
+    extraction_metrics = metrics.active()
+    for hd in history_definitions:
+        for output_name in hd['fields']:
+            start = time.time()
+            data = get_history_data(step, hd['id'], output_name)
+            with metrics.phase('write'):
+                writer.put(step.name, hd['id'], output_name, 'history', data)
+            extraction_metrics.add_region_field(hd['id'], output_name, time.time() - start)
+
+def _step_targets(step, num_frames, time_grid=None, shard=None):
+    # type: (Odb.Step, int | None, dict | None, tuple[int, int] | None) -> list[tuple[int, float, OdbFrame, OdbFrame, float]]
+    '''
+    The increments to write for a step as (increment id, time, frame before, frame after, weight) targets.
+    Increments are the selected frames themselves, unless the step's time grid is interpolated, in which case
+    each target time is an increment numbered by its index on the grid.
+    '''
+    spec = timegrid.step_grid(time_grid, step.name)
+    if spec is None:
+        # Get evenly spaced slice of frames
+        frames = slice_frames_evenly(step.frames, num_frames=num_frames)
+    else:
+        try:
+            times = timegrid.target_times(spec)
+        except ValueError as e:
+            raise ExtractionError('invalid time grid for step {}: {}'.format(step.name, e))
+        if spec.get('interpolate', False):
+            brackets = timegrid.bracket_frames(step.frames, times, interpolate=True)
+            targets = [(i, float(t), step.frames[lo], step.frames[hi], w) for i, (t, (lo, hi, w)) in enumerate(zip(times, brackets))]
+            return targets if shard is None else shard_frames(targets, *shard)
+        frames = timegrid.nearest_frames(step.frames, times)
+    # The block of frames to be extracted if sharding
+    if shard is not None: frames = shard_frames(frames, *shard)
+    return [(frame.frameId, frame.frameValue, frame, frame, 0.) for frame in frames]
+
+def extract_step(step, num_frames, extraction_regions, writer, mean=True, shard=None, derived_fields=None, manifest=None, incremental=False, time_grid=None, constant_volumes=False):
+    # type: (Odb.Step, int, dict, output.NpzWriter | output.StreamWriter | output.ConsolidatedWriter, bool, tuple[int, int] | None, dict[str, derived.DerivedField] | None, output.Manifest | None, bool, dict | None, bool) -> None
+    if derived_fields is None: derived_fields = {}
+    region_fields = [(rid, f) for er in extraction_regions.values() for rid in er['ids'] for f in er['fields']]
+
+    skip = None
+    if incremental:
+        # Every frame written since the last extraction of any requested field
+        last_frame_id = min(manifest.last_frame_id(step.name, rid, f) for rid, f in region_fields)
+        targets = [(frame.frameId, frame.frameValue, frame, frame, 0.) for frame in frames_after(step.frames, last_frame_id)]
+    else:
+        targets = _step_targets(step, num_frames, time_grid, shard)
+
+    # Extract data for each target, writing it out as soon as it is done
+    # Targets are in increasing order of time, so only the records of the frames bracketing the current one are kept
+    writer.reserve(step.name, len(targets))
+    extraction_metrics = metrics.active()
+    step_start = time.time()
+    frame_records = {}
+    # Integration point volumes are read on the first frame only if they are constant over the step
+    step_reads, constant_fields = {}, ('IVOL', ) if constant_volumes else ()
+    for i, (increment_id, time_value, before, after, weight) in enumerate(targets):
+        metrics.progress(step.name, increment_id, i, len(targets), step_start)
+        needed = (before, after) if weight else (before, )
+        frame_records = dict((f.frameId, frame_records[f.frameId]) for f in needed if f.frameId in frame_records)
+        for frame in needed:
+            if frame.frameId in frame_records: continue
+            if incremental:
+                skip = lambda rid, field_name, frame_id=frame.frameId: frame_id <= manifest.last_frame_id(step.name, rid, field_name)
+            frame_records[frame.frameId] = extract_frame(frame, extraction_regions, derived_fields, skip, step_reads, constant_fields)
+            extraction_metrics.frames += 1
+        records = frame_records[before.frameId]
+        if weight: records = interpolate_records(records, frame_records[after.frameId], weight)
+        write_frame(writer, step.name, records)
+
+        if manifest is None or increment_id > manifest.last_increment(step.name):
+            writer.add_increment(step.name, increment_id, time_value)
+        if manifest is not None:
+            manifest.update(step.name, increment_id, region_fields)
+            manifest.save()
 
 if __name__ == '__main__':
     TEST_CFG = {
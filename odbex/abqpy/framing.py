@@ -0,0 +1,80 @@
+"""
+Binary framing of messages of JSON headers and numpy arrays, for sending extracted data between the abaqus python
+worker/server and Python 3 without intermediate files.
+
+A message is a JSON header on a single line, with the number of arrays which follow it under "arrays". Each array
+is a JSON line of its key, dtype, shape and size in bytes, followed by its raw (C-ordered) bytes.
+Standard library and numpy only, so that it can be imported from either interpreter.
+"""
+import json
+import sys
+
+import numpy as np
+
+# Line written before a message on a stream which may carry other output first (e.g., of the abaqus launcher)
+MARKER = b'ODBEX-MESSAGE\n'
+
+def _write_line(stream, obj):
+    # type: (BinaryIO, dict) -> None
+    stream.write(json.dumps(obj).encode('utf-8') + b'\n')
+
+def _read_line(stream):
+    # type: (BinaryIO) -> dict
+    line = stream.readline()
+    if not line.endswith(b'\n'): raise EOFError('connection closed before the end of the message')
+    return json.loads(line.decode('utf-8'))
+
+def _read_exact(stream, num_bytes):
+    # type: (BinaryIO, int) -> bytearray
+    buffer = bytearray(num_bytes)
+    readinto = getattr(stream, 'readinto', None)
+    if readinto is None:
+        # Socket files of Python 2 cannot read into a buffer
+        data = stream.read(num_bytes)
+        if len(data) < num_bytes: raise EOFError('connection closed before the end of the message')
+        buffer[:] = data
+        return buffer
+    view, position = memoryview(buffer), 0
+    while position < num_bytes:
+        read = readinto(view[position:])
+        if not read: raise EOFError('connection closed before the end of the message')
+        position += read
+    return buffer
+
+def write_message(stream, header, arrays=None):
+    # type: (BinaryIO, dict, dict[str, np.ndarray] | None) -> None
+    '''Write a header and the given arrays to a binary stream, flushing it once the message is written.'''
+    arrays = arrays or {}
+    header = dict(header)
+    header['arrays'] = len(arrays)
+    _write_line(stream, header)
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject: raise TypeError('array {} of objects cannot be sent'.format(key))
+        _write_line(stream, {'key': key, 'dtype': array.dtype.str, 'shape': list(array.shape), 'nbytes': int(array.nbytes)})
+        if sys.version_info[0] < 3:
+            # Socket files of Python 2 write str(data), which is not the bytes of a memoryview
+            stream.write(array.tostring())
+        else:
+            stream.write(memoryview(array.reshape(-1).view(np.uint8)))
+    stream.flush()
+
+def read_message(stream):
+    # type: (BinaryIO) -> tuple[dict, dict[str, np.ndarray]]
+    '''Read a message written by write_message, returning its header and arrays.'''
+    header = _read_line(stream)
+    arrays = {}
+    for _ in range(header.pop('arrays', 0)):
+        array_header = _read_line(stream)
+        buffer = _read_exact(stream, array_header['nbytes'])
+        dtype = np.dtype(str(array_header['dtype']))
+        arrays[array_header['key']] = np.frombuffer(buffer, dtype=dtype).reshape(array_header['shape'])
+    return header, arrays
+
+def skip_to_marker(stream, on_line=None):
+    # type: (BinaryIO, Callable[[bytes], None] | None) -> None
+    '''Skip the lines of a stream up to the marker of a message, handing any other lines to on_line.'''
+    for line in iter(stream.readline, b''):
+        if line == MARKER: return
+        if on_line is not None: on_line(line)
+    raise EOFError('stream ended without a message')
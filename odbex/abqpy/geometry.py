@@ -0,0 +1,98 @@
+"""
+Mesh geometry and connectivity of the instances of an odb, run under abaqus python with
+
+    abaqus python odbex/abqpy/export_mesh.py ODB OUTPUT
+
+and written to a single .npz, so that spatial post-processing never has to reopen the odb. Arrays are keyed by
+INSTANCE|DATA_ID:
+- nodeLabels, coordinates: (nodes, ) labels and (nodes, 3) coordinates
+- elementLabels, elementTypes: (elements, ) labels and type names
+- offsets, connectivity: CSR-style connectivity, the node labels of element i are connectivity[offsets[i]:offsets[i + 1]]
+and INSTANCE|elementSets|NAME, INSTANCE|nodeSets|NAME for the labels of the members of each set of the instance.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from . import output
+
+SET_DATA_IDS = {'element': 'elementSets', 'node': 'nodeSets'}
+
+def node_data(instance):
+    # type: (OdbInstance) -> tuple[np.ndarray, np.ndarray]
+    '''Labels and coordinates of the nodes of an instance.'''
+    nodes = instance.nodes
+    labels = np.array([n.label for n in nodes], dtype=int)
+    coordinates = np.array([n.coordinates for n in nodes], dtype=np.float32).reshape(len(labels), -1)
+    return labels, coordinates
+
+def element_data(instance):
+    # type: (OdbInstance) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+    '''Labels, type names and CSR-style connectivity (offsets, node labels) of the elements of an instance.'''
+    elements = instance.elements
+    labels = np.array([e.label for e in elements], dtype=int)
+    types = np.array([str(e.type) for e in elements], dtype=str)
+    element_nodes = [e.connectivity for e in elements]
+    offsets = np.zeros(len(labels) + 1, dtype=int)
+    offsets[1:] = np.cumsum([len(c) for c in element_nodes])
+    connectivity = np.fromiter((n for c in element_nodes for n in c), dtype=int, count=int(offsets[-1]))
+    return labels, types, offsets, connectivity
+
+def element_centroids(node_labels, coordinates, offsets, connectivity):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+    '''Centroids (mean of the node coordinates) of the elements of CSR-style connectivity.'''
+    order = np.argsort(node_labels)
+    node_coordinates = coordinates[order[np.searchsorted(node_labels, connectivity, sorter=order)]].astype(float)
+    counts = np.diff(offsets)
+    sums = np.add.reduceat(node_coordinates, offsets[:-1], axis=0) if len(connectivity) else np.zeros((0, coordinates.shape[1]))
+    return (sums/np.maximum(counts, 1)[:, None]).astype(np.float32)
+
+def instance_mesh(instance):
+    # type: (OdbInstance) -> dict[str, np.ndarray]
+    '''Mesh arrays of an instance keyed by DATA_ID, or SET_DATA_ID|NAME for set membership.'''
+    node_labels, coordinates = node_data(instance)
+    element_labels, types, offsets, connectivity = element_data(instance)
+    arrays = {
+        'nodeLabels': node_labels, 'coordinates': coordinates, 'elementLabels': element_labels, 'elementTypes': types,
+        'offsets': offsets, 'connectivity': connectivity,
+    }
+    for name, odb_set in instance.elementSets.items():
+        arrays[output.KEY_SEP.join([SET_DATA_IDS['element'], name])] = np.array([e.label for e in odb_set.elements], dtype=int)
+    for name, odb_set in instance.nodeSets.items():
+        arrays[output.KEY_SEP.join([SET_DATA_IDS['node'], name])] = np.array([n.label for n in odb_set.nodes], dtype=int)
+    return arrays
+
+def read_mesh(odb):
+    # type: (Odb) -> dict[str, np.ndarray]
+    '''Mesh arrays of all instances of an odb, keyed by INSTANCE|DATA_ID.'''
+    arrays = {}
+    for name, instance in odb.rootAssembly.instances.items():
+        for key, array in instance_mesh(instance).items():
+            arrays[output.KEY_SEP.join([name, key])] = array
+    return arrays
+
+def export_mesh(odb_filepath, filepath):
+    # type: (str, str) -> None
+    # Imported here so that the array helpers above can also be used from Python 3 (odbex.post.mesh)
+    from odbAccess import openOdb
+    odb = openOdb(odb_filepath, readOnly=True)
+    print('reading mesh of {}'.format(odb_filepath))
+    arrays = read_mesh(odb)
+    odb.close()
+    output_dir = os.path.dirname(filepath)
+    if output_dir and not os.path.exists(output_dir): os.makedirs(output_dir)
+    # Written aside and renamed, so that concurrent readers of a cache never see a partial file
+    tmp_filepath = '{}.{}.tmp.npz'.format(os.path.splitext(filepath)[0], os.getpid())
+    np.savez(tmp_filepath, **arrays)
+    if os.path.exists(filepath): os.remove(filepath)
+    os.rename(tmp_filepath, filepath)
+    print('mesh of {} written to file: {}'.format(odb_filepath, filepath))
+
+def main():
+    # type: () -> None
+    parser = argparse.ArgumentParser(prog='odbex-mesh')
+    parser.add_argument('odb', help='Full or relative path to output database (.odb) file.')
+    parser.add_argument('output', help='Path of the .npz file the mesh is written to.')
+    args = parser.parse_args()
+    export_mesh(args.odb, args.output)
@@ -0,0 +1,172 @@
+"""
+Instrumentation of an extraction: cumulative time and call counts per phase (opening the odb, resolving regions,
+reading, stacking, invariants, averaging, writing) and per region/field, peak memory and bytes written.
+Written as a PREFIX_ODBNAME.metrics.json file next to the output.
+
+Progress is reported once per frame, either as a readable line or, for the Python 3 wrapper, as a JSON event
+on a line starting with PROGRESS_PREFIX.
+Standard library only, so that it can be imported from either interpreter.
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROGRESS_PREFIX = 'ODBEX-PROGRESS '
+
+class Metrics(object):
+    def __init__(self, odb_filepath=None):
+        # type: (str | None) -> None
+        self.odb_filepath = odb_filepath
+        self.start = time.time()
+        self.phases = {}
+        self.regions = {}
+        self.frames = 0
+        self.bytes_written = 0
+
+    @contextmanager
+    def phase(self, name):
+        # type: (str) -> Iterator[None]
+        '''Time a phase of the extraction, adding to its cumulative time and call count.'''
+        start = time.time()
+        try:
+            yield
+        finally:
+            totals = self.phases.setdefault(name, [0., 0])
+            totals[0] += time.time() - start
+            totals[1] += 1
+
+    def add_region_field(self, region, field, seconds):
+        # type: (str, str, float) -> None
+        totals = self.regions.setdefault(region, {}).setdefault(field, [0., 0])
+        totals[0] += seconds
+        totals[1] += 1
+
+    def to_dict(self):
+        # type: () -> dict
+        return {
+            'odb': self.odb_filepath,
+            'seconds': time.time() - self.start,
+            'frames': self.frames,
+            'bytes_written': self.bytes_written,
+            'peak_rss_bytes': peak_rss(),
+            'phases': dict((name, {'seconds': t[0], 'calls': t[1]}) for name, t in self.phases.items()),
+            'regions': dict(
+                (region, dict((field, {'seconds': t[0], 'calls': t[1]}) for field, t in fields.items()))
+                for region, fields in self.regions.items()
+            ),
+        }
+
+    def save(self, filepath):
+        # type: (str) -> None
+        with open(filepath, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1, sort_keys=True)
+
+# Metrics of the extraction in progress, so that the extractor's functions can be timed without passing it around
+_active = Metrics()
+_progress_events = False
+
+def start(odb_filepath):
+    # type: (str) -> Metrics
+    global _active
+    _active = Metrics(odb_filepath)
+    return _active
+
+def active():
+    # type: () -> Metrics
+    return _active
+
+def phase(name):
+    # type: (str) -> ContextManager[None]
+    return _active.phase(name)
+
+def emit_progress_events(enable=True):
+    # type: (bool) -> None
+    '''Report progress as JSON events (for the Python 3 wrapper) rather than readable lines.'''
+    global _progress_events
+    _progress_events = enable
+
+def progress(step, frame_id, index, num_frames, step_start):
+    # type: (str, int, int, int, float) -> None
+    '''Report the start of the extraction of a frame, with an estimate of the time left for the step.'''
+    elapsed = time.time() - step_start
+    eta = elapsed/index*(num_frames - index) if index else None
+    if _progress_events:
+        event = {
+            'odb': _active.odb_filepath, 'step': step, 'increment': frame_id, 'frame': index + 1,
+            'frames': num_frames, 'elapsed': elapsed, 'eta': eta,
+        }
+        print(PROGRESS_PREFIX + json.dumps(event))
+        sys.stdout.flush()
+    else:
+        print('extracting data for increment {} (frame {} of {})'.format(frame_id, index + 1, num_frames))
+
+def parse_progress(line):
+    # type: (str) -> dict | None
+    '''The event of a progress line, or None for any other output.'''
+    if not line.startswith(PROGRESS_PREFIX): return None
+    try:
+        return json.loads(line[len(PROGRESS_PREFIX):])
+    except ValueError:
+        return None
+
+def peak_rss():
+    # type: () -> int | None
+    '''Peak resident memory of the process in bytes, if it can be determined on this platform.'''
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss*1024
+    if os.name == 'nt':
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [
+                    ('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t),
+                ]
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return int(counters.PeakWorkingSetSize)
+        except (AttributeError, OSError):
+            pass
+    return None
+
+def combine(metrics_dicts):
+    # type: (list[dict]) -> dict
+    '''Combine the metrics of the shards of a sharded extraction, which ran concurrently.'''
+    combined = {'odb': None, 'seconds': 0., 'frames': 0, 'bytes_written': 0, 'peak_rss_bytes': None, 'phases': {}, 'regions': {}}
+    for m in metrics_dicts:
+        combined['odb'] = m['odb']
+        combined['seconds'] = max(combined['seconds'], m['seconds'])
+        combined['frames'] += m['frames']
+        combined['bytes_written'] += m['bytes_written']
+        if m['peak_rss_bytes'] is not None:
+            combined['peak_rss_bytes'] = max(combined['peak_rss_bytes'] or 0, m['peak_rss_bytes'])
+        timings = [(combined['phases'], m['phases'])]
+        timings += [(combined['regions'].setdefault(region, {}), fields) for region, fields in m['regions'].items()]
+        for totals, added in timings:
+            for name, t in added.items():
+                total = totals.setdefault(name, {'seconds': 0., 'calls': 0})
+                total['seconds'] += t['seconds']
+                total['calls'] += t['calls']
+    return combined
+
+def path_size(path):
+    # type: (str) -> int
+    '''Size in bytes of an output file, or of all files in an output directory.'''
+    if not os.path.exists(path): return 0
+    if not os.path.isdir(path): return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
@@ -0,0 +1,729 @@
+"""
+Output file helpers shared by the abaqus python extractor and the Python 3 wrapper.
+Only depends on numpy so that it can be imported from either interpreter.
+
+Extracted data is keyed by STEP|REGION|FIELD|DATA_ID (and STEP|increments for the frame ids/times of a step)
+and handed to a writer frame by frame:
+- NpzWriter collects everything in memory and writes a single .npz file when closed, optionally compressed and
+  with the frames of each array delta encoded (read back with NpzArrays).
+- StreamWriter appends each frame to one .npy file per key as soon as it is extracted.
+- ConsolidatedWriter collects everything in memory and writes one .npy file per step/field/data id when closed,
+  with all regions stacked into a single memory-mappable array.
+- HDF5Writer appends each frame to chunked, compressed datasets of an HDF5 file (requires h5py).
+"""
+import json
+import os
+import shutil
+import struct
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+KEY_SEP = '|'
+FORMATS = ('npz', 'stream', 'consolidated', 'hdf5')
+INDEX_FILENAME = 'index.json'
+CONSOLIDATED_INDEX_FILENAME = 'consolidated.json'
+HDF5_EXT = '.h5'
+DTYPES = ('float32', 'float64')
+NPZ_COMPRESSION = (None, 'deflate')
+
+# Member of a delta encoded .npz listing the keys of its delta encoded arrays
+DELTA_KEY = 'delta_encoded'
+
+# Element/node labels, integration points and section points of each row of unaveraged data
+INDEX_DATA_IDS = ('elementLabels', 'nodeLabels', 'integrationPoints', 'sectionPoints')
+
+# (increments, 2) time and value of a history output, written under STEP|HISTORY_REGION|OUTPUT|history
+HISTORY_DATA_ID = 'history'
+
+# Data ids which are written once per region/field rather than once per frame
+STATIC_DATA_IDS = ('components', ) + INDEX_DATA_IDS + (HISTORY_DATA_ID, )
+
+def decode_labels(labels):
+    # type: (Iterable[bytes | str]) -> list[str]
+    '''
+    Labels (e.g., components) as text, whether they were written by abaqus python 2, where they load as bytes,
+    or by Python 3.
+    '''
+    return [c.decode('utf-8') if isinstance(c, bytes) and not isinstance(c, str) else str(c) for c in labels]
+
+def output_filepath(odb_filepath, prefix=None, ext='.npz'):
+    # type: (str, str | None, str) -> str
+    '''
+    Path of the file extracted data for an odb is written to, i.e. PREFIX_ODBNAME.npz
+    in the same directory as the odb.
+    '''
+    if prefix is None: prefix = 'odbex'
+    output_filename = '_'.join([prefix, os.path.splitext(os.path.basename(odb_filepath))[0]]) + ext
+    output_dir = os.path.dirname(odb_filepath)
+    if output_dir == '': output_dir = '.'
+    return os.path.join(output_dir, output_filename)
+
+def shard_filepath(filepath, shard, num_shards):
+    # type: (str, int, int) -> str
+    '''Path of the partial output written by one shard of a sharded extraction.'''
+    root, ext = os.path.splitext(filepath)
+    return '{}.shard{}of{}{}'.format(root, shard, num_shards, ext)
+
+def shard_bounds(num_frames, shard, num_shards):
+    # type: (int, int, int) -> tuple[int, int]
+    '''Start/stop indices of the contiguous block of frames handled by a shard.'''
+    return shard*num_frames//num_shards, (shard + 1)*num_frames//num_shards
+
+def output_options(odbex_cfg):
+    # type: (dict) -> dict
+    '''Options of the "output" section of the extraction config, with defaults filled in.'''
+    options = {'format': 'npz'}
+    options.update(odbex_cfg.get('output') or {})
+    if options['format'] not in FORMATS:
+        raise ValueError('unknown output format {}. valid formats: {}'.format(options['format'], ', '.join(FORMATS)))
+    if options.get('dtype') is not None and options['dtype'] not in DTYPES:
+        raise ValueError('unknown output dtype {}. valid dtypes: {}'.format(options['dtype'], ', '.join(DTYPES)))
+    if options['format'] == 'npz' and options.get('compression') not in NPZ_COMPRESSION:
+        raise ValueError('unknown npz compression {}. valid compression: deflate or null'.format(options['compression']))
+    if options.get('delta') and options['format'] != 'npz':
+        raise ValueError('delta encoding is only available for the npz output format')
+    return options
+
+def manifest_filepath(odb_filepath, prefix=None):
+    # type: (str, str | None) -> str
+    return output_filepath(odb_filepath, prefix, ext='.manifest.json')
+
+def metrics_filepath(odb_filepath, prefix=None):
+    # type: (str, str | None) -> str
+    return output_filepath(odb_filepath, prefix, ext='.metrics.json')
+
+def open_writer(odb_filepath, odbex_cfg, shard=None, incremental=False):
+    # type: (str, dict, tuple[int, int] | None, bool) -> NpzWriter | StreamWriter | ConsolidatedWriter
+    '''
+    Create the writer for the output format requested in the config.
+    Shards of a sharded extraction always write a partial .npz, which is merged into the requested format afterwards.
+    Incremental extractions append to the existing output, streaming unless it is an HDF5 file.
+    '''
+    prefix = odbex_cfg.get('export_prefix')
+    options = output_options(odbex_cfg)
+    dtype = options.get('dtype')
+    if shard is not None:
+        return NpzWriter(shard_filepath(output_filepath(odb_filepath, prefix), *shard), dtype=dtype)
+    if options['format'] == 'hdf5':
+        return HDF5Writer(output_filepath(odb_filepath, prefix, ext=HDF5_EXT), append=incremental, compression=options.get('compression', 'lzf'), dtype=dtype)
+    if options['format'] == 'stream' or incremental:
+        return StreamWriter(output_filepath(odb_filepath, prefix, ext=''), append=incremental, dtype=dtype)
+    if options['format'] == 'consolidated':
+        return ConsolidatedWriter(output_filepath(odb_filepath, prefix, ext=''), dtype=dtype)
+    return NpzWriter(output_filepath(odb_filepath, prefix), dtype=dtype, compression=options.get('compression'), delta=bool(options.get('delta')))
+
+def _join_key(*parts):
+    # type: (str) -> str
+    return KEY_SEP.join(parts)
+
+def _cast(array, dtype):
+    # type: (np.ndarray, str | None) -> np.ndarray
+    '''Floating point data in the precision it is stored in, if one is set (labels and component names are left as they are).'''
+    array = np.asarray(array)
+    if dtype is None or array.dtype.kind != 'f' or array.dtype == dtype: return array
+    return array.astype(dtype)
+
+def delta_encode(array):
+    # type: (np.ndarray) -> np.ndarray
+    '''
+    XOR of the bits of each frame (along the first axis) with those of the previous frame. Slowly varying data
+    leaves mostly zero bits, which compress far better than the data itself. The first frame is kept as is.
+    '''
+    bits = np.ascontiguousarray(array).view('u{}'.format(array.dtype.itemsize))
+    encoded = bits.copy()
+    encoded[1:] ^= bits[:-1]
+    return encoded.view(array.dtype)
+
+def delta_decode(array):
+    # type: (np.ndarray) -> np.ndarray
+    '''Inverse of delta_encode.'''
+    bits = np.ascontiguousarray(array).view('u{}'.format(array.dtype.itemsize))
+    return np.bitwise_xor.accumulate(bits, axis=0).view(array.dtype)
+
+def _relpath(parts):
+    # type: (tuple[str, ...]) -> str
+    '''Relative path of the .npy file of a key in a directory output, one directory level per key part.'''
+    return os.path.join(*[p.replace(os.sep, '_').replace('/', '_') for p in parts]) + '.npy'
+
+class FrameBuffer(object):
+    '''
+    Array the rows of each frame are copied into as they are appended, allocated once for the expected number of
+    frames (and doubled if more are appended), so that no per-frame arrays have to be kept and stacked.
+    '''
+
+    def __init__(self, row, capacity=None):
+        # type: (np.ndarray, int | None) -> None
+        row = np.asarray(row)
+        self.length = 0
+        self._data = np.empty((max(capacity or 1, 1), ) + row.shape, dtype=row.dtype)
+
+    def append(self, row):
+        # type: (np.ndarray) -> None
+        row = np.asarray(row)
+        if row.shape != self._data.shape[1:]:
+            raise ValueError('cannot append array of shape {} to frames of shape {}'.format(row.shape, self._data.shape[1:]))
+        if self.length == self._data.shape[0]:
+            grown = np.empty((2*self.length, ) + self._data.shape[1:], dtype=self._data.dtype)
+            grown[:self.length] = self._data
+            self._data = grown
+        self._data[self.length] = row
+        self.length += 1
+
+    @property
+    def array(self):
+        # type: () -> np.ndarray
+        return self._data[:self.length]
+
+class NpzWriter(object):
+    '''
+    Collects extracted data in memory and writes it to a single .npz file when closed, deflate compressed if
+    compression is "deflate". With delta, the per-frame floating point arrays are delta encoded along the frame
+    axis (see delta_encode), which only pays off when compressed.
+    '''
+
+    def __init__(self, filepath, dtype=None, compression=None, delta=False):
+        # type: (str, str | None, str | None, bool) -> None
+        self.filepath = filepath
+        self.dtype = dtype
+        self.compression = compression
+        self.delta = delta
+        self._increments = {}
+        self._appended = {}
+        self._static = {}
+        self._num_frames = {}
+
+    def reserve(self, step, num_frames):
+        # type: (str, int) -> None
+        '''Expected number of frames of a step, which the data of its regions/fields is allocated for.'''
+        self._num_frames[step] = self._num_frames.get(step, 0) + num_frames
+
+    def add_increment(self, step, frame_id, frame_value):
+        # type: (str, int, float) -> None
+        self._increments.setdefault(step, {})[frame_id] = frame_value
+
+    def append(self, step, region, field, data_id, array):
+        # type: (str, str, str, str, np.ndarray) -> None
+        '''Append the array of one frame to the data of a region/field.'''
+        key = _join_key(step, region, field, data_id)
+        array = _cast(array, self.dtype)
+        if key not in self._appended:
+            self._appended[key] = FrameBuffer(array, self._num_frames.get(step))
+        self._appended[key].append(array)
+
+    def put(self, step, region, field, data_id, array):
+        # type: (str, str, str, str, np.ndarray) -> None
+        '''Write an array once for a region/field (e.g., component labels). Later writes of the same key are ignored.'''
+        self._static.setdefault(_join_key(step, region, field, data_id), array)
+
+    def arrays(self):
+        # type: () -> dict[str, np.ndarray]
+        '''All arrays collected so far, keyed as in the output file.'''
+        flattened = dict((key, buffer.array) for key, buffer in self._appended.items())
+        flattened.update(self._static)
+        for step, increments in self._increments.items():
+            frame_ids = sorted(increments.keys())
+            flattened[_join_key(step, 'increments')] = np.array([frame_ids, [increments[i] for i in frame_ids]]).T
+        return flattened
+
+    def close(self):
+        # type: () -> None
+        output_dir = os.path.dirname(self.filepath)
+        if output_dir and not os.path.exists(output_dir): os.makedirs(output_dir)
+        arrays = self.arrays()
+        if self.delta:
+            encoded = sorted(k for k in self._appended if arrays[k].dtype.kind == 'f' and len(arrays[k]) > 1)
+            for key in encoded:
+                arrays[key] = delta_encode(arrays[key])
+            arrays[DELTA_KEY] = np.array(encoded, dtype=str)
+        save = np.savez_compressed if self.compression == 'deflate' else np.savez
+        save(self.filepath, **arrays)
+
+class MemoryWriter(NpzWriter):
+    '''Collects extracted data in memory only, for sending it on (e.g., from the extraction server) rather than writing a file.'''
+
+    def __init__(self, dtype=None):
+        # type: (str | None) -> None
+        super(MemoryWriter, self).__init__(None, dtype=dtype)
+
+    def close(self):
+        # type: () -> None
+        pass
+
+class NpzArrays(object):
+    '''STEP|REGION|FIELD|DATA_ID keyed arrays of an .npz output, each read (and delta decoded) when accessed.'''
+
+    def __init__(self, filepath):
+        # type: (str) -> None
+        self._npz = np.load(filepath)
+        self._delta = set(str(k) for k in self._npz[DELTA_KEY]) if DELTA_KEY in self._npz.files else set()
+        self.files = [k for k in self._npz.files if k != DELTA_KEY]
+
+    def keys(self):
+        # type: () -> list[str]
+        return list(self.files)
+
+    def __contains__(self, key):
+        # type: (str) -> bool
+        return key in self.files
+
+    def __getitem__(self, key):
+        # type: (str) -> np.ndarray
+        if key not in self.files: raise KeyError(key)
+        array = self._npz[key]
+        return delta_decode(array) if key in self._delta else array
+
+    def close(self):
+        # type: () -> None
+        self._npz.close()
+
+    def __enter__(self):
+        # type: () -> NpzArrays
+        return self
+
+    def __exit__(self, *args):
+        # type: (...) -> None
+        self.close()
+
+class AppendableNpy(object):
+    '''
+    A .npy file which arrays (rows) can be appended to along its first axis.
+    The header is written with a fixed length and rewritten after each append, so the file is always
+    a valid .npy holding all completely written rows. The file is only held open while appending, so
+    that any number of these can be written side by side.
+    '''
+    HEADER_LEN = 256
+    MAGIC = b'\x93NUMPY\x01\x00'
+
+    def __init__(self, filepath):
+        # type: (str) -> None
+        self.filepath = filepath
+        self.dtype, self.row_shape, self.length = None, None, 0
+        if os.path.exists(filepath):
+            with open(filepath, 'rb') as f:
+                np.lib.format.read_magic(f)
+                shape, _, self.dtype = np.lib.format.read_array_header_1_0(f)
+                if f.tell() != self.HEADER_LEN:
+                    raise ValueError('{} was not written by odbex and cannot be appended to'.format(filepath))
+            self.length, self.row_shape = shape[0], tuple(shape[1:])
+
+    def _write_header(self, f):
+        # type: (BinaryIO) -> None
+        shape = tuple(int(n) for n in (self.length, ) + self.row_shape)
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(np.lib.format.dtype_to_descr(self.dtype), shape)
+        header_len = self.HEADER_LEN - len(self.MAGIC) - 2
+        f.seek(0)
+        f.write(self.MAGIC + struct.pack('<H', header_len) + (header.ljust(header_len - 1) + '\n').encode('latin1'))
+
+    def append(self, array):
+        # type: (np.ndarray) -> None
+        array = np.asarray(array)
+        if self.dtype is None:
+            self.dtype, self.row_shape = array.dtype, tuple(array.shape)
+        if tuple(array.shape) != self.row_shape:
+            raise ValueError('cannot append array of shape {} to {} with rows of shape {}'.format(array.shape, self.filepath, self.row_shape))
+        with open(self.filepath, 'r+b' if os.path.exists(self.filepath) else 'w+b') as f:
+            if self.length == 0: self._write_header(f)
+            # Data first, then the header, so that an interrupted append leaves the previous rows readable
+            f.seek(self.HEADER_LEN + self.length*array.size*self.dtype.itemsize)
+            np.ascontiguousarray(array, dtype=self.dtype).tofile(f)
+            self.length += 1
+            self._write_header(f)
+
+class StreamWriter(object):
+    '''
+    Writes the arrays of each frame to disk as soon as they are extracted, as one appendable .npy file per key
+    in a directory, plus an index.json mapping keys to files. Memory use is bounded by a single frame, and the
+    files stay readable (up to the last complete frame) if the extraction is interrupted.
+    '''
+
+    def __init__(self, dirpath, append=False, dtype=None):
+        # type: (str, bool, str | None) -> None
+        self.filepath = dirpath
+        self.dtype = dtype
+        if os.path.isdir(dirpath) and not append: shutil.rmtree(dirpath)
+        if not os.path.isdir(dirpath): os.makedirs(dirpath)
+        self._index_filepath = os.path.join(dirpath, INDEX_FILENAME)
+        self._index = _read_index(dirpath)
+        self._files = {}
+
+    def reserve(self, step, num_frames):
+        # type: (str, int) -> None
+        '''Frames are written as they are appended, so there is nothing to allocate up front.'''
+
+    def _register(self, parts):
+        # type: (tuple[str, ...]) -> str
+        key = _join_key(*parts)
+        if key not in self._index:
+            self._index[key] = _relpath(parts)
+            filedir = os.path.dirname(os.path.join(self.filepath, self._index[key]))
+            if not os.path.isdir(filedir): os.makedirs(filedir)
+            with open(self._index_filepath, 'w') as f:
+                json.dump(self._index, f, indent=1, sort_keys=True)
+        return os.path.join(self.filepath, self._index[key])
+
+    def _append(self, parts, array):
+        # type: (tuple[str, ...], np.ndarray) -> None
+        if parts not in self._files:
+            self._files[parts] = AppendableNpy(self._register(parts))
+        self._files[parts].append(array)
+
+    def add_increment(self, step, frame_id, frame_value):
+        # type: (str, int, float) -> None
+        self._append((step, 'increments'), np.array([frame_id, frame_value], dtype=float))
+
+    def append(self, step, region, field, data_id, array):
+        # type: (str, str, str, str, np.ndarray) -> None
+        '''Append the array of one frame to the file of a region/field.'''
+        self._append((step, region, field, data_id), _cast(array, self.dtype))
+
+    def put(self, step, region, field, data_id, array):
+        # type: (str, str, str, str, np.ndarray) -> None
+        '''
+        Write an array once for a region/field (e.g., component labels). Later writes of the same key are ignored,
+        except for history outputs, which are replaced by the longer series of a later (incremental) extraction.
+        '''
+        parts = (step, region, field, data_id)
+        if _join_key(*parts) in self._index and data_id != HISTORY_DATA_ID: return
+        np.save(self._register(parts), array)
+
+    def close(self):
+        # type: () -> None
+        self._files = {}
+
+class ConsolidatedWriter(object):
+    '''
+    Collects extracted data in memory and, when closed, writes one array per step/field/data id to a directory of
+    .npy files, with the data of all regions stacked along the second axis: (frames, output locations, components).
+    Averaged regions take up one output location. Frames or components missing for a region are NaN.
+    History outputs are not stacked, but written as they are to one .npy file each.
+    consolidated.json maps each region id to its slice of the output locations, so that a region, component or
+    frame window can be read from a memory-mapped array without loading the rest.
+    '''
+
+    def __init__(self, dirpath, dtype=None):
+        # type: (str, str | None) -> None
+        self.filepath = dirpath
+        self.dtype = dtype
+        self._increments = {}
+        self._appended = {}
+        self._static = {}
+
+    def reserve(self, step, num_frames):
+        # type: (str, int) -> None
+        '''Frames are kept as appended and stacked over regions when closed, so there is nothing to allocate up front.'''
+
+    def add_increment(self, step, frame_id, frame_value):
+        # type: (str, int, float) -> None
+        self._increments.setdefault(step, {})[frame_id] = frame_value
+
+    def append(self, step, region, field, data_id, array):
+        # type: (str, str, str, str, np.ndarray) -> None
+        '''Append the array of one frame to the data of a region/field.'''
+        # Increments are added after the data of their frame, so the frame is the number of increments added so far
+        frame = len(self._increments.get(step, {}))
+        self._appended.setdefault((step, field, data_id), {}).setdefault(region, []).append((frame, _cast(array, self.dtype)))
+
+    def put(self, step, region, field, data_id, array):
+        # type: (str, str, str, str, np.ndarray) -> None
+        '''Write an array once for a region/field (e.g., component labels). Later writes of the same key are ignored.'''
+        self._static.setdefault((step, field, data_id), {}).setdefault(region, np.asarray(array))
+
+    def _save(self, parts, array):
+        # type: (tuple[str, ...], np.ndarray) -> str
+        relpath = _relpath(parts)
+        filepath = os.path.join(self.filepath, relpath)
+        if not os.path.isdir(os.path.dirname(filepath)): os.makedirs(os.path.dirname(filepath))
+        np.save(filepath, array)
+        return relpath
+
+    def _field_layout(self, step, field, data_ids):
+        # type: (str, str, list[str]) -> tuple[dict[str, dict], list[str]]
+        '''Slice of the output locations and component labels of each region of a field.'''
+        shapes = {}
+        for data_id in data_ids:
+            for region, frames in self._appended[(step, field, data_id)].items():
+                shapes.setdefault(region, frames[0][1].shape)
+        regions, components, start = {}, [], 0
+        for region in sorted(shapes):
+            averaged = len(shapes[region]) < 2
+            stop = start + (1 if averaged else shapes[region][0])
+            regions[region] = {'start': start, 'stop': stop, 'averaged': averaged}
+            start = stop
+            region_components = self._static.get((step, field, 'components'), {}).get(region)
+            if region_components is None: region_components = [str(i) for i in range(shapes[region][-1])]
+            components += [c for c in decode_labels(region_components) if c not in components]
+        return regions, components
+
+    def _stack(self, step, field, data_id, regions, components, num_frames):
+        # type: (str, str, str, dict[str, dict], list[str], int) -> np.ndarray
+        by_region = self._appended[(step, field, data_id)]
+        dtype = np.result_type(np.float32, *[frames[0][1].dtype for frames in by_region.values()])
+        num_frames = max([num_frames] + [frames[-1][0] + 1 for frames in by_region.values()])
+        num_locations = max(r['stop'] for r in regions.values())
+        stacked = np.full((num_frames, num_locations, len(components)), np.nan, dtype=dtype)
+        for region, frames in by_region.items():
+            r = regions[region]
+            region_components = self._static.get((step, field, 'components'), {}).get(region)
+            if region_components is None: region_components = [str(i) for i in range(frames[0][1].shape[-1])]
+            columns = [components.index(c) for c in decode_labels(region_components)]
+            for frame, array in frames:
+                stacked[frame, r['start']:r['stop']][:, columns] = array.reshape(r['stop'] - r['start'], -1)
+        return stacked
+
+    def close(self):
+        # type: () -> None
+        if os.path.isdir(self.filepath): shutil.rmtree(self.filepath)
+        os.makedirs(self.filepath)
+        index = {}
+        for step, increments in self._increments.items():
+            frame_ids = sorted(increments.keys())
+            increments = np.array([frame_ids, [increments[i] for i in frame_ids]], dtype=float).T
+            index.setdefault(step, {'fields': {}})['increments'] = self._save((step, 'increments'), increments)
+        fields = {}
+        for step, field, data_id in self._appended:
+            fields.setdefault((step, field), []).append(data_id)
+        for (step, field), data_ids in fields.items():
+            regions, components = self._field_layout(step, field, data_ids)
+            num_frames = len(self._increments.get(step, {}))
+            arrays = {}
+            for data_id in data_ids:
+                arrays[data_id] = self._save((step, field, data_id), self._stack(step, field, data_id, regions, components, num_frames))
+            # Labels/integration points of the output locations, -1 for averaged regions
+            for data_id in INDEX_DATA_IDS:
+                by_region = self._static.get((step, field, data_id))
+                if not by_region: continue
+                index_data = np.full(max(r['stop'] for r in regions.values()), -1, dtype=int)
+                for region, array in by_region.items():
+                    if region in regions and not regions[region]['averaged']:
+                        index_data[regions[region]['start']:regions[region]['stop']] = array
+                arrays[data_id] = self._save((step, field, data_id), index_data)
+            index.setdefault(step, {'fields': {}})['fields'][field] = {'components': components, 'regions': regions, 'arrays': arrays}
+        # History outputs have their own time axis, so they are kept as they are rather than stacked
+        for (step, field, data_id), by_region in self._static.items():
+            if data_id != HISTORY_DATA_ID: continue
+            for region, array in by_region.items():
+                step_index = index.setdefault(step, {'fields': {}}).setdefault('history', {})
+                step_index.setdefault(region, {})[field] = self._save((step, region, field, data_id), array)
+        with open(os.path.join(self.filepath, CONSOLIDATED_INDEX_FILENAME), 'w') as f:
+            json.dump({'steps': index}, f, indent=1, sort_keys=True)
+
+class HDF5Writer(object):
+    '''
+    Writes the arrays of each frame to an HDF5 file as soon as they are extracted, with one dataset per
+    STEP/REGION/FIELD/DATA_ID. Datasets are resizable along the frame axis, so frames can be appended in place,
+    and are chunked and compressed so that a component or frame window of a large unaveraged extraction can be
+    read without decompressing the rest. Component labels are stored as an attribute of the field group, and
+    increments as a STEP/increments dataset.
+    '''
+    CHUNK_BYTES = 1024**2
+    MAX_CHUNK_FRAMES = 256
+
+    def __init__(self, filepath, append=False, compression='lzf', dtype=None):
+        # type: (str, bool, str | None, str | None) -> None
+        if h5py is None:
+            raise ImportError('the hdf5 output format requires h5py, which is not installed for this python interpreter')
+        self.filepath = filepath
+        self.compression = compression
+        self.dtype = dtype
+        output_dir = os.path.dirname(filepath)
+        if output_dir and not os.path.exists(output_dir): os.makedirs(output_dir)
+        self._file = h5py.File(filepath, 'a' if append else 'w')
+
+    def reserve(self, step, num_frames):
+        # type: (str, int) -> None
+        '''Frames are written as they are appended, so there is nothing to allocate up front.'''
+
+    @staticmethod
+    def _path(parts):
+        # type: (tuple[str, ...]) -> str
+        return '/'.join(p.replace('/', '_') for p in parts)
+
+    def _chunks(self, array):
+        # type: (np.ndarray) -> tuple[int, ...]
+        '''Chunk of a few frames of the array, splitting the output locations of large unaveraged arrays.'''
+        chunk = list(array.shape)
+        if array.ndim > 1:
+            location_bytes = max(int(np.prod(array.shape[1:]))*array.dtype.itemsize, 1)
+            chunk[0] = min(array.shape[0], max(self.CHUNK_BYTES//location_bytes, 1))
+        frames = min(max(self.CHUNK_BYTES//max(int(np.prod(chunk))*array.dtype.itemsize, 1), 1), self.MAX_CHUNK_FRAMES)
+        return tuple([frames] + [max(n, 1) for n in chunk])
+
+    def _append(self, parts, array):
+        # type: (tuple[str, ...], np.ndarray) -> None
+        array = np.asarray(array)
+        path = self._path(parts)
+        if path not in self._file:
+            self._file.create_dataset(
+                path, shape=(0, ) + array.shape, maxshape=(None, ) + array.shape, dtype=array.dtype,
+                chunks=self._chunks(array), compression=self.compression
+            )
+        dataset = self._file[path]
+        if tuple(dataset.shape[1:]) != array.shape:
+            raise ValueError('cannot append array of shape {} to {} with rows of shape {}'.format(array.shape, path, dataset.shape[1:]))
+        dataset.resize(dataset.shape[0] + 1, axis=0)
+        dataset[-1] = array
+
+    def add_increment(self, step, frame_id, frame_value):
+        # type: (str, int, float) -> None
+        path = self._path((step, 'increments'))
+        if path in self._file and self._file[path].shape[0] and self._file[path][-1, 0] >= frame_id: return
+        self._append((step, 'increments'), np.array([frame_id, frame_value], dtype=float))
+        # The data of the frame is complete, so make sure it is on disk
+        self._file.flush()
+
+    def append(self, step, region, field, data_id, array):
+        # type: (str, str, str, str, np.ndarray) -> None
+        '''Append the array of one frame to the dataset of a region/field.'''
+        self._append((step, region, field, data_id), _cast(array, self.dtype))
+
+    def put(self, step, region, field, data_id, array):
+        # type: (str, str, str, str, np.ndarray) -> None
+        '''
+        Write an array once for a region/field (e.g., component labels). Later writes of the same key are ignored,
+        except for history outputs, which are replaced by the longer series of a later (incremental) extraction.
+        '''
+        group = self._file.require_group(self._path((step, region, field)))
+        if data_id == 'components':
+            if 'components' not in group.attrs:
+                group.attrs['components'] = np.array(decode_labels(array)).astype('S')
+        elif data_id == HISTORY_DATA_ID:
+            if data_id in group: del group[data_id]
+            group.create_dataset(data_id, data=np.asarray(array), compression=self.compression)
+        elif data_id not in group:
+            group.create_dataset(data_id.replace('/', '_'), data=np.asarray(array), compression=self.compression)
+
+    def close(self):
+        # type: () -> None
+        self._file.close()
+
+class Manifest(object):
+    '''
+    Record of the last frame id extracted for each step and step/region/field of a streamed output,
+    so that an incremental extraction only has to extract (and append) frames written since.
+    '''
+
+    def __init__(self, filepath, odb_filepath, reset=False):
+        # type: (str, str, bool) -> None
+        self.filepath = filepath
+        self._manifest = {'odb': os.path.abspath(odb_filepath), 'steps': {}}
+        if os.path.exists(filepath) and not reset:
+            with open(filepath, 'r') as f:
+                self._manifest = json.load(f)
+
+    def _step(self, step):
+        # type: (str) -> dict
+        return self._manifest['steps'].setdefault(step, {'increments': -1, 'fields': {}})
+
+    def last_increment(self, step):
+        # type: (str) -> int
+        return self._step(step)['increments']
+
+    def last_frame_id(self, step, region, field):
+        # type: (str, str, str) -> int
+        return self._step(step)['fields'].get(_join_key(region, field), -1)
+
+    def update(self, step, frame_id, region_fields):
+        # type: (str, int, list[tuple[str, str]]) -> None
+        step_manifest = self._step(step)
+        step_manifest['increments'] = max(step_manifest['increments'], frame_id)
+        for region, field in region_fields:
+            step_manifest['fields'][_join_key(region, field)] = frame_id
+
+    def save(self):
+        # type: () -> None
+        with open(self.filepath, 'w') as f:
+            json.dump(self._manifest, f, indent=1, sort_keys=True)
+
+def _read_index(dirpath):
+    # type: (str) -> dict[str, str]
+    index_filepath = os.path.join(dirpath, INDEX_FILENAME)
+    if not os.path.exists(index_filepath): return {}
+    with open(index_filepath, 'r') as f:
+        return json.load(f)
+
+def load_stream(dirpath, mmap_mode='r'):
+    # type: (str, str | None) -> dict[str, np.ndarray]
+    '''Load all arrays of a streamed output directory (memory-mapped by default) keyed by STEP|REGION|FIELD|DATA_ID.'''
+    return dict(
+        (key, np.load(os.path.join(dirpath, relpath), mmap_mode=mmap_mode))
+        for key, relpath in _read_index(dirpath).items()
+    )
+
+def read_consolidated_index(dirpath):
+    # type: (str) -> dict
+    with open(os.path.join(dirpath, CONSOLIDATED_INDEX_FILENAME), 'r') as f:
+        return json.load(f)['steps']
+
+def load_consolidated(dirpath, mmap_mode='r'):
+    # type: (str, str | None) -> dict[str, np.ndarray]
+    '''
+    Load a consolidated output directory as STEP|REGION|FIELD|DATA_ID keyed arrays, as for the other formats.
+    The arrays are views of the (memory-mapped by default) stacked arrays, so nothing is read until they are sliced.
+    '''
+    arrays = {}
+    for step, step_index in read_consolidated_index(dirpath).items():
+        if 'increments' in step_index:
+            arrays[_join_key(step, 'increments')] = np.load(os.path.join(dirpath, step_index['increments']), mmap_mode=mmap_mode)
+        for region, outputs in step_index.get('history', {}).items():
+            for field, relpath in outputs.items():
+                arrays[_join_key(step, region, field, HISTORY_DATA_ID)] = np.load(os.path.join(dirpath, relpath), mmap_mode=mmap_mode)
+        for field, field_index in step_index['fields'].items():
+            stacked = dict(
+                (data_id, np.load(os.path.join(dirpath, relpath), mmap_mode=mmap_mode))
+                for data_id, relpath in field_index['arrays'].items()
+            )
+            for region, r in field_index['regions'].items():
+                locations = slice(r['start'], r['stop'])
+                for data_id, array in stacked.items():
+                    if data_id in INDEX_DATA_IDS:
+                        if r['averaged']: continue
+                        view = array[locations]
+                    elif r['averaged']:
+                        view = array[:, r['start']]
+                    elif data_id == 'std':
+                        continue
+                    else:
+                        view = array[:, locations]
+                    arrays[_join_key(step, region, field, data_id)] = view
+                arrays[_join_key(step, region, field, 'components')] = np.array(field_index['components'])
+    return arrays
+
+def replay(arrays, writer, increments=True):
+    # type: (Mapping[str, np.ndarray], NpzWriter | StreamWriter | ConsolidatedWriter, bool) -> None
+    '''
+    Write STEP|REGION|FIELD|DATA_ID keyed arrays (e.g., from a saved output) to a writer.
+    The rows of each step are written frame by frame, each frame followed by its increment, as in an extraction.
+    '''
+    steps, step_increments, per_frame = [], {}, {}
+    for key in arrays.keys():
+        parts = key.split(KEY_SEP)
+        if parts[0] not in steps: steps.append(parts[0])
+        if parts[-1] == 'increments':
+            if increments: step_increments[parts[0]] = arrays[key]
+        elif parts[-1] in STATIC_DATA_IDS:
+            writer.put(*(parts + [arrays[key]]))
+        else:
+            per_frame.setdefault(parts[0], []).append((parts, arrays[key]))
+    for step in steps:
+        step_data, step_incs = per_frame.get(step, []), step_increments.get(step, [])
+        if len(step_incs): writer.reserve(step, len(step_incs))
+        for i in range(max([len(step_incs)] + [len(data) for _, data in step_data])):
+            for parts, data in step_data:
+                if i < len(data): writer.append(*(parts + [data[i]]))
+            if i < len(step_incs): writer.add_increment(step, int(step_incs[i][0]), step_incs[i][1])
+
+def merge_shards(shard_filepaths, writer):
+    # type: (list[str], NpzWriter | StreamWriter | ConsolidatedWriter) -> None
+    '''
+    Merge the partial .npz outputs of a sharded extraction into a writer, giving the same layout as an
+    unsharded extraction. Shards must be given in frame order.
+    '''
+    for fp in shard_filepaths:
+        with NpzArrays(fp) as shard:
+            replay(shard, writer)
+    writer.close()
@@ -0,0 +1,35 @@
+"""
+Helpers for the region definitions of the extraction config which do not need the odb.
+Standard library and numpy only, so that it can be imported from either interpreter.
+"""
+import numpy as np
+
+MESH_NUMBER_PREFIX = {'element': 'E', 'node': 'N'}
+
+def make_number_slice(numbers):
+    # type: (list) -> np.ndarray:
+    '''
+    Convert a list of element/node numbers into an array for slicing.
+    If the list contains a string, the strings can be of a single integer (e.g., "1") or
+    a range of integers in the form "START-STOP" (e.g., "1-10").
+    '''
+    nums = []
+    for n in numbers:
+        if type(n) == int: nums.append(n)
+        if type(n) == str:
+            if '-' in n:  # Range of values
+                start, stop = n.split('-')
+                nums += np.arange(int(start), int(stop) + 1).tolist()
+            else: nums.append(int(n))  # Convert string to int
+    return np.unique(nums)
+
+def region_ids(extraction_definition):
+    # type: (dict) -> list[str]
+    '''
+    Ids the data of an extraction definition is written under: the set name for sets, the given id for
+    spatial selections, or one id per element/node label (e.g., E1, E2, ...) for numbers.
+    '''
+    if extraction_definition['type'].lower() == 'number':
+        pfx = MESH_NUMBER_PREFIX[extraction_definition['mesh'].lower()]
+        return ['{}{}'.format(pfx, n) for n in make_number_slice(extraction_definition['id'])]
+    return [extraction_definition['id']]
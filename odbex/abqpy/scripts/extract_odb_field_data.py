@@ -40,13 +40,6 @@ def _export_extracted_data(extracted, file_basename, directory=None, prefix="ext
     with open(filepath, "w") as f:
         json.dump(extracted, f, indent=4)    
 
-def _get_integration_point_volumes(odb_handler, frames, mesh_subset):
-    # type: (oex.extract.OdbHandler, list[OdbFrame], oex.extract.MeshSubset) -> list[np.ndarray] | None
-    ipt_vols = None
-    if mesh_subset.type == "element":
-        ipt_vols = odb_handler.get_integration_point_volumes(frames, mesh_subset.mesh)
-    return ipt_vols
-
 def _get_frames(odb_handler, analysis_step, num_frames):
     # type: (oex.extract.OdbHandler, OdbStep, int | None) -> tuple[list[OdbFrame], list[float]]
     frames = odb_handler.slice_step_frames(analysis_step.frames, num_frames=num_frames)
@@ -59,38 +52,29 @@ def _set_subset_key(mesh_subset):
     if type(subset_key) == int: subset_key = "{}{}".format(mesh_subset.type[0].upper(), subset_key)
     return subset_key
 
-def _extract_fields_from_subset(mesh_subset, field_vars, frames, frame_timevals, ipt_vols=None):
-    # type: (oex.extract.MeshSubset, list[str], list[OdbFrame], list[float], list[np.ndarray]) -> dict[str, list[dict[str, float]]]
-    field_data_dicts = {}
-    for field in field_vars:
-        fde = oex.extract.FieldDataExtractor(mesh_subset.mesh, field, frames)
-        fde.extract(ipt_vols=ipt_vols)
-        field_data_dicts.update({field: fde.data_to_records(frame_timevals)})
-        print("Data for field var {} on the current subset sucessfully extracted".format(field))
-    return field_data_dicts
-
 def _update_step_dict_with_field_data(step_dict, subset_key, field_data_dicts):
     # type: (dict, str, dict[str, list[dict[str, float]]]) -> None
     step_dict.update({subset_key: {k: v for k, v in field_data_dicts.items()}})
     
-def _request_field_data(odb_handler, frames, frame_timevals, analysis_step, extraction_dict, field_requests):
-    # type: (oex.extract.OdbHandler, list[OdbFrame], list[int], OdbStep, dict, list[oex.extract.FieldRequest]) -> None
-    for fr in field_requests:
-        ipt_vols = _get_integration_point_volumes(odb_handler, frames, fr.mesh_subset)
+def _request_field_data(odb_handler, frames, frame_timevals, analysis_step, extraction_dict, field_requests, constant_volumes=False):
+    # type: (oex.extract.OdbHandler, list[OdbFrame], list[int], OdbStep, dict, list[oex.extract.FieldRequest], bool) -> None
+    # All requests are read in a single pass over the frames, sharing the reads of common fields and subsets
+    plan = oex.extract.ExtractionPlan(field_requests, constant_volumes=constant_volumes)
+    for fr, (extractors, _) in zip(field_requests, plan.execute(frames)):
         subset_key = _set_subset_key(fr.mesh_subset)
-        print("Extracting fields on model subset {}...".format(subset_key))
-        field_data_dicts = _extract_fields_from_subset(fr.mesh_subset, fr.field_vars, frames, frame_timevals, ipt_vols)          
+        print("Data for fields {} on model subset {} sucessfully extracted".format(", ".join(extractors), subset_key))
+        field_data_dicts = dict((field, fde.data_to_records(frame_timevals)) for field, fde in extractors.items())
         _update_step_dict_with_field_data(extraction_dict[analysis_step.name], subset_key, field_data_dicts)
 
-def _extract_from_odb(filepath, config_field_requests, num_frames=None):
-    # type: (str, list[dict[str, str | list]], int | None) -> dict
+def _extract_from_odb(filepath, config_field_requests, num_frames=None, constant_volumes=False):
+    # type: (str, list[dict[str, str | list]], int | None, bool) -> dict
     odb_handler = oex.extract.OdbHandler(filepath)
     field_requests = oex.extract.field_requests_from_config(config_field_requests, odb_handler)
     extraction_dict = {}
     for step in odb_handler.analysis_steps:
         extraction_dict.update({step.name: {}})
         frames, frame_timevals = _get_frames(odb_handler, step, num_frames)
-        _request_field_data(odb_handler, frames, frame_timevals, step, extraction_dict, field_requests)
+        _request_field_data(odb_handler, frames, frame_timevals, step, extraction_dict, field_requests, constant_volumes)
     return extraction_dict
 
 def main(args):
@@ -99,5 +83,5 @@ def main(args):
     for fp in _get_odb_filepaths(cfg):
         print("**Extracting field data from {}...".format(fp))
         file_basename = os.path.splitext(os.path.basename(fp))[0]
-        extracted = _extract_from_odb(fp, cfg["field_requests"], cfg["slice_frames_by"])
+        extracted = _extract_from_odb(fp, cfg["field_requests"], cfg["slice_frames_by"], cfg.get("constant_volumes", False))
         _export_extracted_data(extracted, file_basename, **cfg["export"])
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""
+Long-lived extraction server, run under abaqus python with
+
+    abaqus python odbex/abqpy/serve.py [--port PORT] [--max-open N] [--state-file PATH]
+
+The most recently used odbs are kept open, so that repeated queries from Python 3 (odbex.client) skip both the
+interpreter startup and openOdb. Requests take the same extraction definitions as the odbex config, and the
+extracted arrays are sent back with odbex.abqpy.framing. The server only listens on the loopback interface, and
+only answers requests carrying the token it writes, with its port, to its state file.
+"""
+import argparse
+import binascii
+import json
+import os
+import traceback
+from collections import OrderedDict
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from odbAccess import openOdb
+
+from . import _json, extractor, framing, metrics, output
+
+HOST = '127.0.0.1'
+DEFAULT_MAX_OPEN = 4
+STATE_FILE_ENV = 'ODBEX_SERVER_FILE'
+DEFAULT_STATE_FILE = os.path.join(os.path.expanduser('~'), '.odbex', 'server.json')
+
+def state_filepath(filepath=None):
+    # type: (str | None) -> str
+    return filepath or os.environ.get(STATE_FILE_ENV, DEFAULT_STATE_FILE)
+
+def _file_stamp(filepath):
+    # type: (str) -> tuple[float, int] | None
+    '''Modification time and size of a file, to tell whether an open odb was written to since (e.g., by a running analysis).'''
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+class OdbPool(object):
+    '''
+    Open odbs, keyed by absolute path, closing the least recently used beyond max_open.
+    An odb is reopened if its file has changed since it was opened.
+    '''
+
+    def __init__(self, max_open=DEFAULT_MAX_OPEN):
+        # type: (int) -> None
+        self.max_open = max_open
+        self.opened = 0
+        self._odbs = OrderedDict()
+
+    @property
+    def paths(self):
+        # type: () -> list[str]
+        return list(self._odbs.keys())
+
+    def get(self, odb_filepath):
+        # type: (str) -> Odb
+        odb_filepath = os.path.abspath(odb_filepath)
+        stamp = _file_stamp(odb_filepath)
+        entry = self._odbs.pop(odb_filepath, None)
+        if entry is not None and entry[1] != stamp:
+            entry[0].close()
+            entry = None
+        if entry is None:
+            with metrics.phase('open_odb'):
+                entry = (openOdb(odb_filepath, readOnly=True), stamp)
+            self.opened += 1
+        self._odbs[odb_filepath] = entry
+        while len(self._odbs) > self.max_open:
+            _, (odb, _) = self._odbs.popitem(last=False)
+            odb.close()
+        return entry[0]
+
+    def close(self, odb_filepath=None):
+        # type: (str | None) -> None
+        '''Close an odb, or all of them.'''
+        paths = self.paths if odb_filepath is None else [os.path.abspath(odb_filepath)]
+        for path in paths:
+            entry = self._odbs.pop(path, None)
+            if entry is not None: entry[0].close()
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # type: () -> None
+        try:
+            request, _ = framing.read_message(self.rfile)
+        except (EOFError, ValueError):
+            return
+        arrays = None
+        if request.get('token') != self.server.token:
+            response = {'ok': False, 'error': 'invalid token'}
+        else:
+            try:
+                response, arrays = self.server.handle_command(request)
+            except Exception as e:
+                traceback.print_exc()
+                response = {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+        framing.write_message(self.wfile, response, arrays)
+
+class ExtractionServer(socketserver.TCPServer):
+    '''
+    Serves one request per connection, one at a time (odbAccess is not thread-safe). Commands are "ping",
+    "extract" (odb, cfg), "close" (odb, or all odbs if not given) and "shutdown".
+    '''
+    allow_reuse_address = True
+
+    def __init__(self, address, token, pool):
+        # type: (tuple[str, int], str, OdbPool) -> None
+        socketserver.TCPServer.__init__(self, address, _RequestHandler)
+        self.token = token
+        self.pool = pool
+        self.running = True
+
+    def handle_command(self, request):
+        # type: (dict) -> tuple[dict, dict[str, np.ndarray] | None]
+        command = request.get('command')
+        if command == 'ping':
+            return {'ok': True, 'pid': os.getpid(), 'open': self.pool.paths, 'opened': self.pool.opened}, None
+        if command == 'extract':
+            # Under abaqus python 2, decoded json strings are unicode, which the config parsing does not expect
+            request = _json.byteify(request)
+            odb_filepath = os.path.abspath(request['odb'])
+            extraction_metrics = metrics.start(odb_filepath)
+            odb = self.pool.get(odb_filepath)
+            writer = output.MemoryWriter(dtype=output.output_options(request['cfg']).get('dtype'))
+            extractor.extract_odb(odb, request['cfg'], writer)
+            arrays = writer.arrays()
+            extraction_metrics.bytes_written = sum(int(a.nbytes) for a in arrays.values())
+            return {'ok': True, 'metrics': extraction_metrics.to_dict()}, arrays
+        if command == 'close':
+            self.pool.close(request.get('odb'))
+            return {'ok': True}, None
+        if command == 'shutdown':
+            self.running = False
+            return {'ok': True}, None
+        return {'ok': False, 'error': 'unknown command {}'.format(command)}, None
+
+    def serve(self):
+        # type: () -> None
+        while self.running:
+            self.handle_request()
+        self.pool.close()
+        self.server_close()
+
+def write_state(filepath, port, token):
+    # type: (str, int, str) -> None
+    '''Write the port and token of the server to its state file, readable by the user only.'''
+    directory = os.path.dirname(filepath)
+    if directory and not os.path.exists(directory): os.makedirs(directory)
+    # Written aside and renamed, so that clients waiting for the file never read it partially written
+    tmp_filepath = '{}.{}.tmp'.format(filepath, os.getpid())
+    fd = os.open(tmp_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'host': HOST, 'port': port, 'token': token, 'pid': os.getpid()}, f)
+    if os.path.exists(filepath): os.remove(filepath)
+    os.rename(tmp_filepath, filepath)
+
+def main():
+    # type: () -> None
+    parser = argparse.ArgumentParser(prog='odbex-server')
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on (on the loopback interface). Defaults to any free port.')
+    parser.add_argument('--max-open', type=int, default=DEFAULT_MAX_OPEN, help='Number of odbs kept open.')
+    parser.add_argument('--state-file', default=None, help='File the port and token are written to. Defaults to ${} or {}.'.format(STATE_FILE_ENV, DEFAULT_STATE_FILE))
+    args = parser.parse_args()
+
+    token = binascii.hexlify(os.urandom(16)).decode('ascii')
+    server = ExtractionServer((HOST, args.port), token, OdbPool(args.max_open))
+    filepath = state_filepath(args.state_file)
+    write_state(filepath, server.server_address[1], token)
+    print('odbex server listening on {}:{} (state file: {})'.format(HOST, server.server_address[1], filepath))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        server.pool.close()
+    finally:
+        if os.path.exists(filepath): os.remove(filepath)
+    print('odbex server stopped')
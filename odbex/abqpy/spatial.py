@@ -0,0 +1,126 @@
+"""
+Geometric selection of the elements (by centroid) or nodes of an instance, for the spatial region types of the
+extraction config:
+    {"type": "box", "geometry": {"min": [x, y, z], "max": [x, y, z]}}
+    {"type": "sphere", "geometry": {"center": [x, y, z], "radius": r}}
+    {"type": "cylinder", "geometry": {"start": [x, y, z], "end": [x, y, z], "radius": r}}
+    {"type": "slab", "geometry": {"point": [x, y, z], "normal": [x, y, z], "distance": d}}
+(a slab holds the points within distance d of the plane through point with the given normal).
+Candidates are looked up in a uniform grid over the points, built once per instance, and only those are tested
+exactly. Numpy only, so that it can be imported from either interpreter.
+"""
+import numpy as np
+
+SELECTORS = ('box', 'sphere', 'cylinder', 'slab')
+SELECTOR_KEYS = {
+    'box': ('min', 'max'),
+    'sphere': ('center', 'radius'),
+    'cylinder': ('start', 'end', 'radius'),
+    'slab': ('point', 'normal', 'distance'),
+}
+POINTS_PER_CELL = 8
+
+class GridIndex(object):
+    '''
+    Uniform grid over points, with cells sized for POINTS_PER_CELL points each on average. The points are sorted
+    by cell, so that the points of any block of cells are found with a binary search per cell.
+    '''
+
+    def __init__(self, points, points_per_cell=POINTS_PER_CELL):
+        # type: (np.ndarray, int) -> None
+        self.points = np.asarray(points, dtype=float).reshape(len(points), -1)
+        num_points, dim = self.points.shape
+        self.lower = self.points.min(axis=0) if num_points else np.zeros(dim)
+        self.upper = self.points.max(axis=0) if num_points else np.zeros(dim)
+        extent = self.upper - self.lower
+        # Only the dimensions the points extend in are divided, e.g. for a flat mesh
+        spread = extent[extent > 0]
+        cell_size = (np.prod(spread)*points_per_cell/max(num_points, 1))**(1./len(spread)) if len(spread) else 1.
+        self.cell_size = max(cell_size, 1e-12)
+        self.shape = tuple(int(n) for n in np.floor(extent/self.cell_size).astype(int) + 1)
+        cells = np.ravel_multi_index(self._cells(self.points).T, self.shape) if num_points else np.zeros(0, dtype=int)
+        self._order = np.argsort(cells, kind='mergesort')
+        self._sorted_cells = cells[self._order]
+
+    def _cells(self, points):
+        # type: (np.ndarray) -> np.ndarray
+        cells = np.floor((points - self.lower)/self.cell_size).astype(int)
+        return np.clip(cells, 0, np.array(self.shape) - 1)
+
+    def candidates(self, lower, upper):
+        # type: (np.ndarray, np.ndarray) -> np.ndarray
+        '''Sorted indices of the points in the cells overlapping the box [lower, upper].'''
+        lower, upper = np.maximum(lower, self.lower), np.minimum(upper, self.upper)
+        if len(self._order) == 0 or np.any(lower > upper): return np.zeros(0, dtype=int)
+        lo, hi = self._cells(lower[None])[0], self._cells(upper[None])[0]
+        grids = np.meshgrid(*[np.arange(l, h + 1) for l, h in zip(lo, hi)], indexing='ij')
+        cells = np.ravel_multi_index([g.ravel() for g in grids], self.shape)
+        starts = np.searchsorted(self._sorted_cells, cells, side='left')
+        lengths = np.searchsorted(self._sorted_cells, cells, side='right') - starts
+        total = int(lengths.sum())
+        if total == 0: return np.zeros(0, dtype=int)
+        # Concatenation of the ranges starts[i]:starts[i] + lengths[i]
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return np.sort(self._order[positions])
+
+def _vector(spec, key, dim):
+    # type: (dict, str, int) -> np.ndarray
+    vector = np.asarray(spec[key], dtype=float).reshape(-1)
+    if len(vector) != dim:
+        raise ValueError('"{}" of a spatial selection must have {} coordinates, got {}'.format(key, dim, len(vector)))
+    return vector
+
+def _check(selector, spec):
+    # type: (str, dict) -> None
+    if selector not in SELECTORS:
+        raise ValueError('unknown spatial selection {}. valid selections: {}'.format(selector, ', '.join(SELECTORS)))
+    missing = [k for k in SELECTOR_KEYS[selector] if k not in spec]
+    if missing:
+        raise ValueError('{} selection requires "geometry" with {} (missing {})'.format(
+            selector, ', '.join(SELECTOR_KEYS[selector]), ', '.join(missing)
+        ))
+
+def bounds(selector, spec, dim):
+    # type: (str, dict, int) -> tuple[np.ndarray, np.ndarray]
+    '''Axis-aligned bounding box of a selection (infinite along the plane of a slab).'''
+    _check(selector, spec)
+    if selector == 'box':
+        return _vector(spec, 'min', dim), _vector(spec, 'max', dim)
+    if selector == 'sphere':
+        center, radius = _vector(spec, 'center', dim), float(spec['radius'])
+        return center - radius, center + radius
+    if selector == 'cylinder':
+        start, end, radius = _vector(spec, 'start', dim), _vector(spec, 'end', dim), float(spec['radius'])
+        return np.minimum(start, end) - radius, np.maximum(start, end) + radius
+    point, normal, distance = _vector(spec, 'point', dim), _vector(spec, 'normal', dim), float(spec['distance'])
+    lower, upper = np.full(dim, -np.inf), np.full(dim, np.inf)
+    axes = np.flatnonzero(normal)
+    if len(axes) == 1:
+        lower[axes[0]], upper[axes[0]] = point[axes[0]] - distance, point[axes[0]] + distance
+    return lower, upper
+
+def contains(selector, spec, points):
+    # type: (str, dict, np.ndarray) -> np.ndarray
+    '''Mask of the points within a selection.'''
+    _check(selector, spec)
+    dim = points.shape[1]
+    if selector == 'box':
+        return np.all((points >= _vector(spec, 'min', dim)) & (points <= _vector(spec, 'max', dim)), axis=1)
+    if selector == 'sphere':
+        return np.sum((points - _vector(spec, 'center', dim))**2, axis=1) <= float(spec['radius'])**2
+    if selector == 'cylinder':
+        start, end = _vector(spec, 'start', dim), _vector(spec, 'end', dim)
+        axis = end - start
+        if not np.any(axis): raise ValueError('cylinder selection requires distinct "start" and "end"')
+        t = np.dot(points - start, axis)/np.dot(axis, axis)
+        radial = points - start - t[:, None]*axis
+        return (t >= 0.) & (t <= 1.) & (np.sum(radial**2, axis=1) <= float(spec['radius'])**2)
+    normal = _vector(spec, 'normal', dim)
+    if not np.any(normal): raise ValueError('slab selection requires a non-zero "normal"')
+    return np.abs(np.dot(points - _vector(spec, 'point', dim), normal/np.linalg.norm(normal))) <= float(spec['distance'])
+
+def select(index, selector, spec):
+    # type: (GridIndex, str, dict) -> np.ndarray
+    '''Sorted indices of the points of an index within a selection.'''
+    candidates = index.candidates(*bounds(selector, spec, index.points.shape[1]))
+    return candidates[contains(selector, spec, index.points[candidates])]
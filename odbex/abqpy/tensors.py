@@ -0,0 +1,82 @@
+"""
+Closed-form, vectorized invariants of symmetric second-order tensor field data (stress, strain).
+Computed with numpy from the tensor components already extracted from the odb, in place of
+asking Abaqus for each invariant through FieldOutput.getScalarField.
+"""
+import numpy as np
+
+INVARIANTS = ('MAXPRINC', 'MIDPRINC', 'MINPRINC', 'MISES', 'PRESS', 'TRESCA')
+TENSOR_FIELDS = ('S', 'E', 'LE')
+DEFAULT_INVARIANTS = ('MAXPRINC',)
+
+# Abaqus reports engineering shear strains, which are halved to get the tensor shear components
+_ENGINEERING_SHEAR_FIELDS = ('E', 'LE', 'NE', 'PE', 'EE', 'IE', 'THE')
+_INDICES = ('11', '22', '33', '12', '13', '23')
+
+def default_invariants(field_name):
+    # type: (str) -> tuple[str, ...]
+    '''Invariants computed for a field when none are explicitly requested in the config.'''
+    return DEFAULT_INVARIANTS if field_name in TENSOR_FIELDS else ()
+
+def invariant_labels(field_name, invariants):
+    # type: (str, list[str]) -> list[str]
+    '''Component labels of the computed invariants, e.g. SMAXPRINC for the max. principal stress.'''
+    return ['{}{}'.format(field_name, inv) for inv in invariants]
+
+def unknown_invariants(invariants):
+    # type: (list[str]) -> list[str]
+    return [inv for inv in invariants if inv not in INVARIANTS]
+
+def tensor_components(data, components, field_name):
+    # type: (np.ndarray, list[str], str) -> list[np.ndarray]
+    '''
+    Get the 11, 22, 33, 12, 13, 23 tensor components (as float64 columns) from bulk field data.
+    Components which are not output for the element type (e.g., S13 for plane elements) are zero.
+    '''
+    columns = dict((label[-2:], i) for i, label in enumerate(components) if label[-2:] in _INDICES)
+    zero = np.zeros(data.shape[0])
+    tensor = [data[:, columns[ij]].astype(np.float64) if ij in columns else zero for ij in _INDICES]
+    if field_name in _ENGINEERING_SHEAR_FIELDS:
+        tensor[3:] = [0.5*t for t in tensor[3:]]
+    return tensor
+
+def principal_values(s11, s22, s33, s12, s13, s23):
+    # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]
+    '''
+    Max., mid. and min. principal values of a symmetric 3x3 tensor using the trigonometric solution
+    of the characteristic equation.
+    '''
+    q = (s11 + s22 + s33)/3.
+    d11, d22, d33 = s11 - q, s22 - q, s33 - q
+    p = np.sqrt((d11**2 + d22**2 + d33**2 + 2.*(s12**2 + s13**2 + s23**2))/6.)
+
+    # Determinant of the deviatoric tensor scaled by p (isotropic points, p = 0, give all principals equal to q)
+    ps = np.where(p > 0, p, 1.)
+    b11, b22, b33, b12, b13, b23 = d11/ps, d22/ps, d33/ps, s12/ps, s13/ps, s23/ps
+    det = b11*(b22*b33 - b23**2) - b12*(b12*b33 - b23*b13) + b13*(b12*b23 - b22*b13)
+    phi = np.arccos(np.clip(0.5*det, -1., 1.))/3.
+
+    smax = q + 2.*p*np.cos(phi)
+    smin = q + 2.*p*np.cos(phi + 2.*np.pi/3.)
+    return smax, 3.*q - smax - smin, smin
+
+def compute_invariants(data, components, field_name, invariants, out=None):
+    # type: (np.ndarray, list[str], str, list[str], np.ndarray | None) -> tuple[np.ndarray, list[str]]
+    '''
+    Compute the requested invariants for each row of bulk tensor field data.
+    Returns an (n, len(invariants)) array, in the same dtype as the field data (or written into out, e.g. the
+    spare columns of the field data array), and its component labels.
+    '''
+    s11, s22, s33, s12, s13, s23 = tensor_components(data, components, field_name)
+    computed = {}
+    if any(inv in ('MAXPRINC', 'MIDPRINC', 'MINPRINC', 'TRESCA') for inv in invariants):
+        computed['MAXPRINC'], computed['MIDPRINC'], computed['MINPRINC'] = principal_values(s11, s22, s33, s12, s13, s23)
+        computed['TRESCA'] = computed['MAXPRINC'] - computed['MINPRINC']
+    if 'MISES' in invariants:
+        computed['MISES'] = np.sqrt(0.5*((s11 - s22)**2 + (s22 - s33)**2 + (s33 - s11)**2) + 3.*(s12**2 + s13**2 + s23**2))
+    if 'PRESS' in invariants:
+        computed['PRESS'] = -(s11 + s22 + s33)/3.
+    values = np.empty((data.shape[0], len(invariants)), dtype=data.dtype) if out is None else out
+    for i, inv in enumerate(invariants):
+        values[:, i] = computed[inv]
+    return values, invariant_labels(field_name, invariants)
@@ -0,0 +1,182 @@
+"""
+Extraction throughput benchmarks on synthetic ODBs, runnable without Abaqus:
+
+    python -m odbex.abqpy.tests.bench_extraction [--sizes small medium] [--save]
+
+Measures build_extraction_region_dict, get_field_data, extract_step and the output writers in frames/s and MB/s
+for a few ODB sizes, and the compression ratio and write/read throughput (MB/s of uncompressed float64 data) of the
+npz storage modes. Results are compared to the baseline in benchmark_baseline.json, failing (exit code 1) when
+a throughput drops by more than the tolerance; --save records the results as the new baseline.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from odbex.abqpy.tests import fakeabq
+from odbex.abqpy import extractor, output
+
+BASELINE_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_TOLERANCE = 0.3
+MIN_COMPARED_SECONDS = 0.01
+SIZES = {
+    'small': {'num_elements': 1000, 'num_frames': 20},
+    'medium': {'num_elements': 20000, 'num_frames': 20},
+    'large': {'num_elements': 100000, 'num_frames': 10},
+}
+INSTANCE = 'PART-1-1'
+STORAGE_MODES = {
+    'float64': {'dtype': 'float64'},
+    'float32': {'dtype': 'float32'},
+    'deflate': {'dtype': 'float32', 'compression': 'deflate'},
+    'delta': {'dtype': 'float32', 'compression': 'deflate', 'delta': True},
+}
+
+def _config(num_elements):
+    # type: (int) -> dict
+    return {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-ALL', 'fields': ['S', 'E', 'IVOL', 'SDEG']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S'], 'avg': False},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'number', 'id': ['1-{}'.format(min(num_elements, 100))], 'fields': ['S', 'SDEG']},
+        ],
+        'nframes': None,
+    }
+
+def _timed(func, repeat=5):
+    # type: (Callable[[], Any], int) -> tuple[float, Any]
+    '''Best time of a few runs, with the extractor's progress messages suppressed.'''
+    best, result = None, None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def _dir_size(path):
+    # type: (str) -> int
+    if os.path.isfile(path): return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+def bench_size(size, workdir):
+    # type: (str, str) -> dict[str, dict[str, float]]
+    params = SIZES[size]
+    odb_filepath = os.path.join(workdir, 'bench_{}.odb'.format(size))
+    odb = fakeabq.register(odb_filepath, fakeabq.make_odb(path=odb_filepath, **params))
+    cfg = _config(params['num_elements'])
+    step = odb.steps['Step-1']
+    num_frames = len(step.frames)
+    results = {}
+
+    elapsed, extraction_regions = _timed(lambda: extractor.build_extraction_region_dict(odb, cfg['extract']))
+    results['build_extraction_region_dict'] = {'seconds': elapsed}
+
+    region = odb.rootAssembly.instances[INSTANCE].elementSets['SET-ALL']
+    elapsed, _ = _timed(lambda: [extractor.get_field_data('S', frame, region) for frame in step.frames])
+    nbytes = odb.expected_values(INSTANCE, 'S', odb.rootAssembly.instances[INSTANCE].element_labels).nbytes*num_frames
+    results['get_field_data'] = {'frames_per_s': num_frames/elapsed, 'mb_per_s': nbytes/elapsed/1e6}
+
+    def _extract_step():
+        writer = output.NpzWriter(os.path.join(workdir, 'bench_{}.npz'.format(size)))
+        extractor.extract_step(step, None, extraction_regions, writer)
+        writer.close()
+        return writer.filepath
+    elapsed, filepath = _timed(_extract_step)
+    results['extract_step'] = {'frames_per_s': num_frames/elapsed, 'mb_per_s': _dir_size(filepath)/elapsed/1e6}
+
+    # Writers fed with the extracted arrays, frame by frame
+    with np.load(filepath) as extracted:
+        arrays = dict((k, extracted[k]) for k in extracted.files)
+    for fmt in ('npz', 'stream', 'consolidated'):
+        def _write():
+            writer = output.open_writer(odb_filepath, {'output': {'format': fmt}, 'export_prefix': 'bench'})
+            output.replay(arrays, writer)
+            writer.close()
+            return writer.filepath
+        elapsed, filepath = _timed(_write)
+        results['writer_{}'.format(fmt)] = {'frames_per_s': num_frames/elapsed, 'mb_per_s': _dir_size(filepath)/elapsed/1e6}
+
+    # Storage modes, relative to the data in double precision
+    nbytes = sum(a.size*8 if a.dtype.kind == 'f' else a.nbytes for a in arrays.values())
+    for mode, options in STORAGE_MODES.items():
+        def _write():
+            writer = output.open_writer(odb_filepath, {'output': dict(options, format='npz'), 'export_prefix': 'bench_{}'.format(mode)})
+            output.replay(arrays, writer)
+            writer.close()
+            return writer.filepath
+        write_elapsed, filepath = _timed(_write)
+        def _read():
+            with output.NpzArrays(filepath) as stored:
+                return [stored[k] for k in stored.keys()]
+        read_elapsed, _ = _timed(_read)
+        results['storage_{}'.format(mode)] = {
+            'ratio': nbytes/_dir_size(filepath), 'write_mb_per_s': nbytes/write_elapsed/1e6, 'read_mb_per_s': nbytes/read_elapsed/1e6
+        }
+    return results
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    # type: (dict, dict, float) -> list[str]
+    '''Throughputs which dropped by more than the tolerance relative to the baseline.'''
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, metrics in benchmarks.items():
+            for metric, value in metrics.items():
+                base = baseline.get(size, {}).get(name, {}).get(metric)
+                if base is None: continue
+                # Timings this short are mostly noise
+                if metric == 'seconds' and max(base, value) < MIN_COMPARED_SECONDS: continue
+                # Times regress upwards, throughputs downwards
+                ratio = base/value if metric == 'seconds' else value/base
+                if ratio < 1. - tolerance:
+                    regressions.append('{} {} {}: {:.4g} (baseline {:.4g})'.format(size, name, metric, value, base))
+    return regressions
+
+def _print_results(results):
+    # type: (dict) -> None
+    for size, benchmarks in results.items():
+        print('{} ({} elements, {} frames)'.format(size, SIZES[size]['num_elements'], SIZES[size]['num_frames']))
+        for name, metrics in benchmarks.items():
+            print('  {:<30} {}'.format(name, ', '.join('{} {:.4g}'.format(m, v) for m, v in metrics.items())))
+
+def main():
+    # type: () -> None
+    parser = argparse.ArgumentParser(prog='bench_extraction')
+    parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES), default=['small', 'medium'])
+    parser.add_argument('--save', action='store_true', help='Save the results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed relative drop in throughput before failing.')
+    parser.add_argument('--baseline', default=BASELINE_FILEPATH)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='odbex_bench_')
+    try:
+        results = dict((size, bench_size(size, workdir)) for size in args.sizes)
+    finally:
+        shutil.rmtree(workdir)
+    _print_results(results)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print('baseline saved to {}'.format(args.baseline))
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    for r in regressions:
+        print('regression: {}'.format(r))
+    if regressions: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
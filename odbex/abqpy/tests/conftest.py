@@ -0,0 +1,2 @@
+# Serve synthetic ODBs through the odbAccess/abaqusConstants stand-ins, so that the tests run without Abaqus
+from odbex.abqpy.tests import fakeabq  # noqa: F401
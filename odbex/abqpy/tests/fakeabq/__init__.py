@@ -0,0 +1,12 @@
+"""
+Pure-python stand-ins for the Abaqus odbAccess and abaqusConstants modules, serving synthetic ODBs of any size
+with numpy-backed bulk data, so that the extractor can be tested and benchmarked without an Abaqus license.
+Importing this package puts the stand-ins on sys.path, ahead of any real Abaqus modules.
+"""
+import os
+import sys
+
+FAKEABQ_DIR = os.path.dirname(os.path.abspath(__file__))
+if FAKEABQ_DIR not in sys.path: sys.path.insert(0, FAKEABQ_DIR)
+
+from odbAccess import make_odb, register, write_spec  # noqa: E402
@@ -0,0 +1,17 @@
+"""
+Stand-in for the abaqusConstants module: the symbolic constants used by odbex, as strings.
+"""
+
+class SymbolicConstant(str):
+    def __repr__(self):
+        # type: () -> str
+        return str(self)
+
+INTEGRATION_POINT = SymbolicConstant('INTEGRATION_POINT')
+NODAL = SymbolicConstant('NODAL')
+ELEMENT_NODAL = SymbolicConstant('ELEMENT_NODAL')
+CENTROID = SymbolicConstant('CENTROID')
+WHOLE_ELEMENT = SymbolicConstant('WHOLE_ELEMENT')
+SCALAR = SymbolicConstant('SCALAR')
+VECTOR = SymbolicConstant('VECTOR')
+TENSOR_3D_FULL = SymbolicConstant('TENSOR_3D_FULL')
@@ -0,0 +1,381 @@
+"""
+Stand-in for the odbAccess module, serving synthetic ODBs generated with numpy.
+
+The mesh of each instance is a chain of elements, each sharing half of its nodes with the next one. For 8-node
+elements this is a row of unit hexahedra along x, element n spanning n - 1 <= x <= n.
+Field output values are a fixed random base value per output location, scaled by (1 + frame value), so the
+expected result of any extraction can be computed from the base values. ODBs are either registered in memory
+with register(path, make_odb(...)), or described by a JSON spec file written with write_spec(path, ...), which
+openOdb reads (so that a subprocess can open the same synthetic ODB).
+"""
+import json
+import os
+
+import numpy as np
+
+import abaqusConstants as abqconst
+
+TENSOR_COMPONENTS = ('11', '22', '33', '12', '13', '23')
+DEFAULT_FIELDS = {
+    'S': (abqconst.INTEGRATION_POINT, tuple('S' + c for c in TENSOR_COMPONENTS)),
+    'E': (abqconst.INTEGRATION_POINT, tuple('E' + c for c in TENSOR_COMPONENTS)),
+    'LE': (abqconst.INTEGRATION_POINT, tuple('LE' + c for c in TENSOR_COMPONENTS)),
+    'IVOL': (abqconst.INTEGRATION_POINT, ()),
+    'SDEG': (abqconst.INTEGRATION_POINT, ()),
+    'TEMP': (abqconst.INTEGRATION_POINT, ()),
+    'U': (abqconst.NODAL, ('U1', 'U2', 'U3')),
+    'NT11': (abqconst.NODAL, ()),
+}
+
+# History outputs of each step, as functions of the step time, for the assembly and the first node of PART-1-1
+HISTORY_OUTPUTS = {
+    'Assembly ASSEMBLY': {'ALLSE': lambda t: t**2, 'ALLKE': lambda t: 0.1*t},
+    'Node PART-1-1.1': {'U1': lambda t: 0.01*t, 'RF1': lambda t: -5.*t},
+}
+
+_REGISTRY = {}
+
+class OdbError(Exception):
+    pass
+
+class SectionPoint(object):
+    def __init__(self, number, description=''):
+        # type: (int, str) -> None
+        self.number = number
+        self.description = description
+
+class FieldBulkData(object):
+    def __init__(self, data, position, instance, componentLabels, elementLabels=None, nodeLabels=None, integrationPoints=None, sectionPoint=None):
+        self.data = data
+        self.position = position
+        self.instance = instance
+        self.componentLabels = componentLabels
+        self.elementLabels = elementLabels
+        self.nodeLabels = nodeLabels
+        self.integrationPoints = integrationPoints
+        self.sectionPoint = sectionPoint
+
+class OdbMeshElement(object):
+    def __init__(self, instance, label):
+        # type: (OdbInstance, int) -> None
+        self.instance = instance
+        self.instanceName = instance.name
+        self.label = label
+        self.type = instance.element_type
+        self.connectivity = tuple(int(n) for n in instance.connectivity[instance.element_position([label])[0]])
+
+class OdbMeshNode(object):
+    def __init__(self, instance, label):
+        # type: (OdbInstance, int) -> None
+        self.instance = instance
+        self.instanceName = instance.name
+        self.label = label
+        self.coordinates = tuple(float(x) for x in instance.node_coordinates[instance.node_position([label])[0]])
+
+class OdbSet(object):
+    def __init__(self, name, mesh, members):
+        # type: (str, str, list[tuple[OdbInstance, np.ndarray]]) -> None
+        self.name = name
+        self.mesh = mesh
+        self.members = [(instance, np.unique(np.asarray(labels, dtype=int))) for instance, labels in members]
+
+    @property
+    def elements(self):
+        # type: () -> list[OdbMeshElement]
+        if self.mesh != 'element': return []
+        return [OdbMeshElement(instance, int(label)) for instance, labels in self.members for label in labels]
+
+    @property
+    def nodes(self):
+        # type: () -> list[OdbMeshNode]
+        if self.mesh != 'node': return []
+        return [OdbMeshNode(instance, int(label)) for instance, labels in self.members for label in labels]
+
+class OdbInstance(object):
+    def __init__(self, name, num_elements, nodes_per_element=8):
+        # type: (str, int, int) -> None
+        self.name = name
+        self.nodes_per_element = nodes_per_element
+        self.element_labels = np.arange(1, num_elements + 1)
+        shift = max(nodes_per_element//2, 1)
+        self.connectivity = (np.arange(num_elements)*shift)[:, None] + np.arange(nodes_per_element)[None, :] + 1
+        self.node_labels = np.arange(1, int(self.connectivity.max()) + 1)
+        self.element_type = 'C3D8R' if nodes_per_element == 8 else 'C3D{}'.format(nodes_per_element)
+        corner = (self.node_labels - 1) % shift
+        self.node_coordinates = np.stack([(self.node_labels - 1)//shift, corner % 2, corner//2], axis=1).astype(np.float32)
+        self.elementSets = {}
+        self.nodeSets = {}
+
+    def element_position(self, labels):
+        # type: (np.ndarray) -> np.ndarray
+        positions = np.searchsorted(self.element_labels, labels)
+        if np.any(positions >= len(self.element_labels)) or np.any(self.element_labels[np.minimum(positions, len(self.element_labels) - 1)] != labels):
+            raise OdbError('element label(s) not found on instance {}'.format(self.name))
+        return positions
+
+    def node_position(self, labels):
+        # type: (np.ndarray) -> np.ndarray
+        positions = np.searchsorted(self.node_labels, labels)
+        if np.any(positions >= len(self.node_labels)) or np.any(self.node_labels[np.minimum(positions, len(self.node_labels) - 1)] != labels):
+            raise OdbError('node label(s) not found on instance {}'.format(self.name))
+        return positions
+
+    @property
+    def elements(self):
+        # type: () -> list[OdbMeshElement]
+        return [OdbMeshElement(self, int(label)) for label in self.element_labels]
+
+    @property
+    def nodes(self):
+        # type: () -> list[OdbMeshNode]
+        return [OdbMeshNode(self, int(label)) for label in self.node_labels]
+
+    def getElementFromLabel(self, label):
+        # type: (int) -> OdbMeshElement
+        return OdbMeshElement(self, label)
+
+    def getNodeFromLabel(self, label):
+        # type: (int) -> OdbMeshNode
+        self.node_position([label])
+        return OdbMeshNode(self, label)
+
+    def ElementSetFromElementLabels(self, name, elementLabels):
+        # type: (str, tuple[int, ...]) -> OdbSet
+        self.element_position(np.unique(elementLabels))
+        self.elementSets[name] = OdbSet(name, 'element', [(self, elementLabels)])
+        return self.elementSets[name]
+
+    def NodeSetFromNodeLabels(self, name, nodeLabels):
+        # type: (str, tuple[int, ...]) -> OdbSet
+        self.node_position(np.unique(nodeLabels))
+        self.nodeSets[name] = OdbSet(name, 'node', [(self, nodeLabels)])
+        return self.nodeSets[name]
+
+class OdbAssembly(object):
+    def __init__(self, instances):
+        # type: (list[OdbInstance]) -> None
+        self.name = 'ASSEMBLY'
+        self.instances = dict((instance.name, instance) for instance in instances)
+        self.elementSets = {}
+        self.nodeSets = {}
+
+class FieldOutput(object):
+    def __init__(self, odb, name, frame, position, componentLabels, region=None, requested_position=None):
+        self._odb = odb
+        self.name = name
+        self._frame = frame
+        self.position = position
+        self.componentLabels = componentLabels
+        self._region = region
+        self._requested_position = requested_position
+
+    def getSubset(self, region=None, position=None):
+        # type: (OdbSet | OdbMeshElement | OdbMeshNode | None, str | None) -> FieldOutput
+        return FieldOutput(self._odb, self.name, self._frame, self.position, self.componentLabels, region, position)
+
+    @property
+    def bulkDataBlocks(self):
+        # type: () -> list[FieldBulkData]
+        return self._odb._bulk_data(self)
+
+class OdbFrame(object):
+    def __init__(self, odb, frameId, frameValue):
+        # type: (Odb, int, float) -> None
+        self.frameId = frameId
+        self.frameValue = frameValue
+        self.fieldOutputs = dict(
+            (name, FieldOutput(odb, name, self, position, components)) for name, (position, components) in odb.fields.items()
+        )
+
+class HistoryOutput(object):
+    def __init__(self, odb, name, times, values):
+        # type: (Odb, str, np.ndarray, np.ndarray) -> None
+        self.name = name
+        self.description = name
+        self._odb = odb
+        self._data = tuple((float(t), float(v)) for t, v in zip(times, values))
+
+    @property
+    def data(self):
+        # type: () -> tuple[tuple[float, float], ...]
+        self._odb.history_reads += 1
+        return self._data
+
+class HistoryRegion(object):
+    def __init__(self, name, historyOutputs):
+        # type: (str, dict[str, HistoryOutput]) -> None
+        self.name = name
+        self.historyOutputs = historyOutputs
+
+class OdbStep(object):
+    def __init__(self, name, frames, timePeriod):
+        # type: (str, list[OdbFrame], float) -> None
+        self.name = name
+        self.frames = frames
+        self.timePeriod = timePeriod
+        self.historyRegions = {}
+
+class Odb(object):
+    def __init__(self, path, instances, fields, num_ips=8, num_section_points=1, max_block_rows=None, seed=0):
+        self.path = path
+        self.name = path
+        self.rootAssembly = OdbAssembly(instances)
+        self.fields = fields
+        self.num_ips = num_ips
+        self.num_section_points = num_section_points
+        self.max_block_rows = max_block_rows
+        self.steps = {}
+        self._seed = seed
+        self._base = {}
+        self.reads = 0
+        self.history_reads = 0
+
+    def close(self):
+        # type: () -> None
+        pass
+
+    def _base_values(self, instance, field, position):
+        # type: (OdbInstance, str, str) -> np.ndarray
+        '''Random values of a field at every output location of an instance, scaled by (1 + frame value) in each frame.'''
+        key = (instance.name, field, position)
+        if key not in self._base:
+            rng = np.random.RandomState((self._seed + sum(ord(c) for c in '|'.join(key))) % 2**32)
+            num_rows = len(self._locations(instance, position)[0])
+            ncomp = max(len(self.fields[field][1]), 1)
+            values = rng.uniform(-1., 1., size=(num_rows, ncomp))
+            if field == 'IVOL': values = np.abs(values) + 0.5
+            self._base[key] = values.astype(np.float32)
+        return self._base[key]
+
+    def _locations(self, instance, position):
+        # type: (OdbInstance, str) -> tuple[np.ndarray, np.ndarray | None, np.ndarray | None, np.ndarray | None]
+        '''Element labels, node labels, integration points and section points of every output location of an instance.'''
+        num_elements, npe, nsp = len(instance.element_labels), instance.nodes_per_element, self.num_section_points
+        if position == abqconst.NODAL:
+            return np.zeros(len(instance.node_labels), dtype=int), instance.node_labels, None, None
+        if position == abqconst.ELEMENT_NODAL:
+            return np.repeat(instance.element_labels, npe*nsp), np.repeat(instance.connectivity, nsp, axis=1).ravel(), None, np.tile(np.arange(1, nsp + 1), num_elements*npe)
+        return (
+            np.repeat(instance.element_labels, self.num_ips*nsp), None,
+            np.tile(np.repeat(np.arange(1, self.num_ips + 1), nsp), num_elements), np.tile(np.arange(1, nsp + 1), num_elements*self.num_ips),
+        )
+
+    def _rows(self, instance, labels, mesh, position):
+        # type: (OdbInstance, np.ndarray, str, str) -> np.ndarray
+        '''Rows of the output locations of an instance belonging to the elements/nodes of a region.'''
+        if position == abqconst.NODAL:
+            nodes = labels if mesh == 'node' else np.unique(instance.connectivity[instance.element_position(labels)])
+            return instance.node_position(nodes)
+        per_element = instance.nodes_per_element if position == abqconst.ELEMENT_NODAL else self.num_ips
+        per_element *= self.num_section_points
+        if mesh == 'element':
+            return (instance.element_position(labels)[:, None]*per_element + np.arange(per_element)[None, :]).ravel()
+        if position == abqconst.ELEMENT_NODAL:
+            return np.nonzero(np.isin(self._locations(instance, position)[1], labels))[0]
+        # Integration point output is not available on nodes
+        return np.zeros(0, dtype=int)
+
+    def _region_members(self, region):
+        # type: (OdbSet | OdbMeshElement | OdbMeshNode | None) -> list[tuple[OdbInstance, np.ndarray, str]]
+        if region is None:
+            return [(instance, instance.element_labels, 'element') for instance in self.rootAssembly.instances.values()]
+        if isinstance(region, OdbSet):
+            return [(instance, labels, region.mesh) for instance, labels in region.members]
+        mesh = 'node' if isinstance(region, OdbMeshNode) else 'element'
+        return [(region.instance, np.array([region.label]), mesh)]
+
+    def _bulk_data(self, field_output):
+        # type: (FieldOutput) -> list[FieldBulkData]
+        self.reads += 1
+        position = field_output._requested_position or field_output.position
+        if field_output.position == abqconst.NODAL: position = abqconst.NODAL
+        blocks = []
+        for instance, labels, mesh in self._region_members(field_output._region):
+            rows = self._rows(instance, labels, mesh, position)
+            if len(rows) == 0: continue
+            element_labels, node_labels, ips, section_points = self._locations(instance, position)
+            base = self._base_values(instance, field_output.name, position)
+            step = self.max_block_rows or len(rows)
+            for start in range(0, len(rows), step):
+                block_rows = rows[start:start + step]
+                # Section points of a block are constant in Abaqus, so split at section point changes
+                sp_numbers = [None] if section_points is None else np.unique(section_points[block_rows])
+                for sp in sp_numbers:
+                    sp_rows = block_rows if sp is None else block_rows[section_points[block_rows] == sp]
+                    blocks.append(FieldBulkData(
+                        data=base[sp_rows]*np.float32(1. + field_output._frame.frameValue),
+                        position=position, instance=instance, componentLabels=field_output.componentLabels,
+                        elementLabels=None if position == abqconst.NODAL else element_labels[sp_rows],
+                        nodeLabels=None if node_labels is None else node_labels[sp_rows],
+                        integrationPoints=None if ips is None else ips[sp_rows],
+                        sectionPoint=None if sp is None or self.num_section_points == 1 else SectionPoint(int(sp)),
+                    ))
+        return blocks
+
+    def expected_values(self, instance_name, field, labels, mesh='element', position=None, frame_value=0.):
+        # type: (str, str, list[int], str, str | None, float) -> np.ndarray
+        '''Values a getSubset of the field on the given element/node labels of an instance returns, for checking extracted data.'''
+        instance = self.rootAssembly.instances[instance_name]
+        position = position or self.fields[field][0]
+        if self.fields[field][0] == abqconst.NODAL: position = abqconst.NODAL
+        rows = self._rows(instance, np.unique(labels), mesh, position)
+        return self._base_values(instance, field, position)[rows]*np.float32(1. + frame_value)
+
+def make_odb(
+        path='synthetic.odb', num_elements=1000, num_ips=8, nodes_per_element=8, num_instances=1, num_steps=1,
+        num_frames=10, num_sdvs=0, num_section_points=1, fields=None, sets=None, max_block_rows=None, seed=0,
+        num_history=None
+    ):
+    # type: (...) -> Odb
+    '''
+    Generate a synthetic ODB. Each instance (PART-1-1, PART-2-1, ...) has the element sets SET-ALL, SET-HALF
+    (first half of the elements) and SET-EVEN, and the node set NSET-ALL, plus any given as {name: labels} in sets.
+    Steps (Step-1, ...) have num_frames frames each with frame values from 0 to 1, and the HISTORY_OUTPUTS at
+    num_history times from 0 to 1 (by default three increments between frames).
+    '''
+    field_specs = dict(DEFAULT_FIELDS)
+    if fields is not None: field_specs = dict((f, DEFAULT_FIELDS[f]) for f in fields)
+    for i in range(1, num_sdvs + 1):
+        field_specs['SDV{}'.format(i)] = (abqconst.INTEGRATION_POINT, ())
+    instances = []
+    for i in range(1, num_instances + 1):
+        instance = OdbInstance('PART-{}-1'.format(i), num_elements, nodes_per_element)
+        instance.ElementSetFromElementLabels('SET-ALL', instance.element_labels)
+        instance.ElementSetFromElementLabels('SET-HALF', instance.element_labels[:max(num_elements//2, 1)])
+        instance.ElementSetFromElementLabels('SET-EVEN', instance.element_labels[1::2] if num_elements > 1 else instance.element_labels)
+        instance.NodeSetFromNodeLabels('NSET-ALL', instance.node_labels)
+        for name, labels in (sets or {}).items():
+            instance.ElementSetFromElementLabels(name, labels)
+        instances.append(instance)
+    odb = Odb(path, instances, field_specs, num_ips, num_section_points, max_block_rows, seed)
+    for i in range(1, num_steps + 1):
+        frames = [OdbFrame(odb, j, float(v)) for j, v in enumerate(np.linspace(0., 1., num_frames))]
+        step = odb.steps['Step-{}'.format(i)] = OdbStep('Step-{}'.format(i), frames, 1.)
+        times = np.linspace(0., 1., num_history or 4*num_frames - 3)
+        for name, outputs in HISTORY_OUTPUTS.items():
+            step.historyRegions[name] = HistoryRegion(name, dict((o, HistoryOutput(odb, o, times, f(times))) for o, f in outputs.items()))
+    return odb
+
+def register(path, odb):
+    # type: (str, Odb) -> Odb
+    '''Make openOdb return the given synthetic ODB for a path.'''
+    _REGISTRY[os.path.abspath(path)] = odb
+    return odb
+
+def write_spec(path, **kwargs):
+    # type: (str, ...) -> None
+    '''Write a synthetic ODB spec (keyword arguments of make_odb) to a file which openOdb will generate the ODB from.'''
+    with open(path, 'w') as f:
+        json.dump(kwargs, f)
+
+def openOdb(path, readOnly=False, readInternalSets=False):
+    # type: (str, bool, bool) -> Odb
+    key = os.path.abspath(path)
+    if key in _REGISTRY: return _REGISTRY[key]
+    if not os.path.exists(path): raise OdbError('file {} does not exist'.format(path))
+    with open(path, 'r') as f:
+        try:
+            spec = json.load(f)
+        except ValueError:
+            raise OdbError('{} is not a synthetic odb spec'.format(path))
+    return register(path, make_odb(path=path, **spec))
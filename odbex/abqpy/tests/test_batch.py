@@ -0,0 +1,137 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+import odbex.__main__ as odbex_main
+from odbex.abqpy import output
+from odbex.abqpy.tests import fakeabq
+from odbex.cache import ExtractionCache
+
+INSTANCE = 'PART-1-1'
+CFG = {
+    'extract': [
+        {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'IVOL']},
+        {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-EVEN', 'fields': ['SDEG'], 'avg': False},
+    ],
+    'nframes': None,
+}
+
+def _batch(tmp_path, monkeypatch, names, odbex_cfg=CFG):
+    '''Spec files of synthetic odbs and a config file, with the workers run by this interpreter on the odbAccess stand-in.'''
+    monkeypatch.setenv('PYTHONPATH', fakeabq.FAKEABQ_DIR)
+    monkeypatch.setattr(odbex_main, '_abaqus_python', lambda *args: [sys.executable, odbex_main.EXTRACTOR.as_posix(), *args])
+    odbs = []
+    for name in names:
+        odbs.append(str(tmp_path.joinpath(f'{name}.odb')))
+        fakeabq.write_spec(odbs[-1], num_elements=20, num_frames=6)
+    return odbs, _config(tmp_path, odbex_cfg)
+
+def _config(tmp_path, odbex_cfg, name='odbex_cfg'):
+    cfg = tmp_path.joinpath(f'{name}.json')
+    cfg.write_text(json.dumps(odbex_cfg))
+    return str(cfg)
+
+def _assert_cached_output(odb, cfg, cache):
+    '''Extract with and without the cache, checking that the output assembled from the cache is the same.'''
+    assert all(r.ok for r in odbex_main.extract_batch([odb], cfg, workers=1))
+    expected = _load(odb)
+    assert all(r.ok for r in odbex_main.extract_batch([odb], cfg, workers=1, cache=cache))
+    cached = _load(odb)
+    assert sorted(cached) == sorted(expected)
+    for key, array in expected.items():
+        np.testing.assert_array_equal(cached[key], array, err_msg=key)
+
+def _load(odb):
+    with output.NpzArrays(output.output_filepath(odb)) as arrays:
+        return {k: arrays[k] for k in arrays.keys()}
+
+def test_batch_cache_failure(tmp_path, monkeypatch):
+    odbs, cfg = _batch(tmp_path, monkeypatch, ['run1', 'run2'])
+    cache = ExtractionCache(tmp_path.joinpath('cache'))
+    assemble = ExtractionCache.assemble
+
+    # An error while assembling one odb from the cache (e.g. an entry evicted by a concurrent run) fails that odb only
+    def _assemble(self, entries, writer):
+        if 'run1' in writer.filepath: raise FileNotFoundError('evicted')
+        assemble(self, entries, writer)
+    monkeypatch.setattr(ExtractionCache, 'assemble', _assemble)
+    results = {r.odb: r for r in odbex_main.extract_batch(odbs, cfg, workers=2, cache=cache)}
+    assert not results[odbs[0]].ok and 'evicted' in results[odbs[0]].output
+    assert results[odbs[1]].ok
+    assert 'Step-1|SET-EVEN|SDEG|data' in _load(odbs[1])
+
+def test_batch_failure_isolation(tmp_path, monkeypatch):
+    odbs, cfg = _batch(tmp_path, monkeypatch, ['run1', 'run2', 'run3'])
+    # An odb which cannot be opened fails its worker only, while the others are extracted concurrently
+    odbs.insert(1, str(tmp_path.joinpath('missing.odb')))
+    results = {r.odb: r for r in odbex_main.extract_batch(odbs, cfg, workers=2)}
+    assert sorted(results) == sorted(odbs)
+    assert not results[odbs[1]].ok and 'does not exist' in results[odbs[1]].output
+    for odb in odbs[:1] + odbs[2:]:
+        assert results[odb].ok
+        assert _load(odb)['Step-1|SET-HALF|S|data'].shape[0] == 6
+
+def test_batch_shards(tmp_path, monkeypatch):
+    odbs, cfg = _batch(tmp_path, monkeypatch, ['run1', 'run2'])
+    assert all(r.ok for r in odbex_main.extract_batch(odbs, cfg, workers=2))
+    unsharded = {odb: _load(odb) for odb in odbs}
+    # Uneven blocks of frames per shard, merged back into the same output as a single worker writes
+    results = odbex_main.extract_batch(odbs, cfg, workers=3, num_shards=4)
+    assert sorted(r.odb for r in results) == sorted(odbs) and all(r.ok for r in results)
+    for odb in odbs:
+        sharded = _load(odb)
+        assert sorted(sharded) == sorted(unsharded[odb])
+        for key, array in unsharded[odb].items():
+            np.testing.assert_array_equal(sharded[key], array, err_msg=key)
+        assert not list(tmp_path.glob('*.shard*'))
+
+def test_batch_cache(tmp_path, monkeypatch):
+    # Definitions sharing a region and field are cached once, from the first definition as when extracting
+    shared = {'extract': [CFG['extract'][0], dict(CFG['extract'][0], fields=['S', 'IVOL', 'SDEG'])] + CFG['extract'][1:], 'nframes': None}
+    odbs, cfg = _batch(tmp_path, monkeypatch, ['run1'], shared)
+    cache = ExtractionCache(tmp_path.joinpath('cache'))
+    _assert_cached_output(odbs[0], cfg, cache)  # Miss
+    _assert_cached_output(odbs[0], cfg, cache)  # Hit
+    assert _load(odbs[0])['Step-1|SET-HALF|S|data'].shape[0] == 6
+
+    # Fields averaged without the volumes are not reused for a volume-weighted average
+    plain = {'extract': [dict(CFG['extract'][0], fields=['S'])], 'nframes': None}
+    weighted = {'extract': [dict(CFG['extract'][0], fields=['S', 'IVOL'])], 'nframes': None}
+    _assert_cached_output(odbs[0], _config(tmp_path, plain, 'plain'), cache)
+    weighted_cfg = _config(tmp_path, weighted, 'weighted')
+    _assert_cached_output(odbs[0], weighted_cfg, cache)
+
+    # and a field missing from the cache is re-extracted with the volumes it is weighted by
+    with open(weighted_cfg, 'r') as f:
+        s_entry = cache.entries(odbs[0], json.load(f))[0]
+    assert s_entry.field == 'S'
+    cache._path(s_entry.key).unlink()
+    _assert_cached_output(odbs[0], weighted_cfg, cache)
+    assert cache.has(s_entry)
+
+def test_watch_retries(tmp_path, monkeypatch):
+    odb = tmp_path.joinpath('run1.odb')
+    odb.write_text('')
+    odb.with_suffix('.sta').write_text('THE ANALYSIS HAS COMPLETED SUCCESSFULLY')
+    # A failed update of an ended analysis is retried, rather than the final frames being left out
+    outcomes = [1, 0]
+    calls = []
+    def _extract(odb, cfg, incremental=False):
+        calls.append(incremental)
+        return odbex_main.WorkerResult(odb, outcomes.pop(0) if outcomes else 1, 0., 'error\n')
+    monkeypatch.setattr(odbex_main, '_extract_odb', _extract)
+    odbex_main.watch([str(odb)], 'odbex_cfg.json', 0.)
+    assert calls == [True, True]
+
+    # but only a bounded number of times
+    calls.clear()
+    odbex_main.watch([str(odb)], 'odbex_cfg.json', 0.)
+    assert len(calls) == odbex_main.MAX_WATCH_RETRIES + 1
+
+def test_incremental_shards(monkeypatch):
+    for flag in (['--incremental'], ['--watch', '1']):
+        monkeypatch.setattr(sys, 'argv', ['odbex', 'run1.odb', 'odbex_cfg.json', '--shards', '2', *flag])
+        with pytest.raises(SystemExit, match='cannot be combined with --shards'):
+            odbex_main.main()
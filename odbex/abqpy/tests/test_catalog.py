@@ -0,0 +1,46 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from odbex.abqpy.tests.test_simdata import _py2_npz
+from odbex.post.catalog import Catalog
+
+def test_catalog(tmp_path):
+    results = tmp_path.joinpath('results')
+    results.mkdir()
+    _py2_npz(results.joinpath('odbex_run1.npz'))
+    np.savez(
+        results.joinpath('odbex_run2.npz'), **{
+            'Step-1|increments': np.array([[0, 0.], [1, 2.]]),
+            'Step-1|SET-1|S|data': np.array([[1., 2., 3.], [4., 8., 6.]], dtype=np.float32),
+            'Step-1|SET-1|S|components': np.array(['S11', 'S22', 'MISES']),
+        }
+    )
+    catalog = Catalog(tmp_path.joinpath('campaign.db'))
+    assert catalog.index(results) == 2
+    assert catalog.index(results) == 0  # Unmodified results are skipped
+
+    # Labels of the py2-written result are matched by name
+    matches = catalog.query(component='S11')
+    assert [(m.run, m.final) for m in matches] == [('run1', 3.), ('run2', 4.)]
+    assert [m.run for m in catalog.query(field='S', component='S22', final_above=6.)] == ['run2']
+    assert [m.run for m in catalog.query(component='MISES', min_end_time=1.5)] == ['run2']
+    loaded = catalog.load(run='run1', component='MISES')
+    np.testing.assert_array_equal(loaded[('run1', 'Step-1', 'SET-1', 'S')][:, 2], [2., 5.])
+
+def test_catalog_connections(tmp_path, monkeypatch):
+    # Every connection is closed once its transaction is done, so that the catalog file is not left locked (e.g. on Windows)
+    connections = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, 'connect', lambda *args, **kwargs: connections.append(connect(*args, **kwargs)) or connections[-1])
+    catalog = Catalog(tmp_path.joinpath('campaign.db'))
+    _py2_npz(tmp_path.joinpath('odbex_run1.npz'))
+    assert catalog.index(tmp_path) == 1
+    assert [m.run for m in catalog.query(component='S11')] == ['run1']
+    tmp_path.joinpath('odbex_run1.npz').unlink()
+    assert catalog.remove_missing() == 1
+    assert len(connections) == 3
+    for connection in connections:
+        with pytest.raises(sqlite3.ProgrammingError, match='closed'):
+            connection.execute('select 1')
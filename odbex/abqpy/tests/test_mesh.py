@@ -0,0 +1,42 @@
+import sys
+
+import numpy as np
+
+from odbex.abqpy.tests import fakeabq
+from odbex.abqpy import geometry
+from odbex.cache import ExtractionCache
+from odbex import mesh
+from odbex.post.mesh import MeshData
+
+INSTANCE = 'PART-1-1'
+
+def test_mesh(tmp_path, monkeypatch):
+    # The worker runs under this interpreter with the odbAccess stand-in, generating the odb from its spec file
+    monkeypatch.setenv('PYTHONPATH', fakeabq.FAKEABQ_DIR)
+    path = str(tmp_path.joinpath('synthetic.odb'))
+    fakeabq.write_spec(path, num_elements=6, num_frames=2)
+    cache = ExtractionCache(tmp_path.joinpath('cache'))
+    mesh_path = mesh.export_mesh(path, cache, python=(sys.executable,))
+    assert mesh_path == cache.mesh_path(path)
+    instance = mesh.load_mesh(path, cache, python=('false',)).instances[INSTANCE]  # Read from the cache
+
+    # Chain of unit hexahedra along x, each sharing 4 nodes with the next
+    assert instance.num_elements == 6 and len(instance.node_labels) == 28
+    assert list(np.unique(instance.element_types)) == ['C3D8R']
+    np.testing.assert_array_equal(instance.offsets, np.arange(0, 49, 8))
+    np.testing.assert_array_equal(instance.element_nodes(2), np.arange(5, 13))
+    np.testing.assert_array_equal(instance.node_coordinates([1, 8]), [[0., 0., 0.], [1., 1., 1.]])
+    np.testing.assert_allclose(instance.centroids(), np.column_stack([np.arange(6) + 0.5, np.full(6, 0.5), np.full(6, 0.5)]))
+    np.testing.assert_array_equal(instance.element_sets['SET-HALF'], [1, 2, 3])
+    np.testing.assert_array_equal(instance.node_sets['NSET-ALL'], instance.node_labels)
+
+    # Read in-process, the arrays are the same
+    odb = fakeabq.make_odb(path=path, num_elements=6, num_frames=2)
+    arrays = geometry.read_mesh(odb)
+    np.testing.assert_array_equal(arrays[INSTANCE + '|connectivity'], instance.connectivity)
+
+    # Type names exported by abaqus python 2 load as bytes
+    arrays[INSTANCE + '|elementTypes'] = arrays[INSTANCE + '|elementTypes'].astype(bytes)
+    np.savez(tmp_path.joinpath('py2_mesh.npz'), **arrays)
+    py2_instance = MeshData.open(tmp_path.joinpath('py2_mesh.npz')).instances[INSTANCE]
+    assert list(np.unique(py2_instance.element_types)) == ['C3D8R']
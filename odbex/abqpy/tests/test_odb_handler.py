@@ -1,51 +1,302 @@
-import os, json
+import os
 
 import numpy as np
+import pytest
 
-import pc2abaqus as pc
-
-TEST_ODB_FILEPATH = "test_2fiber_RUC_u23.odb"
-                                 
-def _test_filepath():
-    return os.path.join(os.path.dirname(__file__), TEST_ODB_FILEPATH)
-
-def main():
-    odb_handler = pc.extract.OdbHandler(_test_filepath())
-    
-    instance_name = odb_handler.instance_names[0]
-    instance = odb_handler.get_instance_by_name(instance_name)
-    subset = odb_handler.get_mesh_items_by_number("node", instance, [1, 2, 3])
-    subset = odb_handler.get_mesh_items_by_set("element", instance, ["set-composite"], ignorecase=True)
-    
-    res = {}
-    
-    for step in odb_handler.analysis_steps:
-        
-        step_dict = {step.name: {}}
-        res.update(step_dict)
-            
-        frames = odb_handler.slice_step_frames(step.frames, num_frames=4)
-        frame_timevals = odb_handler.get_frame_timevals(frames)
-        for ss in subset:
-            
-            ss_dict = {ss.name: {}}
-            step_dict[step.name].update(ss_dict)
-            # step_dict[step.name].update({ss.name: {}})
-            
-            iptv = odb_handler.get_integration_point_volumes(frames, ss)            
-            for field in ["S", "E"]:
-                
-                fd = pc.extract.FieldDataHandler(field, ss, frames)
-                fd.extract()
-                fd.volume_average_field(iptv)
-
-
-                ss_dict[ss.name].update({field: fd.data_to_records(frame_timevals)})
-
-    odb_handler.odb.close()
-    
-    with open("test.json", "w") as f:
-        json.dump(res, f, indent=4)
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+from odbex.abqpy.tests import fakeabq
+from odbex.abqpy import derived, extract, extractor, output, spatial, tensors
+
+INSTANCE = 'PART-1-1'
+
+def _synthetic_odb(tmp_path, **kwargs):
+    path = str(tmp_path.joinpath('synthetic.odb'))
+    return path, fakeabq.register(path, fakeabq.make_odb(path=path, **kwargs))
+
+def test_odb_handler(tmp_path):
+    path, odb = _synthetic_odb(tmp_path, num_elements=20, num_frames=6)
+    odb_handler = extract.OdbHandler(path)
+
+    assert odb_handler.instance_names == [INSTANCE]
+    instance = odb_handler.get_instance_by_name(INSTANCE)
+    subset = odb_handler.get_mesh_items_by_set_name('element', instance, 'SET-HALF')
+    assert len(subset.elements) == 10
+    assert odb_handler.get_mesh_items_by_label('node', instance, 3).label == 3
+
+    step = odb_handler.analysis_steps[0]
+    assert len(odb_handler.slice_step_frames(step.frames)) == 6
+    frames = odb_handler.slice_step_frames(step.frames, num_frames=3)
+    assert frames[-1] is step.frames[-1]
+    assert [f.frameId for f in odb_handler.frames_at_times(step.frames, [0.05, 0.15, 0.95])] == [0, 1, 5]
+    allse = odb_handler.get_history_output(step, 'Assembly ASSEMBLY', 'ALLSE')
+    np.testing.assert_allclose(allse[:, 1], allse[:, 0]**2)
+    iptv = odb_handler.get_integration_point_volumes(frames, subset)
+    assert [v.shape for v in iptv] == [(80, 1)]*len(frames)
+
+def test_tensor_invariants():
+    rng = np.random.default_rng(0)
+    # Random symmetric tensors, plus an isotropic one (all principals equal)
+    tensor = rng.normal(size=(50, 3, 3))
+    tensor = np.concatenate([tensor + tensor.transpose(0, 2, 1), 2.*np.eye(3)[None]])
+    eig = np.linalg.eigvalsh(tensor)
+    trace = np.trace(tensor, axis1=1, axis2=2)
+    deviatoric = tensor - trace[:, None, None]/3.*np.eye(3)
+    expected = {
+        'MAXPRINC': eig[:, 2], 'MIDPRINC': eig[:, 1], 'MINPRINC': eig[:, 0],
+        'MISES': np.sqrt(1.5*np.sum(deviatoric**2, axis=(1, 2))), 'PRESS': -trace/3., 'TRESCA': eig[:, 2] - eig[:, 0],
+    }
+    i, j = np.array([0, 1, 2, 0, 0, 1]), np.array([0, 1, 2, 1, 2, 2])
+    for field_name, shear_factor in (('S', 1.), ('E', 2.), ('LE', 2.)):
+        # Strains are output with engineering shear components, twice the tensor ones
+        data = tensor[:, i, j]*np.array([1., 1., 1.] + [shear_factor]*3)
+        components = ['{}{}{}'.format(field_name, a + 1, b + 1) for a, b in zip(i, j)]
+        values, labels = tensors.compute_invariants(data, components, field_name, list(tensors.INVARIANTS))
+        assert labels == tensors.invariant_labels(field_name, tensors.INVARIANTS)
+        for k, inv in enumerate(tensors.INVARIANTS):
+            np.testing.assert_allclose(values[:, k], expected[inv], atol=1e-9, err_msg='{}{}'.format(field_name, inv))
+
+def test_derived_expressions(tmp_path):
+    field = derived.parse_derived({'DMGS': 'where(SDEG > 0.5, 2*SMISES, -SMISES) + 1e-3'})['DMGS']
+    assert field.names == ['SDEG', 'SMISES']
+    values = field.evaluate({'SDEG': np.array([0., 1.]), 'SMISES': np.array([2., 3.])}, 2)
+    np.testing.assert_allclose(values, [[-1.999], [6.001]])
+    # Only the whitelisted functions and numeric constants are accepted, checked when the expression is parsed
+    for expression in ('S11.__class__', '__import__("os")', 'sum(S11)', 'S11 + "1"', "S11*b'2'", 'S11*True', '(S11, S22)'):
+        with pytest.raises(ValueError, match='derived field BAD'):
+            derived.parse_derived({'BAD': expression})
+    # and fail the extraction before any data is read
+    path, odb = _synthetic_odb(tmp_path, num_elements=4, num_frames=2)
+    odbex_cfg = {
+        'extract': [{'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-ALL', 'fields': ['S']}],
+        'derived': {'BAD': 'S11 + "1"'},
+    }
+    with pytest.raises(extractor.ExtractionError, match='numeric constants'):
+        extractor.extract(path, odbex_cfg)
+    assert odb.reads == 0
+
+def test_extract(tmp_path):
+    path, odb = _synthetic_odb(tmp_path, num_elements=20, num_frames=5, max_block_rows=50)
+    odbex_cfg = {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'IVOL', 'SDEG']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'number', 'id': [3, '5-6'], 'fields': ['SDEG']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-EVEN', 'fields': ['S'], 'avg': False},
+        ],
+        'nframes': None,
+    }
+    extractor.extract(path, odbex_cfg)
+    with np.load(os.path.join(str(tmp_path), 'odbex_synthetic.npz')) as extracted:
+        assert extracted['Step-1|increments'].shape == (5, 2)
+
+        # Volume-averaged over the set
+        labels = np.arange(1, 11)
+        s, ivol = odb.expected_values(INSTANCE, 'S', labels, frame_value=1.), odb.expected_values(INSTANCE, 'IVOL', labels, frame_value=1.)
+        np.testing.assert_allclose(extracted['Step-1|SET-HALF|S|data'][-1, :6], np.sum(s*ivol, axis=0)/np.sum(ivol), rtol=1e-5)
+        assert list(extracted['Step-1|SET-HALF|S|components'])[-1] == 'SMAXPRINC'
+
+        # One region per element number
+        np.testing.assert_allclose(extracted['Step-1|E5|SDEG|data'][0], odb.expected_values(INSTANCE, 'SDEG', [5]).mean(axis=0), rtol=1e-5)
+        assert 'Step-1|E4|SDEG|data' not in extracted.files
+
+        # Unaveraged data is dense, with the element label/integration point of each row
+        data = extracted['Step-1|SET-EVEN|S|data']
+        assert data.shape == (5, 80, 7)
+        np.testing.assert_array_equal(extracted['Step-1|SET-EVEN|S|elementLabels'], np.repeat(np.arange(2, 21, 2), 8))
+        np.testing.assert_array_equal(extracted['Step-1|SET-EVEN|S|integrationPoints'], np.tile(np.arange(1, 9), 10))
+        assert 'Step-1|SET-EVEN|S|std' not in extracted.files
+
+def test_extract_storage(tmp_path):
+    path, _ = _synthetic_odb(tmp_path, num_elements=20, num_frames=5)
+    odbex_cfg = {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'SDEG']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-EVEN', 'fields': ['S'], 'avg': False},
+        ],
+        'nframes': None,
+    }
+    extractor.extract(path, dict(odbex_cfg, export_prefix='plain', output={'dtype': 'float64'}))
+    extractor.extract(path, dict(odbex_cfg, export_prefix='packed', output={'dtype': 'float32', 'compression': 'deflate', 'delta': True}))
+    with output.NpzArrays(os.path.join(str(tmp_path), 'plain_synthetic.npz')) as plain:
+        with output.NpzArrays(os.path.join(str(tmp_path), 'packed_synthetic.npz')) as packed:
+            assert sorted(plain.keys()) == sorted(packed.keys())
+            assert plain['Step-1|SET-EVEN|S|data'].dtype == np.float64
+            for key in plain.keys():
+                if plain[key].dtype.kind == 'f' and key != 'Step-1|increments':
+                    assert packed[key].dtype == np.float32
+                    np.testing.assert_array_equal(packed[key], plain[key].astype(np.float32))
+                else:
+                    np.testing.assert_array_equal(packed[key], plain[key])
+    assert os.path.getsize(os.path.join(str(tmp_path), 'packed_synthetic.npz')) < os.path.getsize(os.path.join(str(tmp_path), 'plain_synthetic.npz'))/2
+    with pytest.raises(ValueError):
+        output.output_options({'output': {'format': 'stream', 'delta': True}})
+
+def test_extract_time_grid(tmp_path):
+    path, odb = _synthetic_odb(tmp_path, num_elements=20, num_frames=5)
+    odbex_cfg = {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'IVOL']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-EVEN', 'fields': ['SDEG'], 'avg': False},
+        ],
+        'nframes': None,
+        'time_grid': {'times': [0.1, 0.6, 2.], 'interpolate': True},
+    }
+    extractor.extract(path, odbex_cfg)
+    with np.load(os.path.join(str(tmp_path), 'odbex_synthetic.npz')) as extracted:
+        # One increment per target time, numbered by its index on the grid, with the last clamped to the end of the step
+        np.testing.assert_allclose(extracted['Step-1|increments'], [[0, 0.1], [1, 0.6], [2, 2.]])
+        # Synthetic data is linear in time, so interpolating between frames recovers it exactly
+        labels = np.arange(1, 11)
+        s, ivol = odb.expected_values(INSTANCE, 'S', labels, frame_value=0.6), odb.expected_values(INSTANCE, 'IVOL', labels, frame_value=0.6)
+        np.testing.assert_allclose(extracted['Step-1|SET-HALF|S|data'][1, :6], np.sum(s*ivol, axis=0)/np.sum(ivol), rtol=1e-5)
+        sdeg = odb.expected_values(INSTANCE, 'SDEG', np.arange(2, 21, 2), frame_value=0.1)
+        np.testing.assert_allclose(extracted['Step-1|SET-EVEN|SDEG|data'][0], sdeg, rtol=1e-5)
+
+    # Without interpolation, the nearest frames are extracted once each
+    odbex_cfg['time_grid'] = {'Step-1': {'start': 0., 'stop': 0.2, 'num': 3}}
+    extractor.extract(path, odbex_cfg)
+    with np.load(os.path.join(str(tmp_path), 'odbex_synthetic.npz')) as extracted:
+        np.testing.assert_allclose(extracted['Step-1|increments'], [[0, 0.], [1, 0.25]])
+
+def test_extract_incremental_sampling(tmp_path):
+    path, _ = _synthetic_odb(tmp_path, num_elements=4, num_frames=10)
+    odbex_cfg = {
+        'extract': [{'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-ALL', 'fields': ['S']}],
+        'output': {'format': 'stream'},
+    }
+    # Sampling the new frames alone would not match the frames a full extraction samples
+    for sampling in ({'nframes': 3}, {'time_grid': {'times': [0., 0.5]}}):
+        with pytest.raises(extractor.ExtractionError, match='incremental'):
+            extractor.extract(path, dict(odbex_cfg, **sampling), incremental=True)
+    assert not os.path.exists(os.path.join(str(tmp_path), 'odbex_synthetic.manifest.json'))
+    extractor.extract(path, dict(odbex_cfg, nframes=None), incremental=True)
+    assert os.path.exists(os.path.join(str(tmp_path), 'odbex_synthetic.manifest.json'))
+
+def test_extract_shared_reads(tmp_path):
+    path, odb = _synthetic_odb(tmp_path, num_elements=20, num_frames=4)
+    odbex_cfg = {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'IVOL']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'SDEG', 'IVOL']},
+        ],
+        'nframes': None,
+        'constant_volumes': True,
+    }
+    odb.reads = 0
+    extractor.extract(path, odbex_cfg)
+    # Definitions of the same set share its reads, and volumes are read on the first frame only
+    assert odb.reads == 2*4 + 1
+    with np.load(os.path.join(str(tmp_path), 'odbex_synthetic.npz')) as extracted:
+        assert extracted['Step-1|SET-HALF|S|data'].shape == (4, 7)
+        assert extracted['Step-1|SET-HALF|SDEG|data'].shape == (4, 1)
+
+def test_extraction_plan(tmp_path):
+    path, odb = _synthetic_odb(tmp_path, num_elements=20, num_frames=4)
+    odb_handler = extract.OdbHandler(path)
+    instance = odb_handler.get_instance_by_name(INSTANCE)
+    subset = extract.MeshSubset(odb_handler.get_mesh_items_by_set_name('element', instance, 'SET-HALF'), 'element', 'SET-HALF', INSTANCE)
+    field_requests = [extract.FieldRequest(subset, ['S', 'SDEG']), extract.FieldRequest(subset, ['S'])]
+    frames = odb_handler.analysis_steps[0].frames
+
+    # Shared subsets, fields and volumes are read once per frame, or volumes once per step if constant
+    odb.reads = 0
+    results = extract.ExtractionPlan(field_requests).execute(frames)
+    assert odb.reads == 3*len(frames)
+    odb.reads = 0
+    extract.ExtractionPlan(field_requests, constant_volumes=True).execute(frames)
+    assert odb.reads == 2*len(frames) + 1
+
+    fde = extract.FieldDataExtractor(subset.mesh, 'S', frames)
+    fde.extract(ipt_vols=odb_handler.get_integration_point_volumes(frames, subset.mesh))
+    for extractors, _ in results:
+        np.testing.assert_allclose(extractors['S'].field_data, fde.field_data, rtol=1e-6)
+        assert extractors['S'].components == fde.components
+
+def test_extract_region_union(tmp_path):
+    path, odb = _synthetic_odb(tmp_path, num_elements=20, num_frames=3, max_block_rows=30)
+    odbex_cfg = {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-ALL', 'fields': ['S']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'IVOL']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'number', 'id': ['4-5'], 'fields': ['S']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-EVEN', 'fields': ['S'], 'avg': False},
+        ],
+        'nframes': None,
+    }
+    odb.reads = 0
+    extractor.extract(path, odbex_cfg)
+    # Nested regions are read once per frame and field from the largest one
+    assert odb.reads == 2*3
+    with np.load(os.path.join(str(tmp_path), 'odbex_synthetic.npz')) as extracted:
+        labels = np.arange(1, 11)
+        s, ivol = odb.expected_values(INSTANCE, 'S', labels, frame_value=1.), odb.expected_values(INSTANCE, 'IVOL', labels, frame_value=1.)
+        np.testing.assert_allclose(extracted['Step-1|SET-HALF|S|data'][-1, :6], np.sum(s*ivol, axis=0)/np.sum(ivol), rtol=1e-5)
+        np.testing.assert_allclose(extracted['Step-1|E4|S|data'][0, :6], odb.expected_values(INSTANCE, 'S', [4]).mean(axis=0), rtol=1e-5)
+        np.testing.assert_allclose(extracted['Step-1|SET-EVEN|S|data'][0, :, :6], odb.expected_values(INSTANCE, 'S', np.arange(2, 21, 2)), rtol=1e-5)
+        np.testing.assert_array_equal(extracted['Step-1|SET-EVEN|S|elementLabels'], np.repeat(np.arange(2, 21, 2), 8))
+
+def test_extract_spatial(tmp_path):
+    # Row of unit hexahedra along x, the centroid of element n at (n - 0.5, 0.5, 0.5)
+    path, odb = _synthetic_odb(tmp_path, num_elements=12, num_frames=3)
+    selections = {
+        'BOX': ('box', {'min': [1.2, 0., 0.], 'max': [3.9, 1., 1.]}, [2, 3, 4]),
+        'SPHERE': ('sphere', {'center': [0.5, 0.5, 0.5], 'radius': 1.1}, [1, 2]),
+        'CYLINDER': ('cylinder', {'start': [0., 0.5, 0.5], 'end': [2.2, 0.5, 0.5], 'radius': 0.1}, [1, 2]),
+        'SLAB': ('slab', {'point': [5., 0., 0.], 'normal': [2., 0., 0.], 'distance': 1.}, [5, 6]),
+        'OBLIQUE': ('slab', {'point': [8.5, 0.5, 0.5], 'normal': [1., 1., 0.], 'distance': 0.1}, [9]),
+    }
+    odbex_cfg = {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': selector, 'id': rid, 'geometry': spec, 'fields': ['S', 'IVOL']}
+            for rid, (selector, spec, _) in selections.items()
+        ] + [{'subsection': INSTANCE, 'mesh': 'node', 'type': 'box', 'id': 'X0', 'geometry': {'min': [-1., -1., -1.], 'max': [0., 2., 2.]}, 'fields': ['U'], 'avg': False}],
+        'nframes': None,
+    }
+    extraction_regions = extractor.build_extraction_region_dict(odb, odbex_cfg['extract'])
+    for rid, (_, _, labels) in selections.items():
+        assert sorted(e.label for e in extraction_regions[rid]['region'].elements) == labels
+    extractor.extract(path, odbex_cfg)
+    with np.load(os.path.join(str(tmp_path), 'odbex_synthetic.npz')) as extracted:
+        labels = np.array(selections['BOX'][2])
+        s, ivol = odb.expected_values(INSTANCE, 'S', labels, frame_value=1.), odb.expected_values(INSTANCE, 'IVOL', labels, frame_value=1.)
+        np.testing.assert_allclose(extracted['Step-1|BOX|S|data'][-1, :6], np.sum(s*ivol, axis=0)/np.sum(ivol), rtol=1e-5)
+        np.testing.assert_array_equal(np.unique(extracted['Step-1|X0|U|nodeLabels']), [1, 2, 3, 4])
+
+    with pytest.raises(extractor.ExtractionError, match='are within the sphere'):
+        extractor.build_extraction_region_dict(odb, [dict(odbex_cfg['extract'][0], geometry={'center': [100., 0., 0.], 'radius': 1.}, type='sphere')])
+    # Malformed geometry is reported with the region it was given for
+    for geometry in ({'center': [0., 0.], 'radius': 1.}, {'center': [0., 0., 0.]}, {'center': [0., 0., 0.], 'radius': 'big'}):
+        with pytest.raises(extractor.ExtractionError, match='BAD-SPHERE'):
+            extractor.build_extraction_region_dict(odb, [dict(odbex_cfg['extract'][0], id='BAD-SPHERE', geometry=geometry, type='sphere')])
+
+    # The grid index finds the same points as testing all of them
+    points = np.random.RandomState(0).uniform(-1., 1., (5000, 3))*[10., 1., 0.1]
+    index = spatial.GridIndex(points)
+    for selector, spec in [('sphere', {'center': [2., 0., 0.], 'radius': 0.5}), ('box', {'min': [-3., -2., -1.], 'max': [-2., 0., 0.]})]:
+        np.testing.assert_array_equal(spatial.select(index, selector, spec), np.flatnonzero(spatial.contains(selector, spec, points)))
+
+def test_extract_history(tmp_path):
+    path, odb = _synthetic_odb(tmp_path, num_elements=4, num_frames=3, num_steps=2)
+    odbex_cfg = {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-ALL', 'fields': ['SDEG']},
+            {'type': 'history', 'id': 'Assembly ASSEMBLY', 'fields': ['ALLSE', 'ALLKE']},
+            {'type': 'history', 'id': 'Node PART-1-1.1', 'fields': ['RF1']},
+        ],
+        'nframes': None,
+    }
+    for fmt in ('npz', 'consolidated'):
+        extractor.extract(path, dict(odbex_cfg, export_prefix=fmt, output={'format': fmt}))
+    # One read per output and step, at every increment rather than at the frames only
+    assert odb.history_reads == 2*3*2
+    npz = output.NpzArrays(os.path.join(str(tmp_path), 'npz_synthetic.npz'))
+    consolidated = output.load_consolidated(os.path.join(str(tmp_path), 'consolidated_synthetic'))
+    for extracted in (npz, consolidated):
+        for step in ('Step-1', 'Step-2'):
+            allse = extracted[step + '|Assembly ASSEMBLY|ALLSE|history']
+            np.testing.assert_allclose(allse[:, 0], np.linspace(0., 1., 9))
+            np.testing.assert_allclose(allse[:, 1], allse[:, 0]**2)
+            np.testing.assert_allclose(extracted[step + '|Node PART-1-1.1|RF1|history'][:, 1], -5.*np.linspace(0., 1., 9))
+            assert extracted[step + '|increments'].shape == (3, 2)
+    npz.close()
+
+    with pytest.raises(extractor.ExtractionError, match='ALLSE'):
+        extractor.extract(path, dict(odbex_cfg, extract=[{'type': 'history', 'id': 'Assembly ASSEMBLY', 'fields': ['ALLIE']}]))
@@ -0,0 +1,37 @@
+import sys
+
+import numpy as np
+import pytest
+
+from odbex.abqpy.tests import fakeabq
+from odbex import pipe
+
+INSTANCE = 'PART-1-1'
+
+def test_pipe(tmp_path, monkeypatch):
+    # The worker runs under this interpreter with the odbAccess stand-in, generating the odb from its spec file
+    monkeypatch.setenv('PYTHONPATH', fakeabq.FAKEABQ_DIR)
+    path = str(tmp_path.joinpath('synthetic.odb'))
+    fakeabq.write_spec(path, num_elements=20, num_frames=4)
+    odb = fakeabq.make_odb(path=path, num_elements=20, num_frames=4)
+    cfg = {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'IVOL']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-EVEN', 'fields': ['SDEG'], 'avg': False},
+        ],
+        'nframes': None,
+    }
+    events = []
+    sim = pipe.extract(path, cfg, on_progress=events.append, python=(sys.executable,))
+    assert sorted(sim.get_increments('Step-1')) == [0, 1, 2, 3]
+    labels = np.arange(1, 11)
+    s, ivol = odb.expected_values(INSTANCE, 'S', labels, frame_value=1.), odb.expected_values(INSTANCE, 'IVOL', labels, frame_value=1.)
+    np.testing.assert_allclose(sim.get_region_data('Step-1', 'SET-HALF').field_data['S'].data[-1, :6], np.sum(s*ivol, axis=0)/np.sum(ivol), rtol=1e-5)
+    sdeg = sim.get_region_data('Step-1', 'SET-EVEN').field_data['SDEG']
+    np.testing.assert_array_equal(sdeg.indices['elementLabels'], np.repeat(np.arange(2, 21, 2), 8))
+    assert events
+    assert not list(tmp_path.glob('*.npz'))
+
+    # Failures of the worker are raised with its output
+    with pytest.raises(pipe.ExtractionError, match='missing.odb'):
+        pipe.extract(str(tmp_path.joinpath('missing.odb')), cfg, python=(sys.executable,))
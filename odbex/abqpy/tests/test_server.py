@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+import pytest
+
+from odbex.abqpy.tests import fakeabq
+from odbex.abqpy import server
+from odbex.client import ExtractionClient, ServerError
+
+INSTANCE = 'PART-1-1'
+
+def test_server(tmp_path):
+    path = str(tmp_path.joinpath('synthetic.odb'))
+    odb = fakeabq.register(path, fakeabq.make_odb(path=path, num_elements=20, num_frames=4))
+    cfg = {
+        'extract': [
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'IVOL']},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-EVEN', 'fields': ['SDEG'], 'avg': False},
+            {'subsection': INSTANCE, 'mesh': 'element', 'type': 'number', 'id': [1, '3', '5-7'], 'fields': ['SDEG']},
+        ],
+        'nframes': None,
+    }
+    extraction_server = server.ExtractionServer((server.HOST, 0), 'secret', server.OdbPool(max_open=2))
+    thread = threading.Thread(target=extraction_server.serve, daemon=True)
+    thread.start()
+    client = ExtractionClient(server.HOST, extraction_server.server_address[1], 'secret', timeout=10.)
+    try:
+        sim = client.extract(path, cfg)
+        assert sorted(sim.get_increments('Step-1')) == [0, 1, 2, 3]
+        labels = np.arange(1, 11)
+        s, ivol = odb.expected_values(INSTANCE, 'S', labels, frame_value=1.), odb.expected_values(INSTANCE, 'IVOL', labels, frame_value=1.)
+        np.testing.assert_allclose(sim.get_region_data('Step-1', 'SET-HALF').field_data['S'].data[-1, :6], np.sum(s*ivol, axis=0)/np.sum(ivol), rtol=1e-5)
+        sdeg = sim.get_region_data('Step-1', 'SET-EVEN').field_data['SDEG']
+        assert sdeg.data.shape == (4, 80, 1)
+        np.testing.assert_array_equal(sdeg.indices['elementLabels'], np.repeat(np.arange(2, 21, 2), 8))
+
+        # Element numbers and ranges sent as strings are all extracted
+        assert sorted(r for r in sim.regions['Step-1'] if r.startswith('E')) == ['E1', 'E3', 'E5', 'E6', 'E7']
+        np.testing.assert_allclose(
+            sim.get_region_data('Step-1', 'E6').field_data['SDEG'].data[0], odb.expected_values(INSTANCE, 'SDEG', [6]).mean(axis=0), rtol=1e-5
+        )
+
+        # The odb stays open between requests
+        client.extract_arrays(path, cfg)
+        status = client.ping()
+        assert status['open'] == [path] and status['opened'] == 1
+
+        # Errors are reported to the client, and requests without the token refused
+        with pytest.raises(ServerError, match='missing.odb'):
+            client.extract_arrays(str(tmp_path.joinpath('missing.odb')), cfg)
+        with pytest.raises(ServerError, match='token'):
+            ExtractionClient(client.host, client.port, 'wrong', timeout=10.).ping()
+    finally:
+        client.shutdown()
+        thread.join(10.)
+    assert not thread.is_alive()
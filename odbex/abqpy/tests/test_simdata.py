@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from odbex.abqpy import extractor, output
+from odbex.abqpy.tests import fakeabq
+from odbex.post.simdata import SimulationData
+
+INSTANCE = 'PART-1-1'
+CFG = {
+    'extract': [
+        {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-HALF', 'fields': ['S', 'SDEG']},
+        {'subsection': INSTANCE, 'mesh': 'element', 'type': 'set', 'id': 'SET-EVEN', 'fields': ['S'], 'avg': False},
+        {'type': 'history', 'id': 'Assembly ASSEMBLY', 'fields': ['ALLSE']},
+    ],
+    'nframes': None,
+}
+
+def _py2_npz(path):
+    # Labels written by abaqus python 2 are byte strings, which load as bytes under Python 3
+    np.savez(
+        path, **{
+            'Step-1|increments': np.array([[0, 0.], [1, 1.]]),
+            'Step-1|SET-1|S|data': np.arange(6, dtype=np.float32).reshape(2, 3),
+            'Step-1|SET-1|S|std': np.zeros((2, 3), dtype=np.float32),
+            'Step-1|SET-1|S|components': np.array([b'S11', b'S22', b'MISES']),
+        }
+    )
+    return path
+
+def test_bytes_components(tmp_path):
+    sim = SimulationData.open(_py2_npz(tmp_path.joinpath('py2.npz')))
+    s = sim.get_region_data('Step-1', 'SET-1').field_data['S']
+    assert s.components == ['S11', 'S22', 'MISES']
+    np.testing.assert_array_equal(s.data[:, s.components.index('MISES')], [2., 5.])
+
+def test_npz_refuses_pickles(tmp_path):
+    # Object arrays are unpickled when loaded, which could run arbitrary code from an untrusted output file
+    path = tmp_path.joinpath('pickled.npz')
+    np.savez(path, **{'Step-1|increments': np.array([[0, 0.]]), 'Step-1|SET-1|S|components': np.array([{'S11': 0}], dtype=object)})
+    sim = SimulationData.open(path)
+    with pytest.raises(ValueError, match='allow_pickle'):
+        sim.get_region_data('Step-1', 'SET-1').field_data['S'].components
+
+def _assert_round_trip(tmp_path, fmt, ext=''):
+    # The same extraction written as .npz and in another format opens to the same simulation data
+    odb = str(tmp_path.joinpath('synthetic.odb'))
+    fakeabq.register(odb, fakeabq.make_odb(path=odb, num_elements=20, num_frames=5))
+    extractor.extract(odb, dict(CFG, export_prefix='npz'))
+    extractor.extract(odb, dict(CFG, export_prefix=fmt, output={'format': fmt}))
+    expected = SimulationData.open(output.output_filepath(odb, 'npz'))
+    sim = SimulationData.open(output.output_filepath(odb, fmt, ext=ext))
+    assert {step: sorted(regions) for step, regions in sim.regions.items()} == {step: sorted(regions) for step, regions in expected.regions.items()}
+    for step, sd in expected.step_data.items():
+        assert sim.get_increments(step) == sd.increments
+        for region, rd in sd.region_data.items():
+            assert sorted(sim.get_region_data(step, region).field_data) == sorted(rd.field_data)
+            for field_name, fd in rd.field_data.items():
+                actual = sim.get_region_data(step, region).field_data[field_name]
+                assert actual.components == fd.components
+                for data_id in ('data', 'std', 'history'):
+                    a, e = getattr(actual, data_id), getattr(fd, data_id)
+                    assert (a is None) == (e is None), (region, field_name, data_id)
+                    if e is not None: np.testing.assert_array_equal(a, e)
+                assert sorted(actual.indices) == sorted(fd.indices)
+                for data_id, index in fd.indices.items():
+                    np.testing.assert_array_equal(actual.indices[data_id], index)
+    return sim
+
+def test_stream_round_trip(tmp_path):
+    sim = _assert_round_trip(tmp_path, 'stream')
+    assert sim.get_region_data('Step-1', 'SET-EVEN').field_data['S'].data.shape == (5, 80, 7)
+    assert sim.get_region_data('Step-1', 'Assembly ASSEMBLY').field_data['ALLSE'].history is not None
+
+def test_consolidated_round_trip(tmp_path):
+    _assert_round_trip(tmp_path, 'consolidated')
+
+def test_hdf5_round_trip(tmp_path):
+    # h5py is an optional dependency (odbex[hdf5])
+    pytest.importorskip('h5py')
+    _assert_round_trip(tmp_path, 'hdf5', ext=output.HDF5_EXT)
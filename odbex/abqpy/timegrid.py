@@ -0,0 +1,81 @@
+"""
+Selection of frames at target times, so that runs with different increments can be lined up on a common time grid.
+
+The "time_grid" config entry gives the target (step) times, either as a list or as an evenly spaced grid:
+    {"times": [0.0, 0.5, 1.0]} or {"start": 0.0, "stop": 1.0, "num": 11}
+optionally with "interpolate": true, or a dictionary of these keyed by step name for per-step grids.
+The frames bracketing each target are found by binary search over the frame values, so only the frames which are
+needed are ever accessed. Targets outside the step are clamped to its first/last frame.
+"""
+import numpy as np
+
+SPEC_KEYS = ('times', 'start', 'stop', 'num', 'interpolate')
+
+def step_grid(time_grid, step_name):
+    # type: (dict | None, str) -> dict | None
+    '''Time grid of a step: the config entry itself, or its entry for the step when given per step.'''
+    if not time_grid: return None
+    if any(k in time_grid for k in SPEC_KEYS): return time_grid
+    return time_grid.get(step_name)
+
+def target_times(spec):
+    # type: (dict) -> np.ndarray
+    if 'times' in spec:
+        times = np.asarray(spec['times'], dtype=float).reshape(-1)
+    else:
+        try:
+            times = np.linspace(float(spec['start']), float(spec['stop']), int(spec['num']))
+        except KeyError as e:
+            raise ValueError('time grid requires either "times" or "start", "stop" and "num" (missing {})'.format(e))
+    if np.any(np.diff(times) < 0):
+        raise ValueError('time grid times must be in increasing order')
+    return times
+
+def _last_at_or_before(frame_value, lo, hi, t):
+    # type: (Callable[[int], float], int, int, float) -> int
+    '''Index of the last frame in [lo, hi) with a value <= t (lo - 1 if none), by binary search.'''
+    while lo < hi:
+        mid = (lo + hi)//2
+        if frame_value(mid) <= t: lo = mid + 1
+        else: hi = mid
+    return lo - 1
+
+def bracket_frames(frames, times, interpolate=False):
+    # type: (list[OdbFrame], np.ndarray, bool) -> list[tuple[int, int, float]]
+    '''
+    For each target time, the indices of the frames before/after it and the linear interpolation weight of the
+    latter. Without interpolation, both indices are those of the nearest frame (weight 0).
+    Frame values are read lazily, and each at most once.
+    '''
+    values = {}
+    def frame_value(i):
+        if i not in values: values[i] = frames[i].frameValue
+        return values[i]
+
+    num_frames = len(frames)
+    if num_frames == 0: return []
+    brackets, lo = [], 0
+    for t in times:
+        # Targets are increasing, so the search for each one starts from the previous bracket
+        k = _last_at_or_before(frame_value, lo, num_frames, t)
+        if k < 0:
+            brackets.append((0, 0, 0.))
+            continue
+        lo = k
+        if k == num_frames - 1 or frame_value(k) == t:
+            brackets.append((k, k, 0.))
+            continue
+        v0, v1 = frame_value(k), frame_value(k + 1)
+        weight = (t - v0)/(v1 - v0) if v1 > v0 else 0.
+        if not interpolate:
+            k = k + 1 if weight > 0.5 else k
+            brackets.append((k, k, 0.))
+        else:
+            brackets.append((k, k + 1, weight))
+    return brackets
+
+def nearest_frames(frames, times):
+    # type: (list[OdbFrame], np.ndarray) -> list[OdbFrame]
+    '''The frame nearest to each target time, without duplicates (several targets may share a frame).'''
+    indices = sorted(set(lo for lo, _, _ in bracket_frames(frames, times)))
+    return [frames[i] for i in indices]
@@ -0,0 +1,137 @@
+"""
+Local, content-addressed cache of extracted data.
+
+Each requested field of each extraction definition is cached separately, keyed by a fingerprint of the odb
+(path, size, mtime and the bytes at either end) and a hash of everything in the config which affects that
+field's data. Re-running an extraction after a config tweak, or after a crash, only extracts the fields
+which are not already cached. The mesh exported from an odb is cached by its fingerprint alone. The cache is
+bounded in size, evicting the least recently used entries first.
+"""
+import json
+import os
+import pathlib
+import tempfile
+import threading
+
+import numpy as np
+from attrs import define
+
+from odbex.abqpy import _hashing, output, regions
+
+CACHE_DIR_ENV = 'ODBEX_CACHE_DIR'
+CACHE_SIZE_ENV = 'ODBEX_CACHE_SIZE'
+DEFAULT_CACHE_DIR = pathlib.Path.home().joinpath('.cache', 'odbex')
+DEFAULT_CACHE_SIZE = 10*1024**3
+CACHE_VERSION = 3
+
+@define
+class CacheEntry:
+    key: str
+    definition: dict
+    field: str
+    region_ids: list[str]
+
+    @property
+    def region_fields(self) -> list[str]:
+        return [output.KEY_SEP.join([rid, self.field]) for rid in self.region_ids]
+
+@define
+class ExtractionCache:
+    directory: pathlib.Path
+    max_size: int = DEFAULT_CACHE_SIZE
+
+    @classmethod
+    def from_env(cls, max_size: int | None = None) -> 'ExtractionCache':
+        directory = pathlib.Path(os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR))
+        if max_size is None: max_size = int(float(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE)))
+        return cls(directory, max_size)
+
+    @staticmethod
+    def supports(odbex_cfg: dict) -> bool:
+        # Cached blocks are assembled into a single .npz, so streamed output (and incremental extraction) bypass the cache
+        return output.output_options(odbex_cfg)['format'] == 'npz'
+
+    def entries(self, odb: str, odbex_cfg: dict) -> list[CacheEntry]:
+        '''One cache entry for each field of each extraction definition in the config.'''
+        fingerprint = _hashing.odb_fingerprint(odb)
+        derived = odbex_cfg.get('derived') or {}
+        options = {k: v for k, v in output.output_options(odbex_cfg).items() if k != 'format'}
+        entries, extracted = [], set()
+        for ed in odbex_cfg['extract']:
+            definition = {k: v for k, v in ed.items() if k != 'fields'}
+            for field in ed['fields']:
+                # As in the extraction, a field of a region requested by several definitions comes from the first one
+                region_ids = [rid for rid in regions.region_ids(ed) if (rid, field) not in extracted]
+                if not region_ids: continue
+                extracted.update((rid, field) for rid in region_ids)
+                key = _hashing.config_hash({
+                    'version': CACHE_VERSION, 'odb': fingerprint, 'definition': definition, 'field': field,
+                    'region_ids': region_ids, 'volume_weighted': 'IVOL' in ed['fields'],
+                    'derived': derived.get(field), 'nframes': odbex_cfg.get('nframes'),
+                    'time_grid': odbex_cfg.get('time_grid'), 'constant_volumes': odbex_cfg.get('constant_volumes', False),
+                    'output': options,
+                })
+                entries.append(CacheEntry(key, ed, field, region_ids))
+        return entries
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory.joinpath(key[:2], f'{key}.npz')
+
+    def mesh_path(self, odb: str) -> pathlib.Path:
+        '''Path of the mesh exported from an odb (odbex.mesh), shared by every extraction from it.'''
+        return self.directory.joinpath('mesh', f'{_hashing.odb_fingerprint(odb)}.npz')
+
+    def has(self, entry: CacheEntry) -> bool:
+        return self._path(entry.key).exists()
+
+    def store(self, entries: list[CacheEntry], arrays: dict[str, np.ndarray]) -> None:
+        '''Split the arrays of an extraction into cache entries.'''
+        increments = {k: v for k, v in arrays.items() if k.endswith(output.KEY_SEP + 'increments')}
+        for entry in entries:
+            region_fields = set(entry.region_fields)
+            entry_arrays = {
+                k: v for k, v in arrays.items() if output.KEY_SEP.join(k.split(output.KEY_SEP)[1:3]) in region_fields
+            }
+            entry_arrays.update(increments)
+            path = self._path(entry.key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so that concurrent workers never see a partial entry
+            tmp = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp.npz')
+            np.savez(tmp, **entry_arrays)
+            os.replace(tmp, path)
+
+    def assemble(self, entries: list[CacheEntry], writer: output.NpzWriter) -> None:
+        '''Write the cached data of entries to the output of an extraction.'''
+        for i, entry in enumerate(entries):
+            path = self._path(entry.key)
+            os.utime(path)  # Mark as recently used
+            with output.NpzArrays(str(path)) as cached:
+                output.replay(cached, writer, increments=i == 0)
+        writer.close()
+
+    def evict(self) -> None:
+        '''Remove the least recently used entries until the cache fits in its maximum size.'''
+        files = [(f.stat().st_mtime, f.stat().st_size, f) for f in self.directory.glob('*/*.npz')]
+        size = sum(f[1] for f in files)
+        for _, file_size, f in sorted(files, key=lambda f: f[0]):
+            if size <= self.max_size: break
+            f.unlink(missing_ok=True)
+            size -= file_size
+
+    def extraction_config(self, odbex_cfg: dict, entries: list[CacheEntry], prefix: str) -> dict:
+        '''Config extracting only the fields of the given entries, written as a .npz with a different prefix.'''
+        fields = {}
+        for entry in entries:
+            fields.setdefault(id(entry.definition), (entry.definition, []))[1].append(entry.field)
+        # Fields are averaged weighted by the integration point volumes of their definition, so these are always re-read
+        for ed, ed_fields in fields.values():
+            if 'IVOL' in ed['fields'] and 'IVOL' not in ed_fields: ed_fields.append('IVOL')
+        extract = [dict(ed, fields=ed_fields) for ed, ed_fields in fields.values()]
+        return dict(odbex_cfg, extract=extract, export_prefix=prefix, output=dict(odbex_cfg.get('output') or {}, format='npz'))
+
+def temporary_config(odbex_cfg: dict) -> str:
+    '''Write a config to a temporary file for an abaqus python worker, returning its path.'''
+    fd, path = tempfile.mkstemp(prefix='odbex_cfg_', suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(odbex_cfg, f)
+    return path
@@ -0,0 +1,129 @@
+"""
+Python 3 client of the extraction server (odbex.abqpy.server), which keeps odbs open under abaqus python between
+queries:
+
+    python -m odbex.client start      # start a server in the background
+    python -m odbex.client status
+    python -m odbex.client stop
+
+    client = ExtractionClient.connect()
+    sim = client.extract('job.odb', 'odbex_cfg.json')  # SimulationData
+"""
+import argparse
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+from attrs import define
+
+from odbex.abqpy import framing
+from odbex.post.simdata import SimulationData
+
+PARENT = pathlib.Path(__file__).parent
+SERVER = PARENT.joinpath('abqpy/serve.py')
+STATE_FILE_ENV = 'ODBEX_SERVER_FILE'
+DEFAULT_STATE_FILE = pathlib.Path.home().joinpath('.odbex', 'server.json')
+
+class ServerError(Exception):
+    '''Raised when the extraction server cannot be reached or fails to handle a request.'''
+
+def state_filepath(path: str | pathlib.Path | None = None) -> pathlib.Path:
+    return pathlib.Path(path or os.environ.get(STATE_FILE_ENV, DEFAULT_STATE_FILE))
+
+def _load_config(cfg: dict | str | pathlib.Path) -> dict:
+    if isinstance(cfg, dict): return cfg
+    with open(cfg, 'r') as f:
+        return json.load(f)
+
+@define
+class ExtractionClient:
+    host: str
+    port: int
+    token: str
+    timeout: float | None = None
+
+    @classmethod
+    def connect(cls, state_file: str | pathlib.Path | None = None, timeout: float | None = None) -> 'ExtractionClient':
+        '''Client of the server whose port and token are in the state file.'''
+        path = state_filepath(state_file)
+        try:
+            state = json.loads(path.read_text())
+        except FileNotFoundError:
+            raise ServerError(f'no extraction server running (no state file at {path}), start one with python -m odbex.client start')
+        return cls(state['host'], state['port'], state['token'], timeout)
+
+    @classmethod
+    def start(cls, state_file: str | pathlib.Path | None = None, max_open: int = 4, wait: float = 300.) -> 'ExtractionClient':
+        '''Start a server under abaqus python in the background, returning a client once it is listening.'''
+        path = state_filepath(state_file)
+        if path.exists(): path.unlink()
+        cmd = ['abaqus', 'python', SERVER.as_posix(), '--state-file', str(path), '--max-open', str(max_open)]
+        log = path.with_suffix('.log')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(log, 'w') as f:
+            # The abaqus command is a batch script on Windows, so it has to go through the shell there
+            subprocess.Popen(cmd, shell=os.name == 'nt', stdout=f, stderr=subprocess.STDOUT, start_new_session=True)
+        deadline = time.monotonic() + wait
+        while not path.exists():
+            if time.monotonic() > deadline:
+                raise ServerError(f'extraction server did not start within {wait:.0f} s, see {log}')
+            time.sleep(0.2)
+        return cls.connect(path)
+
+    def request(self, command: str, **kwargs) -> tuple[dict, dict[str, np.ndarray]]:
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+                with sock.makefile('wb') as f:
+                    framing.write_message(f, {'command': command, 'token': self.token, **kwargs})
+                with sock.makefile('rb') as f:
+                    response, arrays = framing.read_message(f)
+        except (OSError, EOFError) as e:
+            raise ServerError(f'cannot reach extraction server at {self.host}:{self.port} ({e})')
+        if not response.get('ok'): raise ServerError(response.get('error', 'request failed'))
+        return response, arrays
+
+    def ping(self) -> dict:
+        '''Server process id and the odbs it has open.'''
+        return self.request('ping')[0]
+
+    def extract_arrays(self, odb: str | pathlib.Path, cfg: dict | str | pathlib.Path) -> dict[str, np.ndarray]:
+        '''STEP|REGION|FIELD|DATA_ID keyed arrays of the data requested in an odbex config (dictionary or file).'''
+        return self.request('extract', odb=os.path.abspath(odb), cfg=_load_config(cfg))[1]
+
+    def extract(self, odb: str | pathlib.Path, cfg: dict | str | pathlib.Path) -> SimulationData:
+        return SimulationData.from_arrays(self.extract_arrays(odb, cfg))
+
+    def close_odb(self, odb: str | pathlib.Path | None = None) -> None:
+        '''Close an odb on the server (e.g., to release its lock), or all of them.'''
+        self.request('close', odb=None if odb is None else os.path.abspath(odb))
+
+    def shutdown(self) -> None:
+        self.request('shutdown')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='odbex.client')
+    parser.add_argument('command', choices=['start', 'status', 'stop'])
+    parser.add_argument('--state-file', default=None, help=f'State file of the server. Defaults to ${STATE_FILE_ENV} or {DEFAULT_STATE_FILE}.')
+    parser.add_argument('--max-open', type=int, default=4, help='Number of odbs the server keeps open.')
+    args = parser.parse_args()
+    try:
+        if args.command == 'start':
+            client = ExtractionClient.start(args.state_file, args.max_open)
+            print(f'extraction server listening on {client.host}:{client.port}')
+        elif args.command == 'status':
+            status = ExtractionClient.connect(args.state_file).ping()
+            print(f'extraction server (pid {status["pid"]}) has {len(status["open"])} odbs open')
+            for odb in status['open']: print(f'-> {odb}')
+        else:
+            ExtractionClient.connect(args.state_file).shutdown()
+            print('extraction server stopped')
+    except ServerError as e:
+        sys.exit(f'error: {e}')
+
+if __name__ == '__main__':
+    main()
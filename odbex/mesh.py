@@ -0,0 +1,46 @@
+"""
+Mesh geometry and connectivity of an odb, exported once by an abaqus python worker (odbex.abqpy.geometry) and
+cached by the odb fingerprint, so that spatial post-processing of any result extracted from it never reopens the odb:
+
+    mesh = load_mesh('job.odb')  # odbex.post.mesh.MeshData
+    instance = mesh.instances['PART-1-1']
+    instance.coordinates, instance.connectivity[instance.offsets[0]:instance.offsets[1]]
+"""
+import os
+import pathlib
+import subprocess
+
+from odbex.cache import ExtractionCache
+from odbex.pipe import ABAQUS_PYTHON
+from odbex.post.mesh import MeshData
+
+EXPORTER = pathlib.Path(__file__).parent.joinpath('abqpy/export_mesh.py')
+
+class MeshExportError(Exception):
+    '''Raised when the abaqus python worker fails to export the mesh of an odb.'''
+
+def export_mesh(
+        odb: str | pathlib.Path, cache: ExtractionCache | None = None, refresh: bool = False,
+        python: tuple[str, ...] = ABAQUS_PYTHON
+    ) -> pathlib.Path:
+    '''Path of the cached mesh of an odb, exporting it first unless it is already cached.'''
+    if cache is None: cache = ExtractionCache.from_env()
+    odb = str(odb)
+    path = cache.mesh_path(odb)
+    if path.exists() and not refresh:
+        os.utime(path)  # Mark as recently used
+        return path
+    cmd = [*python, EXPORTER.as_posix(), odb, str(path)]
+    # The abaqus command is a batch script on Windows, so it has to go through the shell there
+    p = subprocess.run(cmd, shell=os.name == 'nt', capture_output=True, text=True)
+    if p.returncode != 0 or not path.exists():
+        raise MeshExportError(f'exporting the mesh of {odb} failed\n{p.stdout}{p.stderr}')
+    cache.evict()
+    return path
+
+def load_mesh(
+        odb: str | pathlib.Path, cache: ExtractionCache | None = None, refresh: bool = False,
+        python: tuple[str, ...] = ABAQUS_PYTHON
+    ) -> MeshData:
+    '''Mesh of an odb, exported by abaqus python only the first time.'''
+    return MeshData.open(export_mesh(odb, cache, refresh, python))
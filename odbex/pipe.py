@@ -0,0 +1,68 @@
+"""
+Extraction straight into Python 3: the abaqus python worker sends the extracted arrays over its stdout pipe
+(framed as in odbex.abqpy.framing) instead of writing an output file next to the odb, and they are returned
+as SimulationData.
+"""
+import os
+import pathlib
+import subprocess
+import threading
+from typing import Callable
+
+import numpy as np
+
+from odbex.abqpy import framing, metrics
+from odbex.cache import temporary_config
+from odbex.post.simdata import SimulationData
+
+EXTRACTOR = pathlib.Path(__file__).parent.joinpath('abqpy/__main__.py')
+ABAQUS_PYTHON = ('abaqus', 'python')
+
+class ExtractionError(Exception):
+    '''Raised when the abaqus python worker fails to extract the requested data.'''
+
+def _read_stderr(stream, lines: list[str], on_progress: Callable[[dict], None] | None) -> None:
+    for line in iter(stream.readline, b''):
+        line = line.decode(errors='replace')
+        event = metrics.parse_progress(line)
+        if event is None: lines.append(line)
+        elif on_progress is not None: on_progress(event)
+
+def extract_arrays(
+        odb: str | pathlib.Path, cfg: dict | str | pathlib.Path, on_progress: Callable[[dict], None] | None = None,
+        python: tuple[str, ...] = ABAQUS_PYTHON
+    ) -> tuple[dict[str, np.ndarray], dict]:
+    '''
+    Extract the data requested in a config (dictionary or file) from an odb with an abaqus python worker,
+    returning the STEP|REGION|FIELD|DATA_ID keyed arrays and the metrics of the extraction.
+    Progress events of the worker are handed to on_progress.
+    '''
+    cfg_filepath = temporary_config(cfg) if isinstance(cfg, dict) else str(cfg)
+    cmd = [*python, EXTRACTOR.as_posix(), str(odb), cfg_filepath, '--pipe']
+    if on_progress is not None: cmd.append('--progress-events')
+    output = []
+    try:
+        # The abaqus command is a batch script on Windows, so it has to go through the shell there
+        with subprocess.Popen(cmd, shell=os.name == 'nt', stdout=subprocess.PIPE, stderr=subprocess.PIPE) as p:
+            stderr = threading.Thread(target=_read_stderr, args=(p.stderr, output, on_progress), daemon=True)
+            stderr.start()
+            try:
+                framing.skip_to_marker(p.stdout, lambda line: output.append(line.decode(errors='replace')))
+                header, arrays = framing.read_message(p.stdout)
+            except (EOFError, ValueError):
+                header, arrays = {'ok': False, 'error': 'worker exited without sending any data'}, {}
+            p.wait()
+            stderr.join()
+    finally:
+        if isinstance(cfg, dict): os.remove(cfg_filepath)
+    if not header.get('ok'):
+        raise ExtractionError(f'extraction from {odb} failed ({header.get("error")})\n{"".join(output)}')
+    return arrays, header.get('metrics', {})
+
+def extract(
+        odb: str | pathlib.Path, cfg: dict | str | pathlib.Path, on_progress: Callable[[dict], None] | None = None,
+        python: tuple[str, ...] = ABAQUS_PYTHON
+    ) -> SimulationData:
+    '''Extract the data requested in a config (dictionary or file) from an odb, without writing an output file.'''
+    arrays, _ = extract_arrays(odb, cfg, on_progress, python)
+    return SimulationData.from_arrays(arrays)
@@ -0,0 +1,196 @@
+"""
+SQLite catalog of extraction results, for querying a campaign of many runs without opening every result file.
+
+Each indexed result records its run name, source odb, steps (frame counts and time ranges), and the regions, fields
+and components it holds with summary statistics (final, max. and min. value). Re-indexing only reads results which
+were modified since they were last indexed.
+"""
+import contextlib
+import os
+import pathlib
+import sqlite3
+import time
+from typing import Iterator
+
+import numpy as np
+from attrs import define
+
+from odbex.abqpy import output
+from odbex.post.simdata import ArrayStore
+
+_SCHEMA = '''
+create table if not exists results (
+    id integer primary key, path text unique not null, run text not null, odb text, mtime real not null, indexed real not null
+);
+create table if not exists steps (
+    result_id integer not null references results(id) on delete cascade,
+    step text not null, num_frames integer not null, start_time real, end_time real
+);
+create table if not exists fields (
+    result_id integer not null references results(id) on delete cascade,
+    step text not null, region text not null, field text not null, component text not null,
+    final real, max real, min real
+);
+create index if not exists fields_lookup on fields(field, region, component);
+'''
+
+@define
+class CatalogMatch:
+    path: pathlib.Path
+    run: str
+    step: str
+    region: str
+    field: str
+    component: str
+    final: float
+    max: float
+    min: float
+    end_time: float | None
+
+    def load(self) -> np.ndarray:
+        '''Data of the matched field (all components) from its result file.'''
+        return np.asarray(ArrayStore(self.path)[output.KEY_SEP.join([self.step, self.region, self.field, 'data'])])
+
+def _is_result(path: pathlib.Path) -> bool:
+    if '.shard' in path.name or path.name.startswith('odbex-cache-'): return False
+    if path.is_dir():
+        return any(path.joinpath(f).exists() for f in (output.INDEX_FILENAME, output.CONSOLIDATED_INDEX_FILENAME))
+    return path.suffix in ('.npz', '.h5', '.hdf5')
+
+def _modified_time(path: pathlib.Path) -> float:
+    # Streamed output is appended to without touching its index, so check every file of a directory output
+    if not path.is_dir(): return path.stat().st_mtime
+    return max([path.stat().st_mtime] + [f.stat().st_mtime for f in path.rglob('*') if f.is_file()])
+
+def _field_stats(data: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Final, max. and min. value of each component, over all output locations of unaveraged data.'''
+    data = np.asarray(data, dtype=float)
+    data = data.reshape(data.shape[0], -1, data.shape[-1])
+    with np.errstate(all='ignore'):
+        return np.nanmax(data[-1], axis=0), np.nanmax(data, axis=(0, 1)), np.nanmin(data, axis=(0, 1))
+
+@define
+class Catalog:
+    path: pathlib.Path
+    prefix: str = 'odbex'
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        '''Connection to the catalog for a single transaction, closed afterwards so that the file is not left locked.'''
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            connection.execute('pragma foreign_keys = on')
+            connection.executescript(_SCHEMA)
+            with connection:
+                yield connection
+
+    def _run_name(self, path: pathlib.Path) -> str:
+        name = path.name[:-len(path.suffix)] if path.suffix else path.name
+        return name[len(self.prefix) + 1:] if name.startswith(f'{self.prefix}_') else name
+
+    def index(self, *paths: str | pathlib.Path, force: bool = False) -> int:
+        '''
+        Index result files, and the result files and directories found under directories. Results which have not
+        been modified since they were last indexed are skipped unless forced. Returns the number of results (re)indexed.
+        '''
+        results = []
+        for p in map(pathlib.Path, paths):
+            if _is_result(p): results.append(p)
+            elif p.is_dir(): results += sorted(f for f in p.rglob('*') if _is_result(f) and not _is_result(f.parent))
+        indexed = 0
+        with self._connect() as connection:
+            for result in results:
+                result = result.resolve()
+                mtime = _modified_time(result)
+                row = connection.execute('select id, mtime from results where path = ?', (str(result), )).fetchone()
+                if row is not None:
+                    if row[1] == mtime and not force: continue
+                    connection.execute('delete from results where id = ?', (row[0], ))
+                self._index_result(connection, result, mtime)
+                indexed += 1
+        return indexed
+
+    def _index_result(self, connection: sqlite3.Connection, path: pathlib.Path, mtime: float) -> None:
+        run = self._run_name(path)
+        odb = path.parent.joinpath(f'{run}.odb')
+        result_id = connection.execute(
+            'insert into results (path, run, odb, mtime, indexed) values (?, ?, ?, ?, ?)',
+            (str(path), run, str(odb) if odb.exists() else None, mtime, time.time())
+        ).lastrowid
+        store = ArrayStore(path, max_arrays=2)
+        steps, fields = [], []
+        for key in store.keys:
+            parts = key.split(output.KEY_SEP)
+            if parts[1:] == ['increments']:
+                times = np.asarray(store[key])[:, 1]
+                steps.append((result_id, parts[0], len(times), float(times.min()) if len(times) else None, float(times.max()) if len(times) else None))
+            elif parts[-1] == 'data':
+                step, region, field = parts[:3]
+                data = store[key]
+                if data.shape[0] == 0: continue
+                components_key = output.KEY_SEP.join([step, region, field, 'components'])
+                components = output.decode_labels(store[components_key]) if components_key in store else [field]
+                for component, final, max_, min_ in zip(components, *_field_stats(data)):
+                    fields.append((result_id, step, region, field, component, float(final), float(max_), float(min_)))
+            elif parts[-1] == output.HISTORY_DATA_ID:
+                step, region, field = parts[:3]
+                history = np.asarray(store[key])
+                if history.shape[0] == 0: continue
+                final, max_, min_ = _field_stats(history[:, 1:])
+                fields.append((result_id, step, region, field, field, float(final[0]), float(max_[0]), float(min_[0])))
+        connection.executemany('insert into steps values (?, ?, ?, ?, ?)', steps)
+        connection.executemany('insert into fields values (?, ?, ?, ?, ?, ?, ?, ?)', fields)
+
+    def remove_missing(self) -> int:
+        '''Drop results whose files no longer exist from the catalog.'''
+        with self._connect() as connection:
+            missing = [(i, ) for i, p in connection.execute('select id, path from results') if not os.path.exists(p)]
+            connection.executemany('delete from results where id = ?', missing)
+        return len(missing)
+
+    def query(
+            self, field: str | None = None, region: str | None = None, step: str | None = None,
+            component: str | None = None, run: str | None = None, min_end_time: float | None = None,
+            final_above: float | None = None, final_below: float | None = None,
+            max_above: float | None = None, min_below: float | None = None
+        ) -> list[CatalogMatch]:
+        '''
+        Find the fields of indexed results matching all of the given criteria, e.g.
+        catalog.query(field='SDEG', region='INTERFACE', min_end_time=300., max_above=0.5).
+        Runs, steps, regions, fields and components may use SQL wildcards (%, _).
+        '''
+        conditions, values = [], []
+        for column, value in (('f.field', field), ('f.region', region), ('f.step', step), ('f.component', component), ('r.run', run)):
+            if value is not None:
+                conditions.append(f'{column} like ?')
+                values.append(value)
+        for condition, value in (
+                ('s.end_time >= ?', min_end_time), ('f.final > ?', final_above), ('f.final < ?', final_below),
+                ('f.max > ?', max_above), ('f.min < ?', min_below),
+            ):
+            if value is not None:
+                conditions.append(condition)
+                values.append(value)
+        sql = '''
+            select r.path, r.run, f.step, f.region, f.field, f.component, f.final, f.max, f.min, s.end_time
+            from fields f join results r on r.id = f.result_id
+            left join steps s on s.result_id = f.result_id and s.step = f.step
+        '''
+        if conditions: sql += ' where ' + ' and '.join(conditions)
+        with self._connect() as connection:
+            rows = connection.execute(sql + ' order by r.run, f.step, f.region, f.field', values).fetchall()
+        return [CatalogMatch(pathlib.Path(row[0]), *row[1:]) for row in rows]
+
+    def paths(self, **criteria) -> list[pathlib.Path]:
+        '''Result files with at least one field matching the criteria of query.'''
+        return sorted(set(m.path for m in self.query(**criteria)))
+
+    def load(self, **criteria) -> dict[tuple[str, str, str, str], np.ndarray]:
+        '''
+        Data of the fields matching the criteria of query, keyed by (run, step, region, field).
+        Only the matched result files are opened.
+        '''
+        arrays = {}
+        for m in self.query(**criteria):
+            key = (m.run, m.step, m.region, m.field)
+            if key not in arrays: arrays[key] = m.load()
+        return arrays
@@ -0,0 +1,94 @@
+"""
+Partial reads of HDF5 output written by odbex.abqpy.output.HDF5Writer.
+Datasets are only read for the requested frame window and components (an HDF5 hyperslab), so that slicing a
+multi-GB unaveraged extraction does not load it fully.
+"""
+import pathlib
+
+import numpy as np
+
+from odbex.abqpy import output
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+class HDF5Reader:
+    def __init__(self, path: pathlib.Path):
+        if h5py is None:
+            raise ImportError('reading hdf5 output requires h5py, which is not installed')
+        self.path = pathlib.Path(path)
+        self._file = h5py.File(self.path, 'r')
+
+    def __enter__(self) -> 'HDF5Reader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    @property
+    def steps(self) -> list[str]:
+        return list(self._file.keys())
+
+    def regions(self, step: str) -> list[str]:
+        return [k for k, v in self._file[step].items() if isinstance(v, h5py.Group)]
+
+    def fields(self, step: str, region: str) -> list[str]:
+        return list(self._file[step][region].keys())
+
+    def increments(self, step: str) -> np.ndarray:
+        '''(frames, 2) array of the frame id and time of each frame of a step.'''
+        return self._file[step]['increments'][()]
+
+    def components(self, step: str, region: str, field: str) -> list[str]:
+        components = self._file[step][region][field].attrs.get('components')
+        return [] if components is None else output.decode_labels(components)
+
+    def frame_window(self, step: str, start_time: float | None = None, stop_time: float | None = None) -> slice:
+        '''Frames of a step with times in [start_time, stop_time].'''
+        times = self.increments(step)[:, 1]
+        start = 0 if start_time is None else int(np.searchsorted(times, start_time, side='left'))
+        stop = len(times) if stop_time is None else int(np.searchsorted(times, stop_time, side='right'))
+        return slice(start, stop)
+
+    def read(
+            self, step: str, region: str, field: str, data_id: str = 'data',
+            frames: slice | None = None, components: list[str] | None = None
+        ) -> np.ndarray:
+        '''
+        Read a frame window and/or a subset of the components of a dataset, e.g.
+        reader.read('Step-1', 'SET-1', 'S', frames=slice(-10, None), components=['S11']).
+        Only the selected hyperslab is read from the file.
+        '''
+        dataset = self._file[step][region][field][data_id]
+        if data_id in output.INDEX_DATA_IDS: return dataset[()]
+        if frames is None: frames = slice(None)
+        if components is None: return dataset[frames]
+        labels = self.components(step, region, field)
+        columns = [labels.index(c) for c in components]
+        # Points of a hyperslab have to be selected in increasing order
+        order = np.argsort(columns)
+        selection = (frames, ) + (slice(None), )*(dataset.ndim - 2) + ([columns[i] for i in order], )
+        return dataset[selection][..., np.argsort(order)]
+
+    def keys(self) -> list[str]:
+        '''STEP|REGION|FIELD|DATA_ID keys of all datasets (and STEP|increments), as for the other output formats.'''
+        keys = []
+        for step in self.steps:
+            if 'increments' in self._file[step]: keys.append(output.KEY_SEP.join([step, 'increments']))
+            for region in self.regions(step):
+                for field in self.fields(step, region):
+                    group = self._file[step][region][field]
+                    keys += [output.KEY_SEP.join([step, region, field, data_id]) for data_id in group.keys()]
+                    if 'components' in group.attrs: keys.append(output.KEY_SEP.join([step, region, field, 'components']))
+        return keys
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        parts = key.split(output.KEY_SEP)
+        if parts[-1] == 'increments': return self.increments(parts[0])
+        if parts[-1] == 'components': return np.array(self.components(*parts[:3]))
+        return self.read(*parts)
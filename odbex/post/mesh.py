@@ -0,0 +1,72 @@
+"""
+Mesh geometry and connectivity exported by odbex.abqpy.geometry (see odbex.mesh.load_mesh), for spatial
+post-processing without reopening the odb.
+"""
+import pathlib
+
+import numpy as np
+from attrs import define, field
+
+from odbex.abqpy import geometry, output
+
+@define
+class InstanceMesh:
+    name: str
+    node_labels: np.ndarray
+    coordinates: np.ndarray
+    element_labels: np.ndarray
+    element_types: np.ndarray
+    offsets: np.ndarray
+    connectivity: np.ndarray
+    element_sets: dict[str, np.ndarray] = field(factory=dict)
+    node_sets: dict[str, np.ndarray] = field(factory=dict)
+
+    @property
+    def num_elements(self) -> int:
+        return len(self.element_labels)
+
+    def element_nodes(self, label: int) -> np.ndarray:
+        '''Node labels of an element.'''
+        i = int(np.flatnonzero(self.element_labels == label)[0])
+        return self.connectivity[self.offsets[i]:self.offsets[i + 1]]
+
+    def node_coordinates(self, labels: np.ndarray) -> np.ndarray:
+        '''Coordinates of nodes by label.'''
+        order = np.argsort(self.node_labels)
+        return self.coordinates[order[np.searchsorted(self.node_labels, labels, sorter=order)]]
+
+    def centroids(self) -> np.ndarray:
+        '''Centroids of the elements, in the order of element_labels.'''
+        return geometry.element_centroids(self.node_labels, self.coordinates, self.offsets, self.connectivity)
+
+@define
+class MeshData:
+    instances: dict[str, InstanceMesh] = field(factory=dict)
+
+    @classmethod
+    def open(cls, path: str | pathlib.Path) -> 'MeshData':
+        with np.load(path) as npz:
+            return cls.from_arrays({key: npz[key] for key in npz.files})
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> 'MeshData':
+        '''Mesh of INSTANCE|DATA_ID keyed arrays, as written by odbex.abqpy.geometry.'''
+        by_instance = {}
+        for key, array in arrays.items():
+            name, data_id = key.split(output.KEY_SEP, 1)
+            by_instance.setdefault(name, {})[data_id] = array
+        cls_ = cls()
+        for name, instance_arrays in by_instance.items():
+            sets = {}
+            for data_id, array in instance_arrays.items():
+                if output.KEY_SEP not in data_id: continue
+                set_type, set_name = data_id.split(output.KEY_SEP, 1)
+                sets.setdefault(set_type, {})[set_name] = array
+            # Type names exported by abaqus python 2 are byte strings, which load as bytes under Python 3
+            element_types = np.array(output.decode_labels(instance_arrays['elementTypes']), dtype=str)
+            cls_.instances[name] = InstanceMesh(
+                name, instance_arrays['nodeLabels'], instance_arrays['coordinates'], instance_arrays['elementLabels'],
+                element_types, instance_arrays['offsets'], instance_arrays['connectivity'],
+                sets.get(geometry.SET_DATA_IDS['element'], {}), sets.get(geometry.SET_DATA_IDS['node'], {}),
+            )
+        return cls_
@@ -1,17 +1,109 @@
+import collections
+import json
 import pathlib
 import orjson
 
 from attrs import define, field, evolve
 import numpy as np
 
+from odbex.abqpy import output
+from odbex.post.hdf5 import HDF5Reader
+
+DEFAULT_MAX_ARRAYS = 256
+
+class ArrayStore:
+    '''
+    STEP|REGION|FIELD|DATA_ID keyed arrays of an extracted output (.npz or .h5 file, streamed or consolidated directory),
+    read on first access. At most max_arrays arrays are kept in memory, evicting the least recently used.
+    '''
+
+    def __init__(self, path: pathlib.Path | None, max_arrays: int = DEFAULT_MAX_ARRAYS, arrays: dict[str, np.ndarray] | None = None):
+        self.path = None if path is None else pathlib.Path(path)
+        self.max_arrays = max_arrays
+        self._arrays = collections.OrderedDict()
+        if arrays is not None:
+            # Arrays already in memory (e.g., received from an extraction), which are kept whatever max_arrays
+            self.keys = list(arrays.keys())
+            self._load = arrays.__getitem__
+        elif self.path.joinpath(output.CONSOLIDATED_INDEX_FILENAME).exists():
+            # Views of memory-mapped arrays, only read when copied into memory
+            views = output.load_consolidated(str(self.path))
+            self.keys = list(views.keys())
+            self._load = lambda key: np.array(views[key])
+        elif self.path.suffix in ('.h5', '.hdf5'):
+            reader = HDF5Reader(self.path)
+            self.keys = reader.keys()
+            self._load = reader.__getitem__
+        elif self.path.joinpath(output.INDEX_FILENAME).exists():
+            with open(self.path.joinpath(output.INDEX_FILENAME), 'r') as f:
+                index = json.load(f)
+            self.keys = list(index.keys())
+            self._load = lambda key: np.load(self.path.joinpath(index[key]))
+        else:
+            # Members of an .npz are only decompressed (and delta decoded) when accessed
+            npz = output.NpzArrays(str(self.path))
+            self.keys = list(npz.files)
+            self._load = lambda key: npz[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._arrays or key in self.keys
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        if key in self._arrays:
+            self._arrays.move_to_end(key)
+            return self._arrays[key]
+        array = self._load(key)
+        self._arrays[key] = array
+        while len(self._arrays) > self.max_arrays:
+            self._arrays.popitem(last=False)
+        return array
+
+    @property
+    def resident(self) -> int:
+        return len(self._arrays)
+
 @define
 class FieldData:
     step: str
     region: str
     field: str
-    data: np.ndarray
-    std: np.ndarray
-    components: list[str] | None
+    _data: np.ndarray | None
+    _std: np.ndarray | None
+    _components: list[str] | None
+    _store: ArrayStore | None = field(default=None, repr=False, eq=False)
+
+    def _stored(self, data_id: str) -> np.ndarray | None:
+        key = output.KEY_SEP.join([self.step, self.region, self.field, data_id])
+        return self._store[key] if key in self._store else None
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None and self._store is not None: return self._stored('data')
+        return self._data
+
+    @property
+    def std(self) -> np.ndarray | None:
+        if self._std is None and self._store is not None: return self._stored('std')
+        return self._std
+
+    @property
+    def components(self) -> list[str] | None:
+        if self._components is None and self._store is not None:
+            components = self._stored('components')
+            return None if components is None else output.decode_labels(components)
+        return self._components
+
+    @property
+    def history(self) -> np.ndarray | None:
+        '''(increments, 2) time and value of a history output, at every increment it was written at.'''
+        return None if self._store is None else self._stored(output.HISTORY_DATA_ID)
+
+    @property
+    def indices(self) -> dict[str, np.ndarray]:
+        '''Element/node labels, integration points and section points of the rows of unaveraged data.'''
+        if self._store is None: return {}
+        indices = {data_id: self._stored(data_id) for data_id in output.INDEX_DATA_IDS}
+        return {data_id: index for data_id, index in indices.items() if index is not None}
 
     @classmethod
     def from_dict(cls, step: str, region: str, field: str, field_data_dict: dict[str, list]):
@@ -85,6 +177,35 @@ class SimulationData:
                 )})
             cls_.step_data.update({step: sd})
         return cls_
+
+    @classmethod
+    def open(cls, path: pathlib.Path, max_arrays: int = DEFAULT_MAX_ARRAYS):
+        '''
+        Open an extracted output (.npz or .h5 file, streamed or consolidated directory) lazily. Only the keys are indexed
+        up front; the data, std and components of a FieldData are read on first access, keeping at most max_arrays
+        arrays in memory.
+        '''
+        return cls._from_store(ArrayStore(path, max_arrays))
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]):
+        '''Simulation data of STEP|REGION|FIELD|DATA_ID keyed arrays already in memory, e.g. received from odbex.client.'''
+        return cls._from_store(ArrayStore(None, arrays=arrays))
+
+    @classmethod
+    def _from_store(cls, store: ArrayStore):
+        cls_ = cls()
+        for key in store.keys:
+            parts = key.split(output.KEY_SEP)
+            sd = cls_.step_data.setdefault(parts[0], StepData(parts[0], {}))
+            if parts[1:] == ['increments']:
+                sd.increments.update({int(frame_id): float(time) for frame_id, time in np.asarray(store[key])})
+                continue
+            step, region, field_name, _ = parts
+            rd = sd.region_data.setdefault(region, RegionData(region))
+            if field_name not in rd.field_data:
+                rd.field_data[field_name] = FieldData(step, region, field_name, None, None, None, store=store)
+        return cls_
     
     # Return a dictionary of the increments associated with the field data
     def get_increments(self, step: str) -> dict[int, float]:
@@ -5,5 +5,6 @@ setup(
     description="Abaqus .odb data extractor",
     verison="3.0.1",
     packages=find_packages(),
-    install_requires=['numpy', 'orjson', 'attrs']
+    install_requires=['numpy', 'orjson', 'attrs'],
+    extras_require={'hdf5': ['h5py']}
 )
\ No newline at end of file